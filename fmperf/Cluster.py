@@ -1,9 +1,13 @@
 import hashlib
 import json
 import typing
-from typing import Union
+from typing import List, Union
 import os
+import threading
+import time
+import uuid
 from datetime import datetime
+from durations import Duration
 
 import pandas as pd
 from kubernetes import client
@@ -11,13 +15,44 @@ from kubernetes import client
 from fmperf.ModelSpecs import ModelSpec, TGISModelSpec, vLLMModelSpec
 from fmperf.StackSpec import StackSpec
 from fmperf.DeployedModel import DeployedModel
-from fmperf.utils import Creating, Deleting, Waiting, make_logger
+from fmperf.utils import (
+    Creating,
+    Deleting,
+    Fetching,
+    Streaming,
+    Waiting,
+    make_logger,
+)
+from fmperf.loadgen.shards import get_shard_filename, merge_shards
 from fmperf.WorkloadSpecs import (
     WorkloadSpec,
     GuideLLMWorkloadSpec,
     LMBenchmarkWorkload,
     HomogeneousWorkloadSpec,
     HeterogeneousWorkloadSpec,
+    TraceReplayWorkloadSpec,
+)
+
+# labels and annotations through which deployments are reused (see Cluster.deploy_model)
+MANIFEST_HASH_LABEL = "fmperf/manifest-hash"
+LAST_USED_ANNOTATION = "fmperf/last-used"
+IDLE_TTL_ANNOTATION = "fmperf/idle-ttl"
+# the Cluster object currently benchmarking a deployment
+IN_USE_ANNOTATION = "fmperf/in-use-by"
+# longest interval (in seconds) between refreshes of LAST_USED_ANNOTATION
+# while a reused deployment is in use
+HEARTBEAT_INTERVAL = 60.0
+# a deployment marked as in use is free again once its heartbeat is older
+# than this (e.g. after its user crashed)
+IN_USE_LEASE = 3 * HEARTBEAT_INTERVAL
+
+# WorkloadSpec attributes which do not influence the generated requests
+WORKLOAD_NON_CONTENT_FIELDS = (
+    "image",
+    "pvc_name",
+    "overwrite",
+    "parallelism",
+    "time_scale",
 )
 
 
@@ -30,12 +65,41 @@ class GeneratedWorkload:
 
 class Cluster:
     def __init__(
-        self, name: str, apiclient: client.ApiClient, namespace: str = "default"
+        self,
+        name: str,
+        apiclient: client.ApiClient,
+        namespace: str = "default",
+        reuse_deployments: bool = False,
+        idle_ttl: str = "30m",
+        results_in_log: bool = True,
     ):
+        """
+        With `reuse_deployments`, a healthy model deployment rendered from an
+        identical manifest is adopted rather than created again, and
+        delete_model keeps deployments around until they have been idle for
+        `idle_ttl`.
+
+        Evaluation results are fetched from the workload volume through a
+        pod exec. With `results_in_log`, the load generator also prints its
+        results to the pod log, which is read whenever fetching fails (e.g.
+        where exec is not permitted); turning it off keeps large results out
+        of the logs, at the cost of that fallback.
+        """
         self.name = name
         self.apiclient = apiclient
         self.namespace = namespace
         self.logger = make_logger(self.name)
+        self.reuse_deployments = reuse_deployments
+        self.idle_ttl = idle_ttl
+        self.results_in_log = results_in_log
+        # deployments currently benchmarked through this object, which may be
+        # shared by the threads of run_benchmark; guarded by in_use_lock
+        self.in_use = set()
+        self.in_use_lock = threading.Lock()
+        # (stop event, thread) of the threads refreshing the deployments in use
+        self.heartbeats = {}
+        # identifies this object in IN_USE_ANNOTATION
+        self.owner = uuid.uuid4().hex
 
         self.security_context = {
             "allowPrivilegeEscalation": False,
@@ -50,6 +114,127 @@ class Cluster:
     def apigetter(self):
         return self.apiclient
 
+    def __get_manifest_hash(self, manifest) -> str:
+        # the pod template covers env, command, args, image, resources and
+        # volumes, but not the deployment name (which contains the id)
+        s = json.dumps(manifest["spec"]["template"]["spec"], sort_keys=True)
+        return hashlib.sha256(s.encode("utf-8")).hexdigest()[:32]
+
+    def __touch_deployment(self, name, in_use=True, resource_version=None):
+        """
+        Refresh the last-used time of a deployment and mark it as used by this
+        object (or no longer used by anyone). With `resource_version`, the
+        patch fails with 409 Conflict if the deployment has changed since.
+        """
+        metadata = {
+            "annotations": {
+                LAST_USED_ANNOTATION: str(int(time.time())),
+                IDLE_TTL_ANNOTATION: str(int(Duration(self.idle_ttl).to_seconds())),
+                IN_USE_ANNOTATION: self.owner if in_use else None,
+            }
+        }
+        if resource_version is not None:
+            metadata["resourceVersion"] = resource_version
+        client.AppsV1Api(self.apiclient).patch_namespaced_deployment(
+            name, self.namespace, {"metadata": metadata}
+        )
+
+    def __start_heartbeat(self, name):
+        """
+        Keep refreshing LAST_USED_ANNOTATION of a deployment until
+        __stop_heartbeat, so that reap_idle_models of other processes does
+        not delete it during a benchmark longer than the idle TTL.
+        """
+        interval = min(Duration(self.idle_ttl).to_seconds() / 3, HEARTBEAT_INTERVAL)
+        stop = threading.Event()
+
+        def heartbeat():
+            while not stop.wait(interval):
+                try:
+                    self.__touch_deployment(name)
+                except Exception as e:
+                    # keep beating; a missed refresh is made up by the next
+                    self.logger.warning(
+                        "failed to refresh deployment %s: %s" % (name, e)
+                    )
+
+        thread = threading.Thread(target=heartbeat, daemon=True)
+        with self.in_use_lock:
+            self.heartbeats[name] = (stop, thread)
+        thread.start()
+
+    def __stop_heartbeat(self, name):
+        with self.in_use_lock:
+            stop, thread = self.heartbeats.pop(name, (None, None))
+        if stop is not None:
+            stop.set()
+            # a refresh still in flight must not mark the deployment in use again
+            thread.join()
+
+    def __is_used_elsewhere(self, deployment, now):
+        annotations = deployment.metadata.annotations or {}
+        if annotations.get(IN_USE_ANNOTATION) in (None, self.owner):
+            return False
+        last_used = float(annotations.get(LAST_USED_ANNOTATION, 0))
+        return now - last_used <= IN_USE_LEASE
+
+    def __find_deployment(self, manifest_hash):
+        """
+        Claim a healthy deployment with the given manifest hash which is not
+        in use (by this or any other process) and return its name. Must be
+        called with in_use_lock held.
+        """
+        deployments = client.AppsV1Api(self.apiclient).list_namespaced_deployment(
+            self.namespace, label_selector=f"{MANIFEST_HASH_LABEL}={manifest_hash}"
+        )
+        now = time.time()
+        for x in deployments.items:
+            if x.metadata.deletion_timestamp is not None:
+                continue
+            if x.metadata.name in self.in_use or self.__is_used_elsewhere(x, now):
+                continue
+            if (x.status.available_replicas or 0) < (x.spec.replicas or 1):
+                continue
+            try:
+                # fails if another process has claimed it since the list
+                self.__touch_deployment(
+                    x.metadata.name, resource_version=x.metadata.resource_version
+                )
+            except client.exceptions.ApiException as e:
+                if e.status == 409:
+                    continue
+                raise
+            return x.metadata.name
+        return None
+
+    def reap_idle_models(self):
+        """Delete reused model deployments which have been idle for longer than their TTL."""
+        deployments = client.AppsV1Api(self.apiclient).list_namespaced_deployment(
+            self.namespace, label_selector=MANIFEST_HASH_LABEL
+        )
+        now = time.time()
+        with self.in_use_lock:
+            in_use = set(self.in_use)
+        for x in deployments.items:
+            annotations = x.metadata.annotations or {}
+            if (
+                x.metadata.name in in_use
+                or LAST_USED_ANNOTATION not in annotations
+                or self.__is_used_elsewhere(x, now)
+            ):
+                continue
+            last_used = float(annotations[LAST_USED_ANNOTATION])
+            ttl = float(annotations.get(IDLE_TTL_ANNOTATION, 0))
+            if now - last_used > ttl:
+                self.logger.info(
+                    "deployment %s idle for %d seconds"
+                    % (x.metadata.name, now - last_used)
+                )
+                self.delete_model(
+                    DeployedModel(spec=None, name=x.metadata.name, url=None),
+                    keep=False,
+                )
+
     def deploy_model(
         self,
         model: ModelSpec,
@@ -98,7 +283,7 @@ class Cluster:
         else:
             raise TypeError("Unrecognized ModelSpec")
 
-        manifest = {
+        deployment_manifest = {
             "apiVersion": "apps/v1",
             "kind": "Deployment",
             "metadata": {
@@ -159,10 +344,28 @@ class Cluster:
             },
         }
 
-        # create deployment
-        creating.create_namespaced_deployment(
-            name=name, namespace=self.namespace, payload=manifest
-        )
+        manifest_hash = self.__get_manifest_hash(deployment_manifest)
+        deployment_manifest["metadata"]["labels"][MANIFEST_HASH_LABEL] = manifest_hash
+
+        existing = None
+        if self.reuse_deployments:
+            # claim the deployment before another thread can adopt it
+            with self.in_use_lock:
+                existing = self.__find_deployment(manifest_hash)
+                self.in_use.add(existing or name)
+        if existing is not None:
+            # adopt the warm deployment (and its service) instead of creating a new one
+            self.logger.info("reusing deployment %s for %s" % (existing, name))
+            name = existing
+        else:
+            # create deployment
+            creating.create_namespaced_deployment(
+                name=name, namespace=self.namespace, payload=deployment_manifest
+            )
+
+        if self.reuse_deployments:
+            self.__touch_deployment(name)
+            self.__start_heartbeat(name)
 
         # define service
         manifest = {
@@ -207,7 +410,23 @@ class Cluster:
             url=url,
         )
 
-    def delete_model(self, model: DeployedModel):
+    def delete_model(self, model: DeployedModel, keep: bool = None):
+        """
+        Delete a model deployment and its service. When deployments are reused
+        (and `keep` is not False) the deployment is only marked as idle and
+        deleted by reap_idle_models once its idle TTL has passed.
+        """
+        if keep is None:
+            keep = self.reuse_deployments
+        self.__stop_heartbeat(model.name)
+        with self.in_use_lock:
+            self.in_use.discard(model.name)
+
+        if keep:
+            self.__touch_deployment(model.name, in_use=False)
+            self.reap_idle_models()
+            return
+
         deleting = Deleting(self.apigetter, self.logger)
         deleting.delete_namespaced_service(
             name=model.name, namespace=self.namespace, wait=False
@@ -257,9 +476,19 @@ class Cluster:
             outfile = filename
         else:
             # creating a unique ID for the workload file using hash of
-            # both model spec and workload spec
+            # both model spec and workload spec; fields which do not affect
+            # the generated requests are left out so that equivalent specs
+            # map onto the same file (generate-input additionally keeps a
+            # content-addressed cache on the volume, see workload_cache.py)
             s1 = json.dumps(model_spec.__dict__, sort_keys=True)
-            s2 = json.dumps(workload.__dict__, sort_keys=True)
+            s2 = json.dumps(
+                {
+                    k: v
+                    for k, v in workload.__dict__.items()
+                    if k not in WORKLOAD_NON_CONTENT_FIELDS
+                },
+                sort_keys=True,
+            )
             hash = hashlib.md5((s1 + s2).encode("utf-8")).hexdigest()
             outfile = "workload-%s.json" % (hash)
 
@@ -322,8 +551,9 @@ class Cluster:
             volumes = []
             volume_mounts = []
         else:
-            volumes = model.spec.volumes
-            volume_mounts = model.spec.volume_mounts
+            # copies, so that the model spec (and its manifest hash) is left untouched
+            volumes = list(model.spec.volumes)
+            volume_mounts = list(model.spec.volume_mounts)
 
         if workload.pvc_name is None:
             volumes.append(
@@ -395,11 +625,31 @@ class Cluster:
             ]
         return []
 
+    def __read_results_from_log(self, streaming, pod_name):
+        # Take the last line of the pod's log stream
+        tail = streaming.tail(pod_name)
+        if tail:
+            pod_log_response = tail[-1]
+        else:
+            self.logger.warning(f"No log stream of {pod_name}")
+            # Fallback to reading directly from the pod
+            pod_log_response = client.CoreV1Api(self.apiclient).read_namespaced_pod_log(
+                name=pod_name, namespace=self.namespace, tail_lines=1
+            )
+
+        trimmed_response = pod_log_response.rstrip("\n").split("\n")[-1]
+        try:
+            return json.loads(trimmed_response)
+        except Exception as e:
+            print("Failed to parse logs [check pod_log_responses.txt]")
+            print(e)
+            return None
+
     def evaluate(
         self,
         model: Union[DeployedModel, StackSpec],
         workload: GeneratedWorkload,
-        num_users: int = 1,
+        num_users: Union[int, List[int]] = 1,
         duration: str = "10s",
         backoff: str = "3s",
         grace_period: str = "10s",
@@ -409,10 +659,26 @@ class Cluster:
         metric_list: str = None,
         id: str = "",
         delete_job: bool = False,  # When True, deletes the job and its logs after evaluation
+        parallelism: int = 1,  # number of load generator pods (Indexed Job) sharing the users
     ):
         # type of service: vllm/tgis
         target = workload.target
 
+        # a list of numbers of users is run as a sweep within a single job
+        sweep_users = num_users if isinstance(num_users, list) else None
+        if sweep_users is not None:
+            num_users = sweep_users[0]
+
+        if parallelism > 1:
+            if isinstance(workload.spec, (GuideLLMWorkloadSpec, LMBenchmarkWorkload)):
+                raise ValueError(
+                    "parallelism is only supported for workloads run by fmperf.loadgen.run"
+                )
+            if workload.spec.pvc_name is None:
+                raise ValueError(
+                    "parallelism > 1 requires a shared volume (set pvc_name of the workload spec)"
+                )
+
         # get volumes
         volumes, volume_mounts = self.__get_volumes_workload(None, workload.spec)
 
@@ -503,6 +769,10 @@ class Cluster:
                 {"name": "NAMESPACE", "value": self.namespace},
                 {"name": "WORKLOAD_DIR", "value": "/requests"},
                 {"name": "NUM_PROM_STEPS", "value": str(num_prom_steps)},
+                {"name": "NUM_SHARDS", "value": str(parallelism)},
+                {"name": "RESULTS_ALL_FILENAME", "value": f"fmperf-results-{id}.json"},
+                # names the barrier files through which the shards synchronise
+                {"name": "FMPERF_RUN_ID", "value": uuid.uuid4().hex},
             ]
 
             if prom_url is not None:
@@ -514,11 +784,34 @@ class Cluster:
             if metric_list is not None:
                 env.append({"name": "TARGET_METRICS_LIST", "value": metric_list})
 
+            if isinstance(workload.spec, TraceReplayWorkloadSpec):
+                env.append({"name": "REPLAY", "value": "true"})
+                env.append(
+                    {"name": "TIME_SCALE", "value": str(workload.spec.time_scale)}
+                )
+
             job_name = f"fmperf-evaluate{'-'+id if id else ''}"
             container_name = "fmaas-perf"
-            container_args = [
-                f"python -m fmperf.loadgen.run; cat /requests/fmperf-results-{id}.json"
-            ]
+            results_file = f"/requests/fmperf-results-{id}.json"
+            if parallelism > 1:
+                results_file = get_shard_filename(
+                    results_file, "${JOB_COMPLETION_INDEX}"
+                )
+            if sweep_users is not None:
+                env.append(
+                    {
+                        "name": "SWEEP_USERS",
+                        "value": ",".join(str(u) for u in sweep_users),
+                    }
+                )
+                entrypoint = "fmperf.loadgen.sweep"
+            else:
+                entrypoint = "fmperf.loadgen.run"
+            if self.results_in_log:
+                container_args = [f"python -m {entrypoint}; cat {results_file}"]
+            else:
+                # the log only carries the checksum of the results
+                container_args = [f"python -m {entrypoint}"]
 
         manifest = {
             "apiVersion": "batch/v1",
@@ -530,7 +823,9 @@ class Cluster:
             "spec": {
                 "template": {
                     "spec": {
-                        "serviceAccountName": workload.spec.service_account
+                        "serviceAccountName": getattr(
+                            workload.spec, "service_account", None
+                        )
                         or "vllm-router-service-account",
                         "initContainers": [
                             {
@@ -570,40 +865,34 @@ class Cluster:
             },
         }
 
+        if parallelism > 1:
+            # every pod gets its shard index as JOB_COMPLETION_INDEX
+            manifest["spec"]["completionMode"] = "Indexed"
+            manifest["spec"]["completions"] = parallelism
+            manifest["spec"]["parallelism"] = parallelism
+
         client.BatchV1Api(self.apiclient).create_namespaced_job(
             self.namespace, manifest
         )
 
-        # Create logs directory if it doesn't exist
+        # Stream the logs of the load generator and of the deployed stacks
+        # into logs/<job name>/<pod name>.log.gz while the job runs
         logs_dir = os.path.join(os.getcwd(), "logs")
-        os.makedirs(logs_dir, exist_ok=True)
-
-        # Start logging pod logs from other deployed stacks
-        logs_script = os.path.join(
-            os.path.dirname(os.path.dirname(__file__)), "scripts", "logs.sh"
+        # results printed to the log are a single line of any length
+        streaming = Streaming(
+            self.apigetter,
+            self.logger,
+            os.path.join(logs_dir, job_name),
+            max_line_length=None if self.results_in_log else 1 << 20,
         )
-        if os.path.exists(logs_script):
-            import subprocess
-
-            try:
-                # Get label key and value from environment variables with defaults
-                label_key = os.environ.get("FMPERF_LABEL_KEY", "app")
-                label_value = os.environ.get("FMPERF_LABEL_VALUE", "vllm-llama-3-70b")
-
-                # Start logs.sh in background with job name and labels
-                subprocess.Popen(
-                    [
-                        logs_script,
-                        f"--job={job_name}",
-                        f"--label-key={label_key}",
-                        f"--label-value={label_value}",
-                        "--background",
-                    ],
-                    stdout=subprocess.DEVNULL,
-                    stderr=subprocess.DEVNULL,
-                )
-            except Exception as e:
-                self.logger.warning(f"Failed to start pod logging: {e}")
+        label_key = os.environ.get("FMPERF_LABEL_KEY", "app")
+        label_value = os.environ.get("FMPERF_LABEL_VALUE", "vllm-llama-3-70b")
+        for label_selector in [
+            f"job-name={job_name}",
+            f"{label_key}={label_value}",
+            "app=endpoint-picker",
+        ]:
+            streaming.follow_selector(self.namespace, label_selector)
 
         waiting = Waiting(self.apigetter, self.logger)
         deleting = Deleting(self.apigetter, self.logger)
@@ -622,35 +911,87 @@ class Cluster:
             timeout_seconds=10,
         )
 
-        pod_name = pods_list.items[0].metadata.name
+        # order the pods by shard
+        pods = sorted(
+            pods_list.items,
+            key=lambda x: int(
+                (x.metadata.annotations or {}).get(
+                    "batch.kubernetes.io/job-completion-index", 0
+                )
+            ),
+        )
 
-        # Process performance and energy data only for HomogeneousWorkloadSpec and HeterogeneousWorkloadSpec
+        # Process performance and energy data only for the workloads run by fmperf.loadgen.run
         if isinstance(
-            workload.spec, (HomogeneousWorkloadSpec, HeterogeneousWorkloadSpec)
+            workload.spec,
+            (
+                HomogeneousWorkloadSpec,
+                HeterogeneousWorkloadSpec,
+                TraceReplayWorkloadSpec,
+            ),
         ):
-            # Read the pod logs from the file that was being written in the background
-            log_file = os.path.join(logs_dir, job_name, f"{pod_name}.txt")
+            # fetch the results from the workload volume; the last line of the
+            # pod log (which carries a copy of the results with results_in_log)
+            # is only a fallback. The fetch pod of a previous repetition of
+            # this id may still be terminating, so its name is unique.
+            fetching = Fetching(self.apigetter, self.logger)
             try:
-                with open(log_file, "r") as f:
-                    pod_log_response = f.read()
+                results_file = f"/requests/fmperf-results-{id}.json"
+                if parallelism > 1:
+                    paths = [
+                        get_shard_filename(results_file, i) for i in range(parallelism)
+                    ]
+                else:
+                    paths = [results_file]
+                outs = fetching.fetch_results(
+                    f"fmperf-fetch{'-'+id if id else ''}-{uuid.uuid4().hex[:8]}",
+                    self.namespace,
+                    paths,
+                    workload.spec.image,
+                    volumes,
+                    volume_mounts,
+                    node_name=pods[0].spec.node_name,
+                    security_context=self.security_context,
+                )
             except Exception as e:
-                self.logger.warning(f"Failed to read pod logs from file: {e}")
-                # Fallback to reading directly from the pod if file reading fails
-                pod_log_response = client.CoreV1Api(
-                    self.apiclient
-                ).read_namespaced_pod_log(name=pod_name, namespace=self.namespace)
-
-            trimmed_response = pod_log_response.split("\n")[-1]
-            try:
-                out = json.loads(trimmed_response)
+                self.logger.warning(
+                    f"Failed to fetch results from the workload volume: {e}"
+                )
+                if self.results_in_log:
+                    outs = [
+                        self.__read_results_from_log(streaming, x.metadata.name)
+                        for x in pods
+                    ]
+                else:
+                    self.logger.warning(
+                        "Results are not in the pod logs either, "
+                        "as results_in_log is off"
+                    )
+                    outs = [None]
+
+            out = None if None in outs else merge_shards(outs)
+
+            if out is not None:
                 perf_out, energy_out = out["results"], out["energy"]
-            except Exception as e:
-                print("Failed to parse logs [check pod_log_responses.txt]")
-                print(e)
+                # a single run returns its energy summary, a sweep one per point
+                if sweep_users is None:
+                    energy_out = energy_out[0] if energy_out else {}
+                # latencies measured by a saturated client are biased
+                for overhead in out["client_overhead"]:
+                    for warning in overhead["warnings"]:
+                        self.logger.warning(
+                            f"load generator may be saturated: {warning}"
+                        )
+            else:
                 perf_out, energy_out = None, None
         else:
             perf_out, energy_out = None, None
 
+        # keep collecting the logs of the stacks for a while if requested
+        streaming.stop(
+            Duration(os.environ.get("FMPERF_LOG_GRACE_PERIOD", "0s")).to_seconds()
+        )
+
         if delete_job:
             deleting.delete_namespaced_job(job_name, self.namespace)
 
@@ -2,7 +2,7 @@ import yaml
 import os
 import json
 from typing import Union
-from fmperf.Cluster import DeployedModel
+from fmperf.DeployedModel import DeployedModel
 from fmperf.StackSpec import StackSpec
 
 
@@ -14,12 +14,18 @@ class WorkloadSpec:
         pvc_name: str = None,
         overwrite: bool = False,
         code: bool = False,
+        parallelism: int = 8,
+        offline: bool = False,
+        tokenizer: str = None,
     ):
         self.sample_size = sample_size
         self.image = image
         self.pvc_name = pvc_name
         self.overwrite = overwrite
         self.code = code
+        self.parallelism = parallelism
+        self.offline = offline
+        self.tokenizer = tokenizer
 
     @classmethod
     def from_yaml(cls, file: str):
@@ -64,11 +70,22 @@ class WorkloadSpec:
                 "name": "CODE",
                 "value": str(self.code),
             },
+            {
+                "name": "PARALLELISM",
+                "value": str(self.parallelism),
+            },
+            {
+                "name": "OFFLINE",
+                "value": str(self.offline),
+            },
             {"name": "REQUESTS_FILENAME", "value": outfile},
             {"name": "WORKLOAD_DIR", "value": "/requests"},
             {"name": "HF_HOME", "value": "/tmp/hf_cache"},
         ]
 
+        if self.tokenizer:
+            env.append({"name": "TOKENIZER", "value": self.tokenizer})
+
         # Add Hugging Face token if available in the environment
         hf_token = (
             os.environ.get("HF_TOKEN")
@@ -94,13 +111,18 @@ class HomogeneousWorkloadSpec(WorkloadSpec):
         overwrite: bool = False,
         code: bool = False,
         model_name: str = None,
+        parallelism: int = 8,
+        offline: bool = False,
+        tokenizer: str = None,
     ):
         self.input_tokens = input_tokens
         self.output_tokens = output_tokens
         self.greedy = greedy
         self.model_name = model_name
 
-        super().__init__(1, image, pvc_name, overwrite, code)
+        super().__init__(
+            1, image, pvc_name, overwrite, code, parallelism, offline, tokenizer
+        )
 
     @classmethod
     def from_yaml(cls, file: str):
@@ -161,6 +183,9 @@ class HeterogeneousWorkloadSpec(WorkloadSpec):
         overwrite: bool = False,
         code: bool = False,
         model_name: str = None,
+        parallelism: int = 8,
+        offline: bool = False,
+        tokenizer: str = None,
     ):
         self.min_input_tokens = min_input_tokens
         self.max_input_tokens = max_input_tokens
@@ -168,7 +193,16 @@ class HeterogeneousWorkloadSpec(WorkloadSpec):
         self.max_output_tokens = max_output_tokens
         self.frac_greedy = frac_greedy
         self.model_name = model_name
-        super().__init__(sample_size, image, pvc_name, overwrite, code)
+        super().__init__(
+            sample_size,
+            image,
+            pvc_name,
+            overwrite,
+            code,
+            parallelism,
+            offline,
+            tokenizer,
+        )
 
     @classmethod
     def from_yaml(cls, file: str):
@@ -223,8 +257,26 @@ class RealisticWorkloadSpec(WorkloadSpec):
         pvc_name: str = None,
         overwrite: bool = False,
         code: bool = False,
+        parallelism: int = 8,
+        offline: bool = False,
+        tokenizer: str = None,
+        where: dict = None,
+        stratify: str = None,
+        model_file: str = None,
     ):
-        super().__init__(sample_size, image, pvc_name, overwrite, code)
+        self.where = where
+        self.stratify = stratify
+        self.model_file = model_file
+        super().__init__(
+            sample_size,
+            image,
+            pvc_name,
+            overwrite,
+            code,
+            parallelism,
+            offline,
+            tokenizer,
+        )
 
     @classmethod
     def from_yaml(cls, file: str):
@@ -233,6 +285,75 @@ class RealisticWorkloadSpec(WorkloadSpec):
     def get_args(self):
         return ["python -m fmperf.loadgen.generate-input --from-model"]
 
+    def get_env(
+        self,
+        target: str,
+        model: Union["DeployedModel", "StackSpec"],
+        outfile: str,
+    ):
+        env = super().get_env(target, model, outfile)
+        if self.where:
+            env.append({"name": "REQUESTS_WHERE", "value": json.dumps(self.where)})
+        if self.stratify:
+            env.append({"name": "REQUESTS_STRATIFY", "value": self.stratify})
+        if self.model_file:
+            env.append({"name": "REQUESTS_MODEL_FILE", "value": self.model_file})
+        return env
+
+
+class TraceReplayWorkloadSpec(WorkloadSpec):
+    def __init__(
+        self,
+        trace_file: str,
+        time_scale: float = 1.0,
+        max_requests: int = 0,
+        image: str = "quay.io/fmperf/fmperf:main",
+        pvc_name: str = None,
+        overwrite: bool = False,
+        code: bool = False,
+        parallelism: int = 8,
+        offline: bool = False,
+        tokenizer: str = None,
+    ):
+        """
+        Replay the requests of a timestamped trace (CSV or JSON lines with the
+        columns arrival_time, input_tokens, output_tokens and optionally
+        is_greedy, temperature, top_k, top_p) at their recorded arrival
+        times. `trace_file` is the path of the trace inside the container
+        (e.g. on the requests volume), arrival times are multiplied by
+        `time_scale` during replay and `max_requests=0` replays the whole
+        trace.
+        """
+        self.trace_file = trace_file
+        self.time_scale = time_scale
+        super().__init__(
+            max_requests,
+            image,
+            pvc_name,
+            overwrite,
+            code,
+            parallelism,
+            offline,
+            tokenizer,
+        )
+
+    @classmethod
+    def from_yaml(cls, file: str):
+        return super().from_yaml(file)
+
+    def get_args(self):
+        return ["python -m fmperf.loadgen.generate-input --from-trace"]
+
+    def get_env(
+        self,
+        target: str,
+        model: Union["DeployedModel", "StackSpec"],
+        outfile: str,
+    ):
+        return super().get_env(target, model, outfile) + [
+            {"name": "TRACE_FILE", "value": self.trace_file},
+        ]
+
 
 class GuideLLMWorkloadSpec(WorkloadSpec):
     def __init__(
@@ -1,10 +1,36 @@
-from fmperf.ModelSpecs import TGISModelSpec, vLLMModelSpec
-from fmperf.Cluster import Cluster, WorkloadSpec
-from fmperf.DeployedModel import DeployedModel
-from fmperf.WorkloadSpecs import (
-    HeterogeneousWorkloadSpec,
-    HomogeneousWorkloadSpec,
-    RealisticWorkloadSpec,
-    GuideLLMWorkloadSpec,
-    LMBenchmarkWorkload,
+from typing import TYPE_CHECKING
+
+from fmperf.utils.lazy import make_lazy
+
+# the specs pull in kubernetes and pandas, which the load generator does not
+# need, so they are only imported when first used
+make_lazy(
+    __name__,
+    {
+        "TGISModelSpec": "ModelSpecs",
+        "vLLMModelSpec": "ModelSpecs",
+        "Cluster": "Cluster",
+        "WorkloadSpec": "WorkloadSpecs",
+        "DeployedModel": "DeployedModel",
+        "HeterogeneousWorkloadSpec": "WorkloadSpecs",
+        "HomogeneousWorkloadSpec": "WorkloadSpecs",
+        "RealisticWorkloadSpec": "WorkloadSpecs",
+        "TraceReplayWorkloadSpec": "WorkloadSpecs",
+        "GuideLLMWorkloadSpec": "WorkloadSpecs",
+        "LMBenchmarkWorkload": "WorkloadSpecs",
+    },
 )
+
+if TYPE_CHECKING:
+    from fmperf.ModelSpecs import TGISModelSpec, vLLMModelSpec
+    from fmperf.Cluster import Cluster
+    from fmperf.DeployedModel import DeployedModel
+    from fmperf.WorkloadSpecs import (
+        WorkloadSpec,
+        HeterogeneousWorkloadSpec,
+        HomogeneousWorkloadSpec,
+        RealisticWorkloadSpec,
+        TraceReplayWorkloadSpec,
+        GuideLLMWorkloadSpec,
+        LMBenchmarkWorkload,
+    )
@@ -1,118 +1,110 @@
 import argparse
 import requests
 import datetime
+import functools
+import concurrent.futures
+import numpy as np
 import pandas as pd
 import urllib3
 import yaml
 import os
 import re
+from requests.adapters import HTTPAdapter
 from urllib3.exceptions import InsecureRequestWarning
+from urllib3.util.retry import Retry
+from durations import Duration
+from .metric_store import MetricSeries, MetricStore
 
 urllib3.disable_warnings(InsecureRequestWarning)
 
+POWER_METRIC = "DCGM_FI_DEV_POWER_USAGE"
+
 metrics = [
-    "DCGM_FI_DEV_POWER_USAGE",
+    POWER_METRIC,
     "kepler_container_gpu_joules_total",
     "kepler_container_package_joules_total",
     "kepler_container_dram_joules_total",
 ]
 
 
-class MetricData:
-    def __init__(self, metric: str, start: str, end: str, pod: str, data: {}):
-        try:
-            if metric == "":
-                raise Exception("No metric name")
+# Prometheus refuses range queries that return more than 11000 points per series
+MAX_POINTS_PER_QUERY = 11000
 
-            self.metric = metric
-            self.data = data
-            # Check the format of timestamps
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
 
-            start_date = start.split("T")
-            time_arr = start_date[1].split(":")
-            self.start = "{}_{}-{}-{}".format(
-                start_date[0], time_arr[0], time_arr[1], time_arr[2]
-            )
 
-            end_date = end.split("T")
-            etime_arr = end_date[1].split(":")
-            self.end = "{}_{}-{}-{}".format(
-                end_date[0], etime_arr[0], etime_arr[1], etime_arr[2]
-            )
+# pooled session shared by all queries, retrying transient failures with backoff
+@functools.lru_cache(maxsize=None)
+def get_session():
+    session = requests.Session()
+    retries = Retry(
+        total=int(os.environ.get("PROM_RETRIES", 3)),
+        backoff_factor=0.5,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=("GET",),
+    )
+    adapter = HTTPAdapter(max_retries=retries, pool_maxsize=32)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.verify = False
 
-            if len(pod) > 0:
-                if "kepler" in metric:
-                    self.pod = pod["pod_name"]
-                else:
-                    self.pod = pod["exported_pod"]
-            else:
-                self.pod = ""
-
-        except AttributeError as e:
-            print("catch AttributeError: ", e)
-        except TypeError as e:
-            print("catch TypeError: ", e)
-        except KeyError as e:
-            print("catch KeyError:", e)
-        except IndexError as e:
-            print("catch IndexError: {}, may fail to parse timestamps".format(e))
-        except Exception as e:
-            print("catch Exception: ", e)
-
-
-# query the specified metrics to Prometheus between the given start and end timestamps
-def get_prom_results(uri, metric, query, step, start, end):
-    metric_data = None
-    if uri is None or uri == "":
-        raise Exception("PROM_URL: {}".format(uri))
+    # generate header if PROM_TOKEN exists
+    access_token = os.environ.get("PROM_TOKEN")
+    if access_token:
+        session.headers["Authorization"] = "Bearer {}".format(access_token)
 
-    try:
-        access_token = os.environ.get("PROM_TOKEN")
-        # start_unix = datetime.datetime.strptime(start, "%Y-%m-%dT%H:%M:%SZ")
-        # end_unix = datetime.datetime.strptime(end, "%Y-%m-%dT%H:%M:%SZ")
-        params = {"query": query, "start": start, "end": end, "step": step}
-
-        # generate header if PROM_TOKEN exists
-        if access_token:
-            headers = {"Authorization": "Bearer {}".format(access_token)}
-        else:
-            headers = None
-
-        # print(uri, headers)
-        # send a request
-        response = requests.get(uri, verify=False, headers=headers, params=params)
-        response.raise_for_status()
-        # parse a response
-        json_data = response.json()
-        if len(json_data["data"]["result"]) > 0:
-            # print(json_data["data"]["result"][0]["metric"])
-            pod = json_data["data"]["result"][0]["metric"]
-            values = json_data["data"]["result"][0]["values"]
-            metric_data = MetricData(metric, start, end, pod, values)
-            # print(metric_data)
-        else:
-            metric_data = MetricData(metric, start, end, "", {})
-
-    except requests.exceptions.HTTPError as e:
-        print("catch HTTPError: ", e)
-    except KeyError as e:
-        print("catch KeyError: ", e)
-    except Exception as e:
-        print("catch Exception: ", e)
-    return metric_data
+    return session
 
 
-# Export energy data to csv file
-def write_to_file(data: MetricData):
+# step of a range query in seconds; plain numbers are seconds as in Prometheus
+def get_step_seconds(step) -> float:
     try:
-        num_users = os.environ["NUM_USERS"]
-        path = os.environ.get("METRICS_DIR", "/requests")
-        filename = "{}/{}_{}_{}.csv".format(path, num_users, data.start, data.metric)
-        df = pd.DataFrame(data.data)
-        # print(df)
-        df.to_csv(filename, header=["timestamp", data.metric], index=False)
-    except Exception as e:
-        print("catch Exception: ", e)
+        return float(step)
+    except ValueError:
+        return Duration(step).to_seconds()
+
+
+def get_unix_time(ts: str) -> float:
+    t = datetime.datetime.strptime(ts, TIMESTAMP_FORMAT)
+    return t.replace(tzinfo=datetime.timezone.utc).timestamp()
+
+
+# split [start, end] into windows that stay below the points limit of Prometheus
+def get_query_windows(start: str, end: str, step):
+    step_s = get_step_seconds(step)
+    t_start = datetime.datetime.strptime(start, TIMESTAMP_FORMAT)
+    t_end = datetime.datetime.strptime(end, TIMESTAMP_FORMAT)
+    window = datetime.timedelta(seconds=step_s * (MAX_POINTS_PER_QUERY - 1))
+
+    windows = []
+    while True:
+        t_window_end = min(t_start + window, t_end)
+        windows.append(
+            (
+                t_start.strftime(TIMESTAMP_FORMAT),
+                t_window_end.strftime(TIMESTAMP_FORMAT),
+            )
+        )
+        if t_window_end >= t_end:
+            return windows
+        # the next window starts one step later so that no sample is repeated
+        t_start = t_window_end + datetime.timedelta(seconds=step_s)
+
+
+# run a range query window by window and merge the values of every series
+def query_range(uri, query, step, start, end):
+    timeout = float(os.environ.get("PROM_TIMEOUT", 30))
+    series = {}
+    for w_start, w_end in get_query_windows(start, end, step):
+        params = {"query": query, "start": w_start, "end": w_end, "step": step}
+        response = get_session().get(uri, params=params, timeout=timeout)
+        response.raise_for_status()
+        for result in response.json()["data"]["result"]:
+            key = tuple(sorted(result["metric"].items()))
+            if key not in series:
+                series[key] = {"metric": result["metric"], "values": []}
+            series[key]["values"].extend(result["values"])
+    return list(series.values())
 
 
 # get file prefix based for current exp based on start time
@@ -121,7 +113,6 @@ def get_file_prefix(start_ts: str):
 
     try:
         num_users = os.environ["NUM_USERS"]
-        path = os.environ.get("METRICS_DIR", "/requests")
         fprefix = "{}_{}".format(num_users, start_time)
     except Exception as e:
         print("catch Exception: ", e)
@@ -147,121 +138,216 @@ def get_target_metrics():
     return metrics
 
 
-# read metrics files and concatenate them to integrate performance data
-def summarize_energy(start_ts: str):
-    global metrics
-    all_df = pd.DataFrame(dtype=float)
+# column names of the Kepler energy metrics in the summary
+KEPLER_ENERGY_COLUMNS = {
+    "kepler_container_gpu_joules_total": "kepler_gpu_energy",
+    "kepler_container_package_joules_total": "kepler_pkg_energy",
+    "kepler_container_dram_joules_total": "kepler_dram_energy",
+}
+
+
+# trapezoidal integral of a series over its (unevenly spaced) timestamps
+def integrate(timestamps, values) -> float:
+    if len(timestamps) < 2:
+        return 0.0
+    return float(np.sum((values[1:] + values[:-1]) / 2.0 * np.diff(timestamps)))
+
+
+# split a series into the samples before the start of the run and of the run
+def split_idle(series: MetricSeries, t_start: float):
+    idle = series.timestamps < t_start
+    return (
+        series.values[idle],
+        series.timestamps[~idle],
+        series.values[~idle],
+    )
+
+
+def get_series_key(series: MetricSeries):
+    return tuple(sorted(series.labels.items()))
+
+
+# summarize the metrics collected for the run started at start_ts
+def summarize_energy(start_ts: str, store: MetricStore, idle_power: dict = None):
+    """
+    Energies are integrated over the sample timestamps and summed over all
+    series (GPUs/pods). Idle power is taken from `idle_power` (see
+    collect_idle_power; used by the points of a sweep, which follow each
+    other), otherwise it is the median of the samples collected before the
+    run, or the first sample of the run if there are none. Metrics without
+    any samples in the run are left out.
+    """
     # target metrics
     metrics = get_target_metrics()
 
-    try:
-        dirpath = os.environ.get("METRICS_DIR", "/requests")
-        steps = float(os.environ.get("NUM_PROM_STEPS", 30))
-        dirlist = os.listdir(dirpath)
-        start = start_ts.split("T")[1].split("Z")[0]
-        fprefix = get_file_prefix(start_ts)
+    start = start_ts.split("T")[1].split("Z")[0]
+    run_id = get_file_prefix(start_ts)
+    t_start = get_unix_time(start_ts)
+    idle_power = idle_power or {}
+
+    summary = {"num_users": int(os.environ["NUM_USERS"])}
 
+    try:
         for m in metrics:
-            metric_df = pd.Series(dtype=float)
-            if m == "DCGM_FI_DEV_POWER_USAGE":
-                idle_df = pd.Series(dtype=float)
-                energy_df = pd.Series(dtype=float)
-                users = pd.Series(dtype=float)
-
-            for f in dirlist:
-                if f.endswith("{}.csv".format(m)) == False:
+            series_list = [x for x in store.get(run_id, m) if len(x) > 0]
+            if len(series_list) == 0:
+                continue
+
+            if m == POWER_METRIC:
+                total_idle, energy, gross_energy, duration = 0.0, 0.0, 0.0, 0.0
+                n_series = 0
+                for series in series_list:
+                    idle_values, t, values = split_idle(series, t_start)
+                    if len(values) == 0:
+                        continue
+                    idle = idle_power.get(get_series_key(series))
+                    if idle is None:
+                        idle = (
+                            np.median(idle_values)
+                            if len(idle_values) > 0
+                            else values[0]
+                        )
+                    n_series += 1
+                    total_idle += idle
+                    energy += integrate(t, values - idle)
+                    gross_energy += integrate(t, values)
+                    duration = max(duration, t[-1] - t[0])
+                if n_series == 0:
                     continue
-                fpath = os.path.join(dirpath, f)
-
-                # read metric csv file
-                df = pd.read_csv(fpath, sep=",", dtype=float)
-                pod = df.columns[-1]
-                num_users = os.environ["NUM_USERS"]
-
-                if m == "DCGM_FI_DEV_POWER_USAGE":
-                    idle = df[pod].iloc[0]
-                    # print(idle)
-                    metric_df[start] = (df[pod].iloc[1:] - idle).mean()
-                    idle_df[start] = idle
-                    energy_df[start] = ((df[pod].iloc[1:] - idle) * steps).sum()
-                    users[start] = num_users
-                elif "DCGM" in m:
-                    metric_df[start] = df[pod].iloc[1:].mean()
-                elif "kepler" in m:
-                    metric_df[start] = (df[pod] * steps).sum()
-
-            if m == "DCGM_FI_DEV_POWER_USAGE":
-                all_df["num_users"] = users
-                all_df["idle_power"] = idle_df
-                all_df["dcgm_total_energy"] = energy_df
-            all_df[m] = metric_df
-
-        # print(all_df)
-        all_df.columns = [
-            "num_users",
-            "dcgm_idle_power",
-            "dcgm_total_energy",
-            "dcgm_power",
-        ]
-        mlist = metrics.remove("DCGM_FI_DEV_POWER_USAGE")
-        all_df.columns.extend(mlist)
-        all_df.index.name = "start_time"
-
-        all_df["kepler_total_energy"] = (
-            all_df["kepler_dram_energy"]
-            .add(all_df["kepler_pkg_energy"], fill_value=0)
-            .add(all_df["kepler_gpu_energy"], fill_value=0)
-        )
-        # if the metrics collected by Kepler are available
-        if all_df["kepler_total_energy"].mean() > 0:
-            all_df["energy"] = all_df["kepler_total_energy"]
-        else:
-            # otherwise use DCGM metrics
-            all_df["kepler_energy"] = pd.Series(dtype=float)
-            all_df["energy"] = all_df["dcgm_total_energy"]
-            # print(all_df["dcgm_energy"])
-
-    except KeyError as e:
-        print("catch KeyError: ", e)
-    except FileNotFoundError as e:
-        print("catch FileNotFoundError: ", e)
+                summary["dcgm_idle_power"] = total_idle
+                summary["dcgm_total_energy"] = energy
+                summary["dcgm_gross_energy"] = gross_energy
+                summary["dcgm_power"] = energy / duration if duration > 0 else np.nan
+            elif "DCGM" in m:
+                values = np.concatenate(
+                    [split_idle(x, t_start)[2] for x in series_list]
+                )
+                if len(values) > 0:
+                    summary[m] = values.mean()
+            elif "kepler" in m:
+                # Kepler series are power (irate of the joule counters)
+                summary[KEPLER_ENERGY_COLUMNS.get(m, m)] = sum(
+                    integrate(*split_idle(x, t_start)[1:]) for x in series_list
+                )
     except Exception as e:
         print("catch Exception: ", e)
 
+    all_df = pd.DataFrame([summary], index=pd.Index([start], name="start_time"))
+
+    kepler_columns = [c for c in KEPLER_ENERGY_COLUMNS.values() if c in all_df]
+    if len(kepler_columns) > 0:
+        all_df["kepler_total_energy"] = all_df[kepler_columns].sum(axis=1)
+
+    # if the metrics collected by Kepler are available
+    if "kepler_total_energy" in all_df and all_df["kepler_total_energy"].mean() > 0:
+        all_df["energy"] = all_df["kepler_total_energy"]
+    elif "dcgm_total_energy" in all_df:
+        # otherwise use DCGM metrics
+        all_df["energy"] = all_df["dcgm_total_energy"]
+    else:
+        all_df["energy"] = float("nan")
+
     print(all_df)
     return all_df
 
 
+def get_query(metric, ns):
+    if "kepler" in metric:
+        filter_str = '{{container_namespace="{}"}}'.format(ns)
+        return "sum(irate({}{}[1m])) by(pod_name)".format(metric, filter_str)
+    filter_str = '{{exported_namespace="{}"}}'.format(ns)
+    return "sum({}{}) by(exported_pod)".format(metric, filter_str)
+
+
+# start of the IDLE_WINDOW before ts
+def get_idle_start(ts):
+    idle_window = Duration(os.environ.get("IDLE_WINDOW", "60s")).to_seconds()
+    t = datetime.datetime.strptime(ts, TIMESTAMP_FORMAT)
+    return (t - datetime.timedelta(seconds=idle_window)).strftime(TIMESTAMP_FORMAT)
+
+
+@functools.lru_cache(maxsize=None)
+def collect_idle_power(idle_end, step, ns) -> dict:
+    """
+    Median power of every GPU ({series labels: W}, see get_series_key) in
+    the IDLE_WINDOW before `idle_end`. The points of a sweep run back to
+    back, so they share the measurement taken before the first one.
+    """
+    try:
+        results = query_range(
+            os.environ["PROM_URL"],
+            get_query(POWER_METRIC, ns),
+            step,
+            get_idle_start(idle_end),
+            idle_end,
+        )
+    except Exception as e:
+        print("catch Exception ({}): ".format(POWER_METRIC), e)
+        return {}
+
+    idle_power = {}
+    for r in results:
+        series = MetricSeries.from_prom_values(POWER_METRIC, r["metric"], r["values"])
+        values = split_idle(series, get_unix_time(idle_end))[0]
+        if len(values) > 0:
+            idle_power[get_series_key(series)] = float(np.median(values))
+    return idle_power
+
+
 # collecting the gpu- or energy-related metrics from Prometheus if PROM_URL is available
-def collect_metrics(start, end, step, ns):
-    global metrics
+def collect_metrics(start, end, step, ns, store: MetricStore = None, idle_window=True):
+    """
+    Collect the target metrics of the run from `start` to `end`, and of the
+    IDLE_WINDOW before it to estimate the idle power, unless `idle_window`
+    is False (the idle power is then given by collect_idle_power).
+    """
     # target metrics
     metrics = get_target_metrics()
 
+    if store is None:
+        store = MetricStore()
+    run_id = get_file_prefix(start)
+    query_start = get_idle_start(start) if idle_window else start
+
     try:
         promuri = os.environ.get("PROM_URL")
-        for metric in metrics:
-            if "kepler" in metric:
-                filter_str = '{{container_namespace="{}"}}'.format(ns)
-                query_str = "sum(irate({}{}[1m])) by(pod_name)".format(
-                    metric, filter_str
-                )
-            else:
-                filter_str = '{{exported_namespace="{}"}}'.format(ns)
-                query_str = "sum({}{}) by(exported_pod)".format(metric, filter_str)
+        if promuri is None or promuri == "":
+            raise Exception("PROM_URL: {}".format(promuri))
+        parallelism = int(os.environ.get("PROM_PARALLELISM", 8))
+
+        def collect_metric(metric):
             # query metric to Prometheus
-            md = get_prom_results(promuri, metric, query_str, step, start, end)
-            # save the data to csv files
-            if len(md.data) > 0:
-                write_to_file(md)
-    except KeyError as e:
-        print(
-            ">> skipped collecting energy metrics because prometheus is not available: ",
-            e,
-        )
+            try:
+                results = query_range(
+                    promuri, get_query(metric, ns), step, query_start, end
+                )
+            except Exception as e:
+                print("catch Exception ({}): ".format(metric), e)
+                return []
+            return [
+                MetricSeries.from_prom_values(metric, r["metric"], r["values"])
+                for r in results
+            ]
+
+        # query all metrics concurrently
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(1, min(parallelism, len(metrics)))
+        ) as executor:
+            futures = [executor.submit(collect_metric, m) for m in metrics]
+            for future in futures:
+                for series in future.result():
+                    if len(series) > 0:
+                        store.add(run_id, series)
+
+        # optionally persist the series of all runs to a single file
+        metrics_file = os.environ.get("METRICS_FILE")
+        if metrics_file:
+            store.save(metrics_file)
     except Exception as e:
         print("catch Exception: ", e)
 
+    return store
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
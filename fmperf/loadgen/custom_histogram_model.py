@@ -1,6 +1,13 @@
 import numpy as np
 import pandas as pd
 from sklearn.base import BaseEstimator, TransformerMixin
+from .request_model import (
+    INTEGER_COLUMNS,
+    RequestModel,
+    cast_column,
+    fit_bins,
+    get_bins,
+)
 
 
 class CustomHistogram(BaseEstimator, TransformerMixin):
@@ -16,89 +23,19 @@ class CustomHistogram(BaseEstimator, TransformerMixin):
         out = pd.DataFrame(columns=data.columns)
 
         for c in data.columns:
-            vals = data[c].values
-            n_val = vals.shape[0]
+            vals = np.asarray(data[c].values)
             sortind = np.argsort(vals)
-            sortval = np.array(vals)[sortind]
-
-            dd = [
-                {
-                    "count": 1,
-                    "rank": 0,
-                    "val": sortval[0],
-                }
-            ]
-
-            for i in range(1, n_val):
-                prev_val = dd[-1]["val"]
-                next_val = sortval[i]
-                if next_val != prev_val:
-                    dd.append({"count": 1, "rank": i, "val": next_val})
-                else:
-                    dd[-1]["count"] += 1
-
-            rank_value = []
-            self.bin_edges_[c] = []
-            self.bin_labels_[c] = []
-
-            if len(dd) <= self.n_bins:
-                self.n_bins_[c] = len(dd)
-                for i, x in enumerate(dd):
-                    self.bin_edges_[c].append(x["val"])
-                    self.bin_labels_[c].append(x["val"])
-                    rank_value.append(x["rank"])
-                rank_value.append(n_val)
-            else:
-                freqvals = []
-                for i, x in enumerate(dd):
-                    frac = x["count"] / n_val
-                    if frac > 0.1:
-                        freqvals.append(i)
-
-                num = n_val
-                den = self.n_bins
-                for i in freqvals:
-                    num -= dd[i]["count"]
-                    den -= 1
-
-                targ = int(np.floor(num / den))
-
-                bin_idx = 0
-                pos = 0
-
-                while bin_idx < self.n_bins and pos < len(dd):
-                    bin_pos = pos
-                    bin_len = 0
-                    bin_weight = 0
-                    bin_rank = dd[pos]["rank"]
-                    bin_val = dd[pos]["val"]
-                    bin_label = 0.0
-
-                    while bin_weight < targ and pos < len(dd):
-                        bin_len += 1
-                        bin_label += dd[pos]["count"] * dd[pos]["val"]
-                        bin_weight += dd[pos]["count"]
-                        pos += 1
-
-                    if float(bin_weight) > 1.2 * targ and pos > (bin_pos + 1):
-                        pos -= 1
-                        bin_len -= 1
-                        bin_weight -= dd[pos]["count"]
-                        bin_label -= dd[pos]["count"] * dd[pos]["val"]
-
-                    self.bin_edges_[c].append(bin_val)
-                    self.bin_labels_[c].append(bin_label / bin_weight)
-                    rank_value.append(bin_rank)
-                    bin_idx += 1
-
-                self.n_bins_[c] = bin_idx
-                rank_value.append(n_val)
-
-            # transform
-            tmp = np.zeros(shape=(n_val,), dtype=np.uint8)
-            for i in range(len(rank_value) - 1):
-                for j in range(rank_value[i], rank_value[i + 1]):
-                    tmp[sortind[j]] = i
+
+            # run-length table of the sorted values
+            uniq, counts = np.unique(vals, return_counts=True)
+
+            rank_value = self._fit_bins(c, uniq, counts)
+
+            # transform: scatter the bin index of every rank back to its value
+            tmp = np.zeros(shape=(vals.shape[0],), dtype=np.uint8)
+            tmp[sortind] = np.repeat(
+                np.arange(len(rank_value) - 1, dtype=np.uint8), np.diff(rank_value)
+            )
 
             out[c] = tmp
 
@@ -112,23 +49,23 @@ class CustomHistogram(BaseEstimator, TransformerMixin):
 
         return out
 
+    def _fit_bins(self, c, uniq, counts):
+        """
+        Fit the bins of column `c` from its sorted unique values and their
+        counts; returns the first rank of every bin followed by the total count.
+        """
+        edges, labels, rank_value = fit_bins(uniq, counts, self.n_bins)
+        self.n_bins_[c] = len(edges)
+        self.bin_edges_[c] = edges
+        self.bin_labels_[c] = labels
+        return rank_value
+
     def __decode(self, df):
-        decoded = pd.DataFrame()
+        decoded = pd.DataFrame(index=df.index)
         for c in df.columns:
-            decoded[c] = df[c].apply(lambda x: self.bin_labels_[c][x])
-
-        for c in [
-            "generated_token_count",
-            "input_token_count",
-            "batch_size",
-            "params.top_k",
-            "is_greedy",
-        ]:
-            if c in decoded.columns:
-                decoded[c] = decoded[c].apply(round)
-
-        if "is_greedy" in decoded.columns:
-            decoded[c] = decoded[c].apply(bool)
+            decoded[c] = np.asarray(self.bin_labels_[c])[df[c].values]
+            if c in INTEGER_COLUMNS:
+                decoded[c] = cast_column(c, decoded[c].values)
 
         return decoded
 
@@ -136,33 +73,10 @@ class CustomHistogram(BaseEstimator, TransformerMixin):
         out = pd.DataFrame()
 
         for c in data.columns:
-            vals = data[c].values
-            n_val = vals.shape[0]
-
-            tmp = np.zeros(shape=(n_val,), dtype=np.uint8)
-            for i in range(n_val):
-                found = None
-                for bin_idx in range(self.n_bins_[c] - 1):
-                    if (
-                        vals[i] >= self.bin_edges_[c][bin_idx]
-                        and vals[i] < self.bin_edges_[c][bin_idx + 1]
-                    ):
-                        found = bin_idx
-
-                if found is None:
-                    found = self.n_bins_[c] - 1
-
-                tmp[i] = found
-
-            out[c] = tmp
+            tmp = get_bins(self.bin_edges_[c], data[c].values)
+            out[c] = tmp.astype(np.uint8)
 
         return self.__decode(out)
 
     def sample(self, n=1):
-        tmp = np.random.choice(
-            range(len(self.indices_flat_)), p=self.probs_flat_, size=n, replace=True
-        )
-        out = pd.DataFrame(
-            np.array(self.indices_flat_, dtype=object)[tmp], columns=self.columns_
-        )
-        return out
+        return RequestModel.from_histogram(self).sample(n)
@@ -0,0 +1,149 @@
+import argparse
+import itertools
+import json
+import numpy as np
+import pandas as pd
+from .request_model import RequestModel, cast_column, fit_bins, get_bins
+
+# request parameters of the bundled requests model
+DEFAULT_COLUMNS = [
+    "generated_token_count",
+    "input_token_count",
+    "params.temperature",
+    "params.top_p",
+    "params.top_k",
+    "batch_size",
+    "is_greedy",
+]
+
+
+def read_jsonl(filename: str, chunksize: int):
+    # nested fields (e.g. {"params": {"temperature": ...}}) are flattened to
+    # dotted column names
+    with open(filename, "r") as f:
+        while True:
+            lines = list(itertools.islice(f, chunksize))
+            if len(lines) == 0:
+                return
+            yield pd.json_normalize([json.loads(x) for x in lines if x.strip()])
+
+
+def read_chunks(filename: str, columns: list, chunksize: int):
+    """
+    Stream the requests of a log file in chunks of at most `chunksize` rows.
+    CSV, JSON lines and Parquet files are supported; rows with a missing
+    value in any of the columns are skipped.
+    """
+    if filename.endswith(".csv"):
+        chunks = pd.read_csv(filename, usecols=columns, chunksize=chunksize)
+    elif filename.endswith(".jsonl"):
+        chunks = read_jsonl(filename, chunksize)
+    elif filename.endswith(".parquet"):
+        import pyarrow.parquet as pq
+
+        chunks = (
+            batch.to_pandas()
+            for batch in pq.ParquetFile(filename).iter_batches(
+                batch_size=chunksize, columns=columns
+            )
+        )
+    else:
+        raise ValueError("Unsupported request log format: %s" % (filename))
+
+    for chunk in chunks:
+        yield chunk[columns].dropna().astype(np.float64)
+
+
+def fit_model(files, columns=DEFAULT_COLUMNS, n_bins=64, chunksize=1000000):
+    """
+    Fit a requests model to request logs in two streaming passes: the first
+    counts the values of every column to fit the bins, the second counts
+    the requests falling into every joint bin. Only the value counts and the
+    joint bin counts are kept in memory.
+    """
+
+    # pass 1: value counts per column
+    value_counts = {c: pd.Series(dtype=np.int64) for c in columns}
+    n_requests = 0
+    for filename in files:
+        for chunk in read_chunks(filename, columns, chunksize):
+            n_requests += chunk.shape[0]
+            for c in columns:
+                value_counts[c] = value_counts[c].add(
+                    chunk[c].value_counts(), fill_value=0
+                )
+        print(">> counted %d requests (%s)" % (n_requests, filename))
+
+    if n_requests == 0:
+        raise ValueError("No requests found in: %s" % (", ".join(files)))
+
+    edges = {}
+    labels = {}
+    for c in columns:
+        counts = value_counts[c].sort_index()
+        edges[c], labels[c], _ = fit_bins(
+            counts.index.values, counts.values.astype(np.int64), n_bins
+        )
+        print(">> %s: %d bins" % (c, len(edges[c])))
+
+    # pass 2: counts per joint bin, with the bin indices of all columns
+    # packed into a single integer
+    radix = np.array([len(edges[c]) for c in columns], dtype=np.int64)
+    joint_counts = pd.Series(dtype=np.int64)
+    for filename in files:
+        for chunk in read_chunks(filename, columns, chunksize):
+            code = np.zeros(chunk.shape[0], dtype=np.int64)
+            for c, r in zip(columns, radix):
+                code = code * r + get_bins(edges[c], chunk[c].values)
+            codes, counts = np.unique(code, return_counts=True)
+            joint_counts = joint_counts.add(
+                pd.Series(counts, index=codes), fill_value=0
+            )
+
+    # unpack the joint bins and decode them to bin labels
+    table = {}
+    code = joint_counts.index.values.astype(np.int64)
+    for c, r in reversed(list(zip(columns, radix))):
+        table[c] = cast_column(c, np.asarray(labels[c])[code % r])
+        code = code // r
+
+    # bins whose labels round to the same values are merged
+    df = pd.DataFrame({c: table[c] for c in columns})
+    df["count"] = joint_counts.values
+    df = df.groupby(columns, sort=False)["count"].sum().reset_index()
+
+    print(">> %d joint bins" % (df.shape[0]))
+
+    return RequestModel(columns, {c: df[c].values for c in columns}, df["count"].values)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="fit a requests model to request logs")
+    parser.add_argument(
+        "files", nargs="+", help="request logs (.csv, .jsonl or .parquet)"
+    )
+    parser.add_argument("--output", required=True, help="model file (.npz)")
+    parser.add_argument("--n-bins", type=int, default=64, help="bins per column")
+    parser.add_argument(
+        "--columns",
+        default=",".join(DEFAULT_COLUMNS),
+        help="comma-separated request parameters to model",
+    )
+    parser.add_argument(
+        "--chunksize", type=int, default=1000000, help="rows read at a time"
+    )
+    args = parser.parse_args()
+
+    model = fit_model(
+        args.files,
+        columns=args.columns.split(","),
+        n_bins=args.n_bins,
+        chunksize=args.chunksize,
+    )
+
+    print(">> writing requests model to file: %s" % (args.output))
+    model.save(args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,16 +3,29 @@ import numpy as np
 import sys
 import json
 import os
-import grpc
-import pickle
-from google.protobuf import json_format
 import requests
 from typing import Iterable, List
 from importlib import resources as impresources
 import fmperf.data
 import traceback
-from transformers import AutoTokenizer
+import functools
+import concurrent.futures
 from fmperf.utils.constants import REQUESTS_DIR
+from .prompt_index import PromptIndex
+from .request_model import RequestModel
+from .trace import load_trace
+from .workload_cache import (
+    get_cache_key,
+    get_digest,
+    get_file_digest,
+    get_tokenizer_revision,
+    load_cache,
+    store_cache,
+    get_journal_file,
+    Journal,
+    is_up_to_date,
+    write_stamp,
+)
 
 code = os.getenv("CODE", "false").lower() != "false"
 
@@ -35,8 +48,16 @@ parser.add_argument(
     help="generate requests according to requests model",
     action="store_true",
 )
+parser.add_argument(
+    "--from-trace",
+    help="replay the requests of a timestamped trace (TRACE_FILE)",
+    action="store_true",
+)
 args = parser.parse_args()
 
+# requests from a model or a trace carry their own sampling parameters
+sampling_params = args.from_model or args.from_trace
+
 
 def get_streaming_response(response: requests.Response):
     finished = False
@@ -70,30 +91,24 @@ def get_streaming_response(response: requests.Response):
                 raise RuntimeError("No usage data in server response")
 
 
-def get_text():
+def get_texts():
     if args.import_text:
-        texts = json.load(open(args.import_text, "r"))
-        n = len(texts)
-        i = 0
-        while True:
-            t = texts[i]
-            i = (i + 1) % n
-            yield t
+        return json.load(open(args.import_text, "r"))
     else:
-        while True:
-            yield text
+        return [text]
 
 
-text_generator = get_text()
+texts = get_texts()
 
 
-def generate_vllm_request(config, url):
-    # Remove http:// prefix if present to avoid duplication
-    url_no_prefix = url.replace("http://", "")
+@functools.lru_cache(maxsize=None)
+def get_model_id(url_no_prefix):
+    return requests.get("http://%s/v1/models" % (url_no_prefix)).json()["data"][0]["id"]
+
 
-    model = requests.get("http://%s/v1/models" % (url_no_prefix)).json()["data"][0][
-        "id"
-    ]
+@functools.lru_cache(maxsize=None)
+def get_tokenizer(model):
+    from transformers import AutoTokenizer
 
     # Set Hugging Face token if available in environment
     hf_token = os.environ.get("HUGGINGFACE_TOKEN") or os.environ.get("HF_TOKEN")
@@ -101,13 +116,27 @@ def generate_vllm_request(config, url):
     if hf_token:
         tokenizer_kwargs["token"] = hf_token
 
-    tokenizer = AutoTokenizer.from_pretrained(model, **tokenizer_kwargs)
+    return AutoTokenizer.from_pretrained(model, use_fast=True, **tokenizer_kwargs)
+
+
+@functools.lru_cache(maxsize=None)
+def get_prompt_index(tokenizer_name):
+    # tokenize all seed texts once, in a single batch
+    return PromptIndex.from_texts(get_tokenizer(tokenizer_name), texts)
+
 
-    prompt_ids = tokenizer(next(text_generator)).input_ids[-config["in_tokens"] :]
+def get_text(sample_idx):
+    return texts[sample_idx % len(texts)]
 
+
+def get_prompt_ids(sample_idx, in_tokens):
+    return get_prompt_index(tokenizer_name).get_prompt_ids(in_tokens, sample_idx)
+
+
+def get_vllm_request(config, sample_idx):
     request = {
-        "model": model,
-        "prompt": prompt_ids,
+        "model": model_id,
+        "prompt": get_prompt_ids(sample_idx, config["in_tokens"]),
         "ignore_eos": True,
         "max_tokens": config["out_tokens"],
         "seed": 42,
@@ -115,7 +144,7 @@ def generate_vllm_request(config, url):
         "stream_options": {"include_usage": True, "continuous_usage_stats": True},
     }
 
-    if not args.from_model:
+    if not sampling_params:
         request["temperature"] = 0.0 if config["is_greedy"] else 1.0
     else:
         if config["is_greedy"] or config["temperature"] == 0.0:
@@ -127,6 +156,15 @@ def generate_vllm_request(config, url):
             request["top_k"] = config["top_k"] if config["top_k"] > 0 else -1
             request["top_p"] = config["top_p"]
 
+    return request
+
+
+def generate_vllm_request(config, url, sample_idx):
+    # Remove http:// prefix if present to avoid duplication
+    url_no_prefix = url.replace("http://", "")
+
+    request = get_vllm_request(config, sample_idx)
+
     headers = {"User-Agent": "Test Client"}
 
     response = requests.post(
@@ -149,19 +187,15 @@ def generate_vllm_request(config, url):
     return request, expected
 
 
-def generate_tgis_request(config, url):
-    """
-    Generate (streaming) gRPC request and expected response
-    """
+@functools.lru_cache(maxsize=None)
+def get_tgis_channel(url):
+    import grpc
 
-    from text_generation_tests.pb import (
-        generation_pb2_grpc as gpb2,
-        generation_pb2 as pb2,
-    )
+    # channels are thread-safe, so a single one is shared by all requests
+    return grpc.insecure_channel(url)
 
-    channel = grpc.insecure_channel(url)
-    stub = gpb2.GenerationServiceStub(channel)
 
+def get_tgis_request(config, text):
     params = {
         "method": "GREEDY" if config["is_greedy"] else "SAMPLE",
         "stopping": {
@@ -178,15 +212,33 @@ def generate_tgis_request(config, url):
         "model_id": "null",
         "params": params,
         "request": {
-            "text": next(text_generator),
+            "text": text,
         },
     }
 
-    if args.from_model:
+    if sampling_params:
         params["sampling"]["temperature"] = config["temperature"]
         params["sampling"]["top_k"] = config["top_k"]
         params["sampling"]["top_p"] = config["top_p"]
 
+    return request
+
+
+def generate_tgis_request(config, url, sample_idx):
+    """
+    Generate (streaming) gRPC request and expected response
+    """
+
+    from google.protobuf import json_format
+    from text_generation_tests.pb import (
+        generation_pb2_grpc as gpb2,
+        generation_pb2 as pb2,
+    )
+
+    stub = gpb2.GenerationServiceStub(get_tgis_channel(url))
+
+    request = get_tgis_request(config, get_text(sample_idx))
+
     message = json_format.ParseDict(request, pb2.SingleGenerationRequest())
 
     response = []
@@ -198,12 +250,34 @@ def generate_tgis_request(config, url):
     return request, response
 
 
+def generate_offline_request(config, sample_idx):
+    """
+    Generate request without contacting the server; the expected response is
+    left empty so that the loadgen treats the request as timing-only
+    """
+    if target == "tgis":
+        prompt_ids = get_prompt_ids(sample_idx, config["in_tokens"])
+        text = get_tokenizer(tokenizer_name).decode(prompt_ids)
+        return get_tgis_request(config, text), []
+    elif target == "vllm":
+        return get_vllm_request(config, sample_idx), []
+    else:
+        raise ValueError(f"Invalid target: {target}")
+
+
 np.random.seed(42)
 
 # Get sample size
 sample_size = int(os.environ["SAMPLE_SIZE"])
 
-if not args.from_model:
+if args.from_trace:
+    trace_file = os.environ["TRACE_FILE"]
+    trace = load_trace(trace_file)
+
+    # a sample size of 0 replays the whole trace
+    if sample_size <= 0 or sample_size > trace.shape[0]:
+        sample_size = trace.shape[0]
+elif not args.from_model:
     # Get input size distribution info
     min_in_tokens = int(os.environ["MIN_INPUT_TOKENS"])
     max_in_tokens = int(os.environ["MAX_INPUT_TOKENS"])
@@ -214,6 +288,12 @@ if not args.from_model:
 
     # Get greedy
     frac_greedy = float(os.environ["FRAC_GREEDY"])
+else:
+    # constraints on the request parameters, e.g. {"input_token_count": [1000, null]}
+    requests_where = json.loads(os.getenv("REQUESTS_WHERE") or "null")
+
+    # draw every value of this request parameter equally often
+    requests_stratify = os.getenv("REQUESTS_STRATIFY") or None
 
 # output file
 filename = os.environ["REQUESTS_FILENAME"]
@@ -221,15 +301,20 @@ filename = os.environ["REQUESTS_FILENAME"]
 # target
 target = os.environ["TARGET"]
 
+# offline generation only needs a tokenizer, not a running server
+offline = os.getenv("OFFLINE", "false").lower() != "false"
+
 # url
-url = os.environ["URL"]
+url = os.environ["URL"] if not offline else os.getenv("URL", "")
 
 # overwrite
 overwrite = os.getenv("OVERWRITE", "false").lower() != "false"
 
-if os.path.isfile(os.path.join(REQUESTS_DIR, filename)) and not overwrite:
-    print("File %s already exists; skipping workload generation" % (filename))
-    sys.exit()
+# maximum number of concurrent requests sent to the server
+parallelism = int(os.getenv("PARALLELISM", "8"))
+
+# content-addressed workload cache
+cache_dir = os.getenv("WORKLOAD_CACHE_DIR", os.path.join(REQUESTS_DIR, "cache"))
 
 
 print(">> ---------------------------------")
@@ -237,48 +322,147 @@ print(">> Generating heterogeneous requests")
 print(">> ---------------------------------")
 print(">> sample_size    = %d" % (sample_size))
 
-if not args.from_model:
+if args.from_trace:
+    print(">> trace_file     = %s" % (trace_file))
+elif not args.from_model:
     print(">> min_in_tokens  = %d" % (min_in_tokens))
     print(">> max_in_tokens  = %d" % (max_in_tokens))
     print(">> min_out_tokens = %d" % (min_out_tokens))
     print(">> max_out_tokens = %d" % (max_out_tokens))
     print(">> frac_greedy    = %.2f" % (frac_greedy))
+else:
+    print(">> where          = %s" % (requests_where))
+    print(">> stratify       = %s" % (requests_stratify))
 
 print(">> filename       = %s" % (filename))
 print(">> target         = %s" % (target))
 print(">> url            = %s" % (url))
+print(">> parallelism    = %d" % (parallelism))
+print(">> offline        = %s" % (offline))
+
+
+def write_cases(cases):
+    print(">> Writing %d requests to %s" % (len(cases), filename))
+    with open(os.path.join(REQUESTS_DIR, filename), "w") as f:
+        json.dump(cases, f)
+    write_stamp(REQUESTS_DIR, filename, cache_key, len(cases))
+
+
+# everything that determines the generated cases, apart from the sample size
+if target == "vllm" and not offline:
+    model_id = get_model_id(url.replace("http://", ""))
+else:
+    model_id = os.getenv("MODEL_ID")
+
+# the tokenizer defaults to the one of the served model
+tokenizer_name = os.getenv("TOKENIZER") or model_id
+
+if target == "vllm" or offline:
+    tokenizer_revision = get_tokenizer_revision(get_tokenizer(tokenizer_name))
+else:
+    tokenizer_revision = None
+
+if args.from_trace:
+    workload_params = {
+        "from_trace": True,
+        "offline": offline,
+        "trace": get_file_digest(trace_file),
+    }
+elif args.from_model:
+    # requests model fitted with fmperf.loadgen.fit-model, or the bundled one
+    requests_model_file = os.getenv("REQUESTS_MODEL_FILE") or (
+        impresources.files(fmperf.data) / "all_nbins_64.npz"
+    )
+    workload_params = {
+        "from_model": True,
+        "offline": offline,
+        "requests_model": get_file_digest(requests_model_file),
+        "where": requests_where,
+        "stratify": requests_stratify,
+    }
+else:
+    workload_params = {
+        "offline": offline,
+        "min_in_tokens": min_in_tokens,
+        "max_in_tokens": max_in_tokens,
+        "min_out_tokens": min_out_tokens,
+        "max_out_tokens": max_out_tokens,
+        "frac_greedy": frac_greedy,
+    }
 
+cache_params = {
+    "workload": workload_params,
+    "model_id": model_id,
+    "tokenizer_name": tokenizer_name,
+    "tokenizer_revision": tokenizer_revision,
+    "seed_text": get_digest(texts),
+    "target": target,
+}
+cache_key = get_cache_key(cache_params)
+print(">> cache key      = %s" % (cache_key))
+
+# a file of the same name is only reused if it was written for this workload
+if not overwrite and is_up_to_date(REQUESTS_DIR, filename, cache_key, sample_size):
+    print("File %s already exists; skipping workload generation" % (filename))
+    sys.exit()
+
+results = {} if overwrite else load_cache(cache_dir, cache_key)
+results = {idx: case for idx, case in results.items() if idx < sample_size}
+
+if len(results) == sample_size:
+    print(">> Found all %d requests in workload cache" % (sample_size))
+    write_cases([results[sample_idx] for sample_idx in range(sample_size)])
+    sys.exit()
+elif len(results) > 0:
+    print(">> Found %d of %d requests in workload cache" % (len(results), sample_size))
 
-cases = []
 
 if args.from_model:
-    requests_model_file = impresources.files(fmperf.data) / "all_nbins_64.pkl"
     print(">> loading requests model from file: ", requests_model_file)
 
-    class CustomUnpickler(pickle.Unpickler):
-        def find_class(self, module, name):
-            if name == "CustomHistogram":
-                from .custom_histogram_model import CustomHistogram
+    requests_model = RequestModel.load(requests_model_file)
 
-                return CustomHistogram
-            return super().find_class(module, name)
+    for c in ["input_token_count", "generated_token_count"]:
+        if c not in requests_model.columns:
+            raise ValueError("Requests model has no column: %s" % (c))
 
-    requests_model = CustomUnpickler(open(requests_model_file, "rb")).load()
-
-    samples = requests_model.sample(sample_size)
+    samples = requests_model.sample(
+        sample_size, where=requests_where, stratify=requests_stratify
+    )
     print(samples)
+    # plain python values, so that the configs can be serialized
+    samples = samples.to_dict("records")
 
+# draw all configs up-front so that the RNG sequence does not depend on the
+# order in which concurrent requests complete
+configs = []
 for sample_idx in range(sample_size):
-    if args.from_model:
-        sample = samples.iloc[sample_idx]
+    if args.from_trace:
+        request = trace.iloc[sample_idx]
+        config = {
+            "in_tokens": int(request["input_tokens"]),
+            "out_tokens": int(request["output_tokens"]),
+            "is_greedy": bool(request["is_greedy"]),
+            "temperature": float(request["temperature"]),
+            "top_k": int(request["top_k"]),
+            "top_p": float(request["top_p"]),
+            # offset (in seconds) from the first request of the trace
+            "arrival_time": float(request["arrival_time"]),
+        }
+    elif args.from_model:
+        sample = samples[sample_idx]
+        # sampling parameters that are not modelled take their defaults
         config = {
             "in_tokens": sample["input_token_count"],
             "out_tokens": sample["generated_token_count"],
-            "is_greedy": sample["is_greedy"],
-            "temperature": sample["params.temperature"],
-            "top_k": sample["params.top_k"],
-            "top_p": sample["params.top_p"],
+            "is_greedy": sample.get("is_greedy", False),
+            "temperature": sample.get("params.temperature", 1.0),
+            "top_k": sample.get("params.top_k", 0),
+            "top_p": sample.get("params.top_p", 1.0),
         }
+        if "weight" in sample:
+            # importance weight w.r.t. the unconstrained requests model
+            config["weight"] = sample["weight"]
     else:
         config = {
             "in_tokens": np.random.randint(low=min_in_tokens, high=max_in_tokens + 1),
@@ -287,26 +471,81 @@ for sample_idx in range(sample_size):
             ),
             "is_greedy": np.random.uniform() < frac_greedy,
         }
+    configs.append(config)
+
+
+def generate_case(sample_idx):
+    config = configs[sample_idx]
 
     case = {
         "config": config,
     }
 
-    try:
-        if target == "tgis":
-            case["request"], case["expected"] = generate_tgis_request(config, url)
-        elif target == "vllm":  # StackSpec will also use this
-            case["request"], case["expected"] = generate_vllm_request(config, url)
-        else:
-            raise ValueError(f"Invalid target: {target}")
+    if offline:
+        case["request"], case["expected"] = generate_offline_request(config, sample_idx)
+    elif target == "tgis":
+        case["request"], case["expected"] = generate_tgis_request(
+            config, url, sample_idx
+        )
+    elif target == "vllm":  # StackSpec will also use this
+        case["request"], case["expected"] = generate_vllm_request(
+            config, url, sample_idx
+        )
+    else:
+        raise ValueError(f"Invalid target: {target}")
+
+    return case
+
+
+if target == "vllm" or offline:
+    # tokenize the seed texts once, before fanning out
+    get_prompt_index(tokenizer_name)
+
+# every finished case is committed to a journal, so that an interrupted run
+# resumes where it stopped rather than starting over. The journal is only
+# removed once the cases are written, so that a retried pod resumes also when
+# OVERWRITE is set (which only bypasses the cache)
+journal_file = get_journal_file(REQUESTS_DIR, filename)
+journal = Journal(journal_file, cache_key)
+
+generated = {
+    idx: case
+    for idx, case in journal.cases.items()
+    if idx < sample_size and idx not in results
+}
+if len(generated) > 0:
+    print(">> Resuming with %d requests from %s" % (len(generated), journal_file))
+
+# only generate the samples which are not cached or journaled yet
+missing = [
+    sample_idx
+    for sample_idx in range(sample_size)
+    if sample_idx not in results and sample_idx not in generated
+]
+
+# offline generation is cheap and shares one tokenizer, so it runs serially
+max_workers = 1 if offline else parallelism
+
+with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+    futures = {
+        executor.submit(generate_case, sample_idx): sample_idx for sample_idx in missing
+    }
+    for future in concurrent.futures.as_completed(futures):
+        try:
+            case = future.result()
+            print(json.dumps(case, indent=4))
+            generated[futures[future]] = case
+            journal.append(futures[future], case)
+        except Exception as e:
+            print(traceback.format_exc())
 
-        print(json.dumps(case, indent=4))
-        cases.append(case)
-    except Exception as e:
-        print(traceback.format_exc())
+if len(generated) > 0:
+    store_cache(cache_dir, cache_key, cache_params, generated)
 
+results.update(generated)
 
-if len(cases) > 0:
-    print(">> Writing %d requests to %s" % (len(cases), filename))
-    with open(os.path.join(REQUESTS_DIR, filename), "w") as f:
-        json.dump(cases, f)
+if len(results) > 0:
+    write_cases([results[sample_idx] for sample_idx in sorted(results)])
+
+# the cases are safely in the cache now
+journal.close(remove=True)
@@ -0,0 +1,119 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+
+# columns of the persisted metrics table
+METRIC_COLUMNS = ["run_id", "metric", "labels", "timestamp", "value"]
+
+
+class MetricSeries:
+    """A single Prometheus time series (one set of labels) of a run."""
+
+    def __init__(self, metric: str, labels: dict, timestamps, values):
+        self.metric = metric
+        self.labels = dict(labels)
+        self.timestamps = np.asarray(timestamps, dtype=np.float64)
+        self.values = np.asarray(values, dtype=np.float64)
+
+    @classmethod
+    def from_prom_values(cls, metric: str, labels: dict, values: list):
+        """Build a series from the [[timestamp, "value"], ...] list of Prometheus."""
+        if len(values) == 0:
+            return cls(metric, labels, [], [])
+        timestamps, vals = zip(*values)
+        series = cls(metric, labels, timestamps, [float(v) for v in vals])
+        # chunked queries may return overlapping samples
+        _, idx = np.unique(series.timestamps, return_index=True)
+        series.timestamps, series.values = series.timestamps[idx], series.values[idx]
+        return series
+
+    def __len__(self):
+        return len(self.timestamps)
+
+
+class MetricStore:
+    """
+    In-memory store of the metric series collected for every run, keyed by
+    run id (see collect_energy.get_file_prefix). The store can be persisted
+    to a single columnar file holding the series of all runs.
+    """
+
+    def __init__(self):
+        self.series = {}
+
+    def add(self, run_id: str, series: MetricSeries):
+        self.series.setdefault(run_id, {}).setdefault(series.metric, []).append(series)
+
+    def get(self, run_id: str, metric: str) -> list:
+        return self.series.get(run_id, {}).get(metric, [])
+
+    def runs(self) -> list:
+        return list(self.series)
+
+    def to_frame(self) -> pd.DataFrame:
+        frames = []
+        for run_id, metrics in self.series.items():
+            for metric, series_list in metrics.items():
+                for series in series_list:
+                    frames.append(
+                        pd.DataFrame(
+                            {
+                                "run_id": run_id,
+                                "metric": metric,
+                                "labels": json.dumps(series.labels, sort_keys=True),
+                                "timestamp": series.timestamps,
+                                "value": series.values,
+                            }
+                        )
+                    )
+        if len(frames) == 0:
+            return pd.DataFrame(columns=METRIC_COLUMNS)
+        return pd.concat(frames, ignore_index=True)
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame):
+        store = cls()
+        for (run_id, metric, labels), group in df.groupby(
+            ["run_id", "metric", "labels"], sort=False
+        ):
+            store.add(
+                run_id,
+                MetricSeries(
+                    metric,
+                    json.loads(labels),
+                    group["timestamp"].values,
+                    group["value"].values,
+                ),
+            )
+        return store
+
+    @classmethod
+    def load(cls, filename: str):
+        if not os.path.exists(filename):
+            return cls()
+        if filename.endswith(".parquet"):
+            df = pd.read_parquet(filename)
+        else:
+            df = pd.read_csv(filename)
+        return cls.from_frame(df)
+
+    def save(self, filename: str):
+        """
+        Merge the runs of this store into `filename` (Parquet if the name
+        ends with .parquet, CSV otherwise); runs already in the file are
+        replaced.
+        """
+        df = self.to_frame()
+        existing = MetricStore.load(filename).to_frame()
+        existing = existing[~existing["run_id"].isin(self.runs())]
+        if existing.shape[0] > 0:
+            df = pd.concat([existing, df], ignore_index=True)
+
+        # write to a temporary file first so that readers never see a partial file
+        tmp_filename = "%s.%d.tmp" % (filename, os.getpid())
+        if filename.endswith(".parquet"):
+            df.to_parquet(tmp_filename, index=False)
+        else:
+            df.to_csv(tmp_filename, index=False)
+        os.replace(tmp_filename, filename)
@@ -0,0 +1,327 @@
+"""
+Mock inference servers for benchmarking the load generator itself: an
+OpenAI-compatible `/v1/completions` server (streaming server-sent events
+like vLLM) and a TGIS `GenerateStream` gRPC server. Tokens are produced
+with a configurable time to first token and inter-token latency, both of
+which grow with the number of requests in flight, and failures can be
+injected. The generated text is a deterministic function of the prompt
+and the seed, so requests recorded by generate-input against a mock
+server are consistent when replayed by fmperf.loadgen.run.
+
+    python -m fmperf.loadgen.mock_server --port 8000 --ttft 0.05 --itl 0.01
+"""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+
+VOCAB = [
+    " the",
+    " model",
+    " token",
+    " of",
+    " and",
+    " server",
+    " a",
+    " load",
+    " to",
+    " in",
+    " request",
+    " is",
+    " latency",
+    " for",
+    " batch",
+    " on",
+]
+
+
+class InjectedFailure(Exception):
+    pass
+
+
+class MockModel:
+    """
+    Token generation shared by the mock servers. With `n` requests in
+    flight, the time to first token and the inter-token latency are
+    stretched by a factor of 1 + batch_slowdown * (n - 1). A request fails
+    up front with probability `failure_rate` and is aborted midway with
+    probability `abort_rate`.
+    """
+
+    def __init__(
+        self,
+        ttft=0.05,
+        itl=0.01,
+        batch_slowdown=0.0,
+        failure_rate=0.0,
+        abort_rate=0.0,
+        seed=0,
+    ):
+        self.ttft = ttft
+        self.itl = itl
+        self.batch_slowdown = batch_slowdown
+        self.failure_rate = failure_rate
+        self.abort_rate = abort_rate
+
+        self.lock = threading.Lock()
+        self.rs = random.Random(seed)
+        self.in_flight = 0
+
+    def _slowdown(self):
+        with self.lock:
+            return 1.0 + self.batch_slowdown * max(self.in_flight - 1, 0)
+
+    def get_tokens(self, prompt, seed, n):
+        key = hashlib.sha256(json.dumps([prompt, seed]).encode("utf-8")).digest()
+        return [VOCAB[(key[i % len(key)] + i) % len(VOCAB)] for i in range(n)]
+
+    def generate(self, prompt, seed, max_tokens):
+        """Yield the tokens of a request at the simulated pace."""
+        with self.lock:
+            if self.rs.random() < self.failure_rate:
+                raise InjectedFailure("injected failure")
+            abort_at = None
+            if self.rs.random() < self.abort_rate:
+                abort_at = self.rs.randrange(max(max_tokens, 1))
+            self.in_flight += 1
+
+        try:
+            t = time.perf_counter()
+            delay = self.ttft
+            for i, token in enumerate(self.get_tokens(prompt, seed, max_tokens)):
+                # keep the schedule rather than the gaps, so that the time
+                # spent writing the responses does not add up
+                t += delay * self._slowdown()
+                remaining = t - time.perf_counter()
+                if remaining > 0:
+                    time.sleep(remaining)
+                if i == abort_at:
+                    raise InjectedFailure("injected abort")
+                yield token
+                delay = self.itl
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+
+def count_prompt_tokens(prompt):
+    if isinstance(prompt, list):
+        return len(prompt)
+    return len(str(prompt).split())
+
+
+class _VLLMHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # send every event at once instead of batching small writes
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, data):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_chunk(self, data):
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.path == "/v1/models":
+            self._send_json(
+                200,
+                {
+                    "object": "list",
+                    "data": [{"id": self.server.model_id, "object": "model"}],
+                },
+            )
+        elif self.path == "/health":
+            self._send_json(200, {})
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        if self.path != "/v1/completions":
+            return self._send_json(404, {"error": "not found"})
+
+        prompt = request.get("prompt", "")
+        max_tokens = request.get("max_tokens", 16)
+        prompt_tokens = count_prompt_tokens(prompt)
+        tokens = self.server.model.generate(prompt, request.get("seed"), max_tokens)
+
+        if not request.get("stream", False):
+            try:
+                text = "".join(tokens)
+            except InjectedFailure as e:
+                return self._send_json(503, {"error": str(e)})
+            return self._send_json(
+                200,
+                {
+                    "object": "text_completion",
+                    "model": self.server.model_id,
+                    "choices": [
+                        {
+                            "index": 0,
+                            "text": text,
+                            "logprobs": None,
+                            "finish_reason": "length",
+                            "stop_reason": None,
+                        }
+                    ],
+                    "usage": {
+                        "prompt_tokens": prompt_tokens,
+                        "completion_tokens": max_tokens,
+                        "total_tokens": prompt_tokens + max_tokens,
+                    },
+                },
+            )
+
+        try:
+            token = next(tokens, None)
+        except InjectedFailure as e:
+            return self._send_json(503, {"error": str(e)})
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        completion_tokens = 0
+        try:
+            while token is not None:
+                completion_tokens += 1
+                last = completion_tokens == max_tokens
+                data = {
+                    "object": "text_completion",
+                    "model": self.server.model_id,
+                    "choices": [
+                        {
+                            "index": 0,
+                            "text": token,
+                            "logprobs": None,
+                            "finish_reason": "length" if last else None,
+                            "stop_reason": None,
+                        }
+                    ],
+                    # as with stream_options.continuous_usage_stats
+                    "usage": {
+                        "prompt_tokens": prompt_tokens,
+                        "completion_tokens": completion_tokens,
+                        "total_tokens": prompt_tokens + completion_tokens,
+                    },
+                }
+                self._send_chunk(b"data: %s\n\n" % (json.dumps(data).encode("utf-8")))
+                token = next(tokens, None)
+            self._send_chunk(b"data: [DONE]\n\n")
+            self._send_chunk(b"")
+        except InjectedFailure:
+            # drop the connection without terminating the stream
+            self.close_connection = True
+        except (BrokenPipeError, ConnectionResetError):
+            # clients may hang up once they have seen the finish_reason
+            self.close_connection = True
+
+
+def make_vllm_server(model, host="0.0.0.0", port=8000, model_id="mock-model"):
+    """Return the (not yet serving) HTTP server; port 0 picks a free port."""
+    server = ThreadingHTTPServer((host, port), _VLLMHandler)
+    server.daemon_threads = True
+    server.model = model
+    server.model_id = model_id
+    return server
+
+
+def make_tgis_server(model, host="0.0.0.0", port=8033, max_workers=256):
+    """Return the started gRPC server; needs grpcio and the TGIS protos."""
+    import concurrent.futures
+    import grpc
+    from google.protobuf import json_format
+    from text_generation_tests.pb import generation_pb2 as pb2
+    from text_generation_tests.pb import generation_pb2_grpc as gpb2
+
+    class Servicer(gpb2.GenerationServiceServicer):
+        def GenerateStream(self, request, context):
+            max_tokens = request.params.stopping.max_new_tokens or 20
+            tokens = model.generate(
+                request.request.text, request.params.sampling.seed, max_tokens
+            )
+            try:
+                # the first response only carries the input token count
+                token = next(tokens, None)
+                yield json_format.ParseDict(
+                    {"inputTokenCount": count_prompt_tokens(request.request.text)},
+                    pb2.GenerationResponse(),
+                )
+                generated = 0
+                while token is not None:
+                    generated += 1
+                    yield json_format.ParseDict(
+                        {
+                            "generatedTokenCount": generated,
+                            "text": token,
+                            "stopReason": (
+                                "MAX_TOKENS"
+                                if generated == max_tokens
+                                else "NOT_FINISHED"
+                            ),
+                        },
+                        pb2.GenerationResponse(),
+                    )
+                    token = next(tokens, None)
+            except InjectedFailure as e:
+                context.abort(grpc.StatusCode.UNAVAILABLE, str(e))
+
+    server = grpc.server(concurrent.futures.ThreadPoolExecutor(max_workers))
+    gpb2.add_GenerationServiceServicer_to_server(Servicer(), server)
+    server.add_insecure_port("%s:%d" % (host, port))
+    server.start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--target", choices=["vllm", "tgis"], default="vllm")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=None)
+    parser.add_argument("--model-id", default="mock-model")
+    parser.add_argument("--ttft", type=float, default=0.05, help="seconds")
+    parser.add_argument("--itl", type=float, default=0.01, help="seconds")
+    parser.add_argument(
+        "--batch-slowdown",
+        type=float,
+        default=0.0,
+        help="relative slowdown per additional request in flight",
+    )
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--abort-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    model = MockModel(
+        ttft=args.ttft,
+        itl=args.itl,
+        batch_slowdown=args.batch_slowdown,
+        failure_rate=args.failure_rate,
+        abort_rate=args.abort_rate,
+        seed=args.seed,
+    )
+
+    if args.target == "vllm":
+        server = make_vllm_server(
+            model, args.host, args.port or 8000, model_id=args.model_id
+        )
+        print(">> serving mock vllm on %s:%d" % server.server_address)
+        server.serve_forever()
+    else:
+        server = make_tgis_server(model, args.host, args.port or 8033)
+        print(">> serving mock tgis on %s:%d" % (args.host, args.port or 8033))
+        server.wait_for_termination()
@@ -0,0 +1,169 @@
+import functools
+import os
+import threading
+import time
+
+import numpy as np
+
+# period at which the lag monitor asks to be woken up
+LAG_INTERVAL = 0.01
+
+# seconds for which the lag of the idle process is measured before the
+# first run of the process
+CALIBRATION_SECONDS = 0.2
+
+# the client is flagged as saturated when its mean scheduling lag exceeds
+# this fraction of the median inter-token latency, or when it keeps the cores
+# it may run on busy for this fraction
+LAG_WARN_FRACTION = 0.05
+CPU_WARN_UTILISATION = 0.9
+
+
+def _percentiles_ms(values_ns, prefix):
+    if len(values_ns) == 0:
+        return {"%s_p50" % (prefix): None, "%s_p99" % (prefix): None}
+    x = np.array(values_ns) / 1000.0 / 1000.0
+    return {
+        "%s_p50" % (prefix): float(np.percentile(x, 50)),
+        "%s_p99" % (prefix): float(np.percentile(x, 99)),
+    }
+
+
+def get_num_cpus() -> int:
+    # the cores the process may run on (e.g. limited by the cpuset of a pod)
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+class OverheadMonitor:
+    """
+    Measure the overhead of the load generator while it runs: the CPU time
+    of the process, the scheduling lag of a thread which asks to be woken up
+    every `interval` seconds (it is late when the GIL or the cores are busy
+    with the streaming threads, and so are the timestamps of the responses)
+    and the gap between a response being read from the socket (for gRPC,
+    returned by the client library) and its record being written (see
+    add_gap). The lag of the idle process (the
+    wake-up latency of the OS) is measured once per process (see calibrate)
+    and only the lag on top of it is attributed to the load generator.
+    """
+
+    def __init__(self, interval=LAG_INTERVAL, calibration_seconds=CALIBRATION_SECONDS):
+        self.interval = interval
+        self.calibration_seconds = calibration_seconds
+        self.idle_lags = []
+        self.lags = []
+        self.gaps = []
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def _run(self, lags, deadline=None):
+        expected = time.perf_counter() + self.interval
+        while not self.stopped.wait(max(expected - time.perf_counter(), 0.0)):
+            now = time.perf_counter()
+            lags.append(int((now - expected) * 1000 * 1000 * 1000))
+            expected = now + self.interval
+            if deadline is not None and now > deadline:
+                return
+
+    def start(self):
+        self.idle_lags = list(calibrate(self.interval, self.calibration_seconds))
+        self.cpu_start = time.process_time()
+        self.wall_start = time.perf_counter()
+        self.thread = threading.Thread(target=self._run, args=(self.lags,), daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        self.cpu_seconds = time.process_time() - self.cpu_start
+        self.wall_seconds = time.perf_counter() - self.wall_start
+
+    def add_gap(self, gap_ns):
+        # list.append is atomic, so the streaming threads need no lock
+        self.gaps.append(gap_ns)
+
+    def summarize(self, median_itl_ms=None) -> dict:
+        """
+        Summarize the overhead of the run, including warnings when the client
+        may have biased the latencies (compared against `median_itl_ms`).
+        """
+        idle_lag_ms = (
+            float(np.median(self.idle_lags)) / 1000.0 / 1000.0
+            if self.idle_lags
+            else 0.0
+        )
+        num_cpus = get_num_cpus()
+        out = {
+            "cpu_seconds": self.cpu_seconds,
+            "wall_seconds": self.wall_seconds,
+            "cpu_utilisation": self.cpu_seconds
+            / max(self.wall_seconds, 1e-9)
+            / num_cpus,
+            "num_cpus": num_cpus,
+            "lag_ms_mean": (
+                float(np.mean(self.lags)) / 1000.0 / 1000.0 if self.lags else None
+            ),
+            "lag_ms_max": (
+                float(np.max(self.lags)) / 1000.0 / 1000.0 if self.lags else None
+            ),
+            "idle_lag_ms": idle_lag_ms,
+            "median_itl_ms": median_itl_ms,
+        }
+        out.update(_percentiles_ms(self.lags, "lag_ms"))
+        out.update(_percentiles_ms(self.gaps, "record_gap_ms"))
+
+        warnings = []
+        if (
+            median_itl_ms
+            and out["lag_ms_mean"] is not None
+            and out["lag_ms_mean"] - idle_lag_ms > LAG_WARN_FRACTION * median_itl_ms
+        ):
+            warnings.append(
+                "mean scheduling lag of %.3f ms (%.3f ms when idle) is above "
+                "%d%% of the median inter-token latency (%.3f ms)"
+                % (
+                    out["lag_ms_mean"],
+                    idle_lag_ms,
+                    LAG_WARN_FRACTION * 100,
+                    median_itl_ms,
+                )
+            )
+        if out["cpu_utilisation"] > CPU_WARN_UTILISATION:
+            warnings.append(
+                "the load generator kept %.0f%% of its %d cores busy"
+                % (out["cpu_utilisation"] * 100, num_cpus)
+            )
+        out["warnings"] = warnings
+        return out
+
+
+@functools.lru_cache(maxsize=None)
+def calibrate(interval=LAG_INTERVAL, seconds=CALIBRATION_SECONDS) -> tuple:
+    """
+    Scheduling lags (ns) of the idle process over `seconds`, measured only
+    once per process as the runs of a sweep share them.
+    """
+    monitor = OverheadMonitor(interval, seconds)
+    monitor._run(monitor.idle_lags, time.perf_counter() + seconds)
+    return tuple(monitor.idle_lags)
+
+
+def print_overhead(overhead: dict):
+    def fmt(x):
+        return "n/a" if x is None else "%.3f ms" % (x)
+
+    print(
+        ">> client overhead: cpu = %.0f%% of %d cores, lag p50 = %s, p99 = %s, record gap p50 = %s, p99 = %s"
+        % (
+            overhead["cpu_utilisation"] * 100,
+            overhead["num_cpus"],
+            fmt(overhead["lag_ms_p50"]),
+            fmt(overhead["lag_ms_p99"]),
+            fmt(overhead["record_gap_ms_p50"]),
+            fmt(overhead["record_gap_ms_p99"]),
+        )
+    )
+    for warning in overhead["warnings"]:
+        print(">> WARNING: client may be saturated: %s" % (warning))
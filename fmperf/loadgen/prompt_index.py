@@ -0,0 +1,55 @@
+import numpy as np
+
+
+class PromptIndex:
+    """
+    Token-length index over a corpus of seed texts.
+
+    Every text is tokenized exactly once. The token ids of all texts are kept
+    in one flat array together with the prefix lengths (offsets) of the texts,
+    and the text lengths are kept sorted so that prompts of a requested length
+    can be found with a binary search instead of re-tokenizing per sample.
+    """
+
+    def __init__(self, text_ids):
+        lengths = np.array([len(x) for x in text_ids], dtype=np.int64)
+        if len(lengths) == 0 or lengths.sum() == 0:
+            raise ValueError("Cannot build prompts from an empty corpus")
+
+        self.ids = np.concatenate([np.asarray(x, dtype=np.int64) for x in text_ids])
+        self.offsets = np.concatenate([[0], np.cumsum(lengths)])
+
+        # drop empty texts from the search, they can never end a prompt
+        nonempty = np.flatnonzero(lengths > 0)
+        self.order = nonempty[np.argsort(lengths[nonempty], kind="stable")]
+        self.sorted_lengths = lengths[self.order]
+
+    @classmethod
+    def from_texts(cls, tokenizer, texts):
+        """
+        Index `texts` without special tokens (BOS, EOS, ...), which would
+        otherwise end up in the middle of prompts running across texts.
+        """
+        special_ids = set(tokenizer.all_special_ids)
+        text_ids = tokenizer(texts, add_special_tokens=False).input_ids
+        return cls([[x for x in ids if x not in special_ids] for ids in text_ids])
+
+    def get_prompt_ids(self, n_tokens, sample_idx=0):
+        """
+        Return exactly `n_tokens` token ids ending at the end of a seed text.
+
+        Texts which are at least `n_tokens` long are found by binary search
+        and used in turn (selected by `sample_idx`); their last `n_tokens`
+        ids are returned. If no text is long enough, the prompt ends at the
+        longest text and runs across the preceding texts of the corpus,
+        wrapping around as needed.
+        """
+        pos = np.searchsorted(self.sorted_lengths, n_tokens, side="left")
+        if pos < len(self.order):
+            candidates = self.order[pos:]
+        else:
+            candidates = self.order[-1:]
+
+        text_idx = candidates[sample_idx % len(candidates)]
+        end = self.offsets[text_idx + 1]
+        return np.take(self.ids, np.arange(end - n_tokens, end), mode="wrap").tolist()
@@ -0,0 +1,256 @@
+import numpy as np
+import pandas as pd
+
+FORMAT_VERSION = 1
+
+# columns of the request model which hold integer values
+INTEGER_COLUMNS = [
+    "generated_token_count",
+    "input_token_count",
+    "batch_size",
+    "params.top_k",
+    "is_greedy",
+]
+
+# columns of the request model which hold boolean values
+BOOLEAN_COLUMNS = ["is_greedy"]
+
+
+def get_column_dtype(column: str):
+    if column in BOOLEAN_COLUMNS:
+        return np.bool_
+    if column in INTEGER_COLUMNS:
+        return np.int64
+    return np.float64
+
+
+def cast_column(column: str, vals):
+    """Cast decoded bin labels of a column to the type of its values."""
+    if column in INTEGER_COLUMNS:
+        # np.rint rounds half to even, like the builtin round
+        vals = np.rint(np.asarray(vals, dtype=np.float64)).astype(np.int64)
+    return np.asarray(vals).astype(get_column_dtype(column))
+
+
+def fit_bins(uniq, counts, n_bins):
+    """
+    Fit at most `n_bins` bins of roughly equal weight to the sorted unique
+    values `uniq` of a column occurring `counts` times. Returns the bin edges
+    (first value of every bin), the bin labels (mean value of every bin) and
+    the first rank of every bin followed by the total count.
+    """
+    n_val = int(counts.sum())
+    ranks = np.concatenate([[0], np.cumsum(counts)[:-1]])
+
+    if len(uniq) <= n_bins:
+        return list(uniq), list(uniq), list(ranks) + [n_val]
+
+    edges = []
+    labels = []
+    rank_value = []
+
+    # values that are more frequent than 10% get a bin of their own
+    freqvals = counts / n_val > 0.1
+    num = n_val - counts[freqvals].sum()
+    den = n_bins - freqvals.sum()
+
+    targ = int(np.floor(num / den))
+
+    # cumulative weight before every unique value
+    cum_weight = np.concatenate([[0], np.cumsum(counts)])
+    weighted_vals = counts * uniq
+
+    pos = 0
+
+    while len(edges) < n_bins and pos < len(uniq):
+        # smallest bin starting at pos that reaches the target weight
+        end = np.searchsorted(cum_weight, cum_weight[pos] + targ, side="left")
+        end = min(max(end, pos), len(uniq))
+        bin_weight = cum_weight[end] - cum_weight[pos]
+
+        # sequential sum, to match the bin labels of the original loop
+        bin_label = np.cumsum(weighted_vals[pos:end])[-1] if end > pos else 0.0
+
+        if float(bin_weight) > 1.2 * targ and end > (pos + 1):
+            end -= 1
+            bin_weight -= counts[end]
+            bin_label -= weighted_vals[end]
+
+        edges.append(uniq[pos])
+        labels.append(bin_label / bin_weight)
+        rank_value.append(ranks[pos])
+        pos = end
+
+    rank_value.append(n_val)
+
+    return edges, labels, rank_value
+
+
+def get_bins(edges, vals):
+    """
+    Bin index of every value: bin i covers [edges[i], edges[i + 1]) and
+    values outside of [edges[0], edges[-1]) fall into the last bin.
+    """
+    n_bins = len(edges)
+    bins = np.searchsorted(np.asarray(edges), vals, side="right") - 1
+    bins[(bins < 0) | (bins >= n_bins - 1)] = n_bins - 1
+    return bins
+
+
+class RequestModel:
+    """
+    Joint distribution of request parameters over histogram bins.
+
+    The model is a table with one row per joint bin (one typed array per
+    column) and the probability of every row. It is stored as a versioned
+    .npz file of plain numeric arrays, so loading it needs neither
+    scikit-learn nor unpickling. Rows are drawn with the alias method, which
+    costs O(1) per sample after an O(rows) setup.
+    """
+
+    def __init__(self, columns, table, probs):
+        self.columns = list(columns)
+        self.table = {
+            c: np.asarray(table[c], dtype=get_column_dtype(c)) for c in columns
+        }
+        self.probs = np.asarray(probs, dtype=np.float64)
+        self.probs = self.probs / self.probs.sum()
+        self.sampler = AliasSampler(self.probs)
+
+    @classmethod
+    def from_histogram(cls, histogram):
+        """Convert a fitted CustomHistogram."""
+        columns = list(histogram.columns_)
+        rows = list(zip(*histogram.indices_flat_))
+        table = {c: np.array(rows[i]) for i, c in enumerate(columns)}
+        return cls(columns, table, histogram.probs_flat_)
+
+    @classmethod
+    def load(cls, file):
+        with np.load(file, allow_pickle=False) as data:
+            version = int(data["version"])
+            if version != FORMAT_VERSION:
+                raise ValueError("Unsupported request model version: %d" % (version))
+            columns = [str(c) for c in data["columns"]]
+            table = {c: data["column_%d" % (i)] for i, c in enumerate(columns)}
+            return cls(columns, table, data["probs"])
+
+    def save(self, file):
+        arrays = {"column_%d" % (i): self.table[c] for i, c in enumerate(self.columns)}
+        np.savez_compressed(
+            file,
+            version=np.array(FORMAT_VERSION),
+            columns=np.array(self.columns),
+            probs=self.probs,
+            **arrays,
+        )
+
+    def select(self, where=None):
+        """
+        Boolean mask of the rows satisfying the constraints in `where`, a dict
+        of column -> value. A value is either matched exactly or, if it is a
+        [min, max] pair, as an inclusive range where None leaves a side open.
+        """
+        mask = np.ones(len(self.probs), dtype=bool)
+        for c, value in (where or {}).items():
+            if c not in self.table:
+                raise ValueError("Unknown request model column: %s" % (c))
+            vals = self.table[c]
+            if isinstance(value, (list, tuple)):
+                low, high = value
+                if low is not None:
+                    mask &= vals >= low
+                if high is not None:
+                    mask &= vals <= high
+            else:
+                mask &= vals == value
+        return mask
+
+    def get_proposal(self, where=None, stratify=None):
+        """
+        Probabilities with which rows are drawn: the model restricted to the
+        rows matching `where` and, if `stratify` names a column, reweighted
+        so that every value of that column is drawn equally often.
+        """
+        q = np.where(self.select(where), self.probs, 0.0)
+        if q.sum() == 0:
+            raise ValueError("No requests in the model satisfy: %s" % (where))
+
+        if stratify is None:
+            return q / q.sum()
+
+        if stratify not in self.table:
+            raise ValueError("Unknown request model column: %s" % (stratify))
+        _, strata = np.unique(self.table[stratify], return_inverse=True)
+        strata_mass = np.bincount(strata, weights=q)
+        n_strata = np.count_nonzero(strata_mass)
+        # strata emptied by `where` are not drawn at all
+        mass = strata_mass[strata]
+        out = np.zeros_like(q)
+        np.divide(q, mass * n_strata, out=out, where=mass > 0)
+        return out
+
+    def sample_rows(self, n=1, rng=np.random, where=None, stratify=None):
+        """
+        Draw `n` row indices of the table; returns the rows and their
+        importance weights p/q, which map statistics over the samples back
+        to the full request distribution.
+        """
+        if where is None and stratify is None:
+            return self.sampler.sample(n, rng), np.ones(n)
+
+        q = self.get_proposal(where, stratify)
+        rows = AliasSampler(q).sample(n, rng)
+        return rows, self.probs[rows] / q[rows]
+
+    def sample(self, n=1, rng=np.random, where=None, stratify=None):
+        """
+        Draw `n` requests; returns one typed column per request parameter.
+        Conditional (`where`) or stratified (`stratify`) samples carry an
+        additional "weight" column.
+        """
+        rows, weights = self.sample_rows(n, rng, where, stratify)
+        out = pd.DataFrame({c: self.table[c][rows] for c in self.columns})
+        if where is not None or stratify is not None:
+            out["weight"] = weights
+        return out
+
+
+class AliasSampler:
+    """
+    Vose's alias method: O(1) draws from a discrete distribution after an
+    O(n) setup. Rows with zero probability are never drawn.
+    """
+
+    def __init__(self, probs):
+        probs = np.asarray(probs, dtype=np.float64)
+        self.support = np.flatnonzero(probs > 0)
+
+        n = len(self.support)
+        scaled = probs[self.support] / probs[self.support].sum() * n
+        self.prob = np.ones(n)
+        self.alias = np.arange(n)
+
+        small = list(np.flatnonzero(scaled < 1.0))
+        large = list(np.flatnonzero(scaled >= 1.0))
+        while small and large:
+            s = small.pop()
+            l = large.pop()
+            self.prob[s] = scaled[s]
+            self.alias[s] = l
+            scaled[l] = (scaled[l] + scaled[s]) - 1.0
+            if scaled[l] < 1.0:
+                small.append(l)
+            else:
+                large.append(l)
+
+    def sample(self, n=1, rng=np.random):
+        n_rows = len(self.support)
+        # a single uniform per sample: its integer part picks the column of the
+        # alias table and its fractional part decides between row and alias,
+        # which keeps the draws of a smaller sample a prefix of a larger one.
+        # random() is available on both RandomState and Generator
+        x = rng.random(n) * n_rows
+        rows = np.minimum(x.astype(np.int64), n_rows - 1)
+        rows = np.where(x - rows < self.prob[rows], rows, self.alias[rows])
+        return self.support[rows]
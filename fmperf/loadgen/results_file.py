@@ -0,0 +1,93 @@
+import gzip
+import hashlib
+import json
+import os
+
+# suffixes of the compressed copy of a results file and of its checksum
+GZIP_SUFFIX = ".gz"
+CHECKSUM_SUFFIX = ".sha256"
+
+# version of the results format written by run and sweep:
+# {"version": 2, "results": [records], "energy": [energy summary per run],
+#  "client_overhead": [client overhead per run and shard]}
+RESULTS_VERSION = 2
+
+
+class ChecksumError(Exception):
+    pass
+
+
+def write_results(filename: str, data) -> str:
+    """
+    Write `data` to `filename` as json together with a gzip'ed copy and the
+    sha256 digest of that copy, so that the results can be fetched from the
+    workload volume and verified (see fmperf.utils.Fetching). Returns the
+    digest.
+    """
+    raw = json.dumps(data).encode("utf-8")
+    compressed = gzip.compress(raw)
+    digest = hashlib.sha256(compressed).hexdigest()
+
+    # the checksum is written last so that its presence marks a complete copy
+    for suffix, contents in [
+        ("", raw),
+        (GZIP_SUFFIX, compressed),
+        (CHECKSUM_SUFFIX, digest.encode("utf-8")),
+    ]:
+        tmp_filename = "%s%s.%d.tmp" % (filename, suffix, os.getpid())
+        with open(tmp_filename, "wb") as f:
+            f.write(contents)
+        os.replace(tmp_filename, filename + suffix)
+
+    return digest
+
+
+def make_results(results: list, energy: list, client_overhead: list) -> dict:
+    return {
+        "version": RESULTS_VERSION,
+        "results": results,
+        "energy": energy,
+        "client_overhead": client_overhead,
+    }
+
+
+def upgrade_results(data) -> dict:
+    """
+    Convert results written by earlier versions to the current format: sweeps
+    wrote a plain list of records, runs a single energy summary (and client
+    overhead) rather than lists of them.
+    """
+    if isinstance(data, list):
+        return make_results(data, [], [])
+    if data.get("version") == RESULTS_VERSION:
+        return data
+
+    def as_list(x):
+        if not x:
+            return []
+        return x if isinstance(x, list) else [x]
+
+    return make_results(
+        data["results"],
+        as_list(data.get("energy")),
+        as_list(data.get("client_overhead")),
+    )
+
+
+def decode_results(compressed: bytes, digest: str):
+    """Verify a gzip'ed results file against its sha256 digest and parse it."""
+    actual = hashlib.sha256(compressed).hexdigest()
+    if actual != digest.strip():
+        raise ChecksumError(
+            "results checksum mismatch: expected %s, got %s" % (digest.strip(), actual)
+        )
+    return json.loads(gzip.decompress(compressed).decode("utf-8"))
+
+
+def read_results(filename: str):
+    """Read results written by write_results, verifying the compressed copy."""
+    with open(filename + GZIP_SUFFIX, "rb") as f:
+        compressed = f.read()
+    with open(filename + CHECKSUM_SUFFIX, "r") as f:
+        digest = f.read()
+    return decode_results(compressed, digest)
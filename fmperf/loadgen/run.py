@@ -2,24 +2,36 @@ import time
 import requests
 from typing import Iterable, List
 import json
-import pandas as pd
 import os
 from durations import Duration
 import numpy as np
-from fmperf.utils.approx import approx
-import grpc
-from google.protobuf import json_format
-from fmperf.utils import parse_results
 from datetime import datetime
-from .collect_energy import collect_metrics, summarize_energy
+from .results_file import make_results, write_results
+from .overhead import OverheadMonitor, print_overhead
+from .shards import get_shard_filename, get_shard_workers, wait_for_barrier
 from fmperf.utils.constants import REQUESTS_DIR, REQUESTS_FILENAME, RESULTS_FILENAME
 
 
-def run(result_filename=None):
+def run(result_filename=None, idle_end_time=None):
+    """
+    Run the load test. The idle power of the GPUs is estimated from before
+    `idle_end_time` (the start of the run by default), which a sweep sets to
+    the start of its first point; it is then only measured once.
+    """
     if result_filename is None:
         result_filename = RESULTS_FILENAME
 
+    # a run can be split across the pods of an Indexed Job; every shard runs
+    # a subset of the users (keeping their global ids) and writes its own file
+    num_shards = int(os.getenv("NUM_SHARDS", "1"))
+    shard_index = int(os.getenv("JOB_COMPLETION_INDEX", "0"))
+    barrier_name = "%s.%s" % (result_filename, os.getenv("FMPERF_RUN_ID", ""))
+    if num_shards > 1:
+        result_filename = get_shard_filename(result_filename, shard_index)
+
     def get_streaming_response_tgis(response):
+        from google.protobuf import json_format
+
         stop = False
         generated_tokens = 0
         while not stop:
@@ -36,19 +48,28 @@ def run(result_filename=None):
                 timestamp = time.time_ns()
                 yield None, 0, timestamp, False, e
 
+    def iter_lines_timed(response):
+        """
+        Yield the lines of a streamed HTTP response together with the time_ns
+        at which the chunk completing them was read from the socket.
+        """
+        pending = b""
+        for chunk in response.iter_content(chunk_size=8192):
+            timestamp = time.time_ns()
+            *lines, pending = (pending + chunk).split(b"\n")
+            for line in lines:
+                yield line, timestamp
+        if pending:
+            yield pending, time.time_ns()
+
     def get_streaming_response_vllm(response):
-        response_iter = response.iter_lines(
-            chunk_size=8192,
-            decode_unicode=False,
-            delimiter=b"\n",
-        )
+        response_iter = iter_lines_timed(response)
 
         stop = False
         prev_completion_tokens = 0
         while not stop:
             try:
-                chunk = next(response_iter)
-                timestamp = time.time_ns()
+                chunk, timestamp = next(response_iter)
                 if chunk and not stop:
                     data = chunk.decode("utf-8").strip().split("data: ")[1]
                     out = json.loads(data)["choices"][0]
@@ -84,18 +105,113 @@ def run(result_filename=None):
     backoff = Duration(os.environ["BACKOFF"])
     grace_period = Duration(os.environ["GRACE_PERIOD"])
 
+    # replay requests at their recorded arrival times instead of running
+    # closed-loop users; NUM_USERS then bounds the number of open requests
+    replay = os.getenv("REPLAY", "false").lower() != "false"
+    time_scale = float(os.getenv("TIME_SCALE", "1.0"))
+
     with open(infile, "rb") as f:
         sample_requests = json.load(f)
 
-    def worker(wid, channel):
-        rs = np.random.RandomState(seed=wid)
-
+    def get_stub(channel):
         if target == "tgis":
             from text_generation_tests.pb import generation_pb2_grpc as gpb2
 
-            stub = gpb2.GenerationServiceStub(channel)
+            return gpb2.GenerationServiceStub(channel)
+        return None
+
+    def send_request(
+        stub, wid, request_idx, sample_idx, exclude_after_ns=None, session=None
+    ):
+        """
+        Send a sample request and stream its responses; returns the records
+        of all responses, the perf_counter_ns at which the request was sent
+        and whether the request failed (and backoff should be applied).
+        """
+        sample_request = sample_requests[sample_idx]["request"]
+        # importance weight of conditionally/stratified sampled requests
+        weight = sample_requests[sample_idx].get("config", {}).get("weight", 1.0)
+
+        if target == "vllm":  # StackSpec will also use this
+            headers = {"User-Agent": "fmaas-load-test"}
+            t_send = time.perf_counter_ns()
+            t0 = time.time_ns()
+            response = (session or requests).post(
+                "http://%s/v1/completions" % (api_url),
+                headers=headers,
+                json=sample_request,
+                stream=True,
+            )
+        elif target == "tgis":
+            from google.protobuf import json_format
+            from text_generation_tests.pb import generation_pb2 as pb2
+
+            message = json_format.ParseDict(
+                sample_request, pb2.SingleGenerationRequest()
+            )
+            t_send = time.perf_counter_ns()
+            t0 = time.time_ns()
+            response = stub.GenerateStream(message)
+        else:
+            raise ValueError(f"Invalid target: {target}")
+
+        stop = False
+        response_idx = 0
+
+        if target == "vllm":  # StackSpec will also use this
+            response_generator = get_streaming_response_vllm(response)
+        elif target == "tgis":
+            response_generator = get_streaming_response_tgis(response)
+        else:
+            raise ValueError(f"Invalid target: {target}")
+
+        apply_backoff = False
+
+        output = []
+        while not stop:
+            r, n_tokens, t, ok, err = next(response_generator)
+
+            if not ok:
+                stop = True
+                # check if we have reached end of stream
+                if type(err) is StopIteration:
+                    continue
+                else:
+                    apply_backoff = True
+
+            record = {
+                "response": r,
+                "ok": ok,
+                "error": str(err),
+                "timestamp": t,
+                "exp_num_users": num_users,
+                "exp_duration": duration.to_seconds(),
+                "duration_ms": (t - t0) / 1000.0 / 1000.0,
+                "exclude": exclude_after_ns is not None and t > exclude_after_ns,
+                "worker_idx": wid,
+                "request_idx": request_idx,
+                "sample_idx": sample_idx,
+                "response_idx": response_idx,
+                "n_tokens": n_tokens,
+                "weight": weight,
+            }
+
+            output.append(record)
+            monitor.add_gap(time.time_ns() - t)
+            response_idx += 1
+            t0 = t
+
+        return output, t_send, apply_backoff
+
+    def worker(wid, channel):
+        rs = np.random.RandomState(seed=wid)
+
+        stub = get_stub(channel)
 
         t_start = time.time_ns()
+        exclude_after_ns = t_start + (
+            duration.to_seconds() + grace_period.to_seconds()
+        ) * (1000.0 * 1000.0 * 1000.0)
 
         output = []
         request_idx = 0
@@ -104,71 +220,10 @@ def run(result_filename=None):
         ):
             sample_idx = rs.randint(low=0, high=len(sample_requests))
 
-            sample_request = sample_requests[sample_idx]["request"]
-
-            if target == "vllm":  # StackSpec will also use this
-                headers = {"User-Agent": "fmaas-load-test"}
-                t0 = time.time_ns()
-                response = requests.post(
-                    "http://%s/v1/completions" % (api_url),
-                    headers=headers,
-                    json=sample_request,
-                    stream=True,
-                )
-            elif target == "tgis":
-                from text_generation_tests.pb import generation_pb2 as pb2
-
-                message = json_format.ParseDict(
-                    sample_request, pb2.SingleGenerationRequest()
-                )
-                t0 = time.time_ns()
-                response = stub.GenerateStream(message)
-            else:
-                raise ValueError(f"Invalid target: {target}")
-
-            stop = False
-            response_idx = 0
-
-            if target == "vllm":  # StackSpec will also use this
-                response_generator = get_streaming_response_vllm(response)
-            elif target == "tgis":
-                response_generator = get_streaming_response_tgis(response)
-            else:
-                raise ValueError(f"Invalid target: {target}")
-
-            apply_backoff = False
-
-            while not stop:
-                r, n_tokens, t, ok, err = next(response_generator)
-
-                if not ok:
-                    stop = True
-                    # check if we have reached end of stream
-                    if type(err) is StopIteration:
-                        continue
-                    else:
-                        apply_backoff = True
-
-                record = {
-                    "response": r,
-                    "ok": ok,
-                    "error": str(err),
-                    "timestamp": t,
-                    "exp_num_users": num_users,
-                    "exp_duration": duration.to_seconds(),
-                    "duration_ms": (t - t0) / 1000.0 / 1000.0,
-                    "exclude": (t - t_start) / 1000.0 / 1000.0 / 1000.0
-                    > (duration.to_seconds() + grace_period.to_seconds()),
-                    "worker_idx": wid,
-                    "request_idx": request_idx,
-                    "sample_idx": sample_idx,
-                    "response_idx": response_idx,
-                    "n_tokens": n_tokens,
-                }
-
-                output.append(record)
-                response_idx += 1
-                t0 = t
+            records, _, apply_backoff = send_request(
+                stub, wid, request_idx, sample_idx, exclude_after_ns
+            )
+            output.extend(records)
 
             if apply_backoff:
                 time.sleep(backoff.to_seconds())
@@ -180,33 +235,164 @@ def run(result_filename=None):
 
         return True
 
+    def wait_until(t_ns):
+        # sleep until shortly before the deadline, then spin for precision
+        while True:
+            remaining = t_ns - time.perf_counter_ns()
+            if remaining <= 0:
+                return
+            if remaining > 2 * 1000 * 1000:
+                time.sleep((remaining - 1000 * 1000) / (1000.0 * 1000.0 * 1000.0))
+
+    def replay_requests(channel):
+        """
+        Issue every sample request at its recorded arrival time (scaled by
+        TIME_SCALE) from a single dispatcher; the requests themselves are
+        streamed by NUM_USERS threads which are started up-front.
+        """
+        import queue
+        import sys
+        import threading
+
+        stub = get_stub(channel)
+
+        order = sorted(
+            range(len(sample_requests)),
+            key=lambda i: sample_requests[i]["config"]["arrival_time"],
+        )
+        # every shard issues its share of the requests on the common clock
+        order = order[shard_index::num_shards]
+
+        pending = queue.SimpleQueue()
+        outputs = {wid: [] for wid in workers}
+
+        def replay_worker(wid):
+            # keep-alive connections avoid a TCP handshake per request
+            session = requests.Session()
+            while True:
+                item = pending.get()
+                if item is None:
+                    return
+                request_idx, sample_idx, t_scheduled = item
+                records, t_send, _ = send_request(
+                    stub, wid, request_idx, sample_idx, session=session
+                )
+                skew_ms = (t_send - t_scheduled) / 1000.0 / 1000.0
+                for record in records:
+                    record["schedule_skew_ms"] = skew_ms
+                outputs[wid].extend(records)
+
+        threads = [
+            threading.Thread(target=replay_worker, args=(wid,), daemon=True)
+            for wid in workers
+        ]
+        for thread in threads:
+            thread.start()
+
+        # let the dispatcher preempt the streaming threads quickly while the
+        # requests are replayed; the interval is global to the interpreter, so
+        # it is restored afterwards
+        switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-4)
+        try:
+            t_start = time.perf_counter_ns()
+            t_start_wall = time.time_ns()
+            for request_idx, sample_idx in enumerate(order):
+                arrival_time = sample_requests[sample_idx]["config"]["arrival_time"]
+                t_scheduled = t_start + int(
+                    arrival_time * time_scale * 1000.0 * 1000.0 * 1000.0
+                )
+                wait_until(t_scheduled)
+                pending.put((request_idx, sample_idx, t_scheduled))
+
+            for thread in threads:
+                pending.put(None)
+            for thread in threads:
+                thread.join()
+        finally:
+            sys.setswitchinterval(switch_interval)
+
+        output = [record for records in outputs.values() for record in records]
+
+        # the experiment lasts from the first request to the last response
+        exp_duration = (time.time_ns() - t_start_wall) / (1000.0 * 1000.0 * 1000.0)
+        for record in output:
+            record["exp_duration"] = exp_duration
+
+        skew = np.array(
+            [r["schedule_skew_ms"] for r in output if r["response_idx"] == 0]
+        )
+        if len(skew) > 0:
+            print(
+                ">> replay schedule skew: p50 = %.3f ms, p99 = %.3f ms, max = %.3f ms"
+                % (np.percentile(skew, 50), np.percentile(skew, 99), np.max(skew))
+            )
+
+        return output
+
     from datetime import datetime
     import concurrent.futures
 
+    workers = get_shard_workers(num_users, shard_index, num_shards)
+    if num_shards > 1:
+        print(
+            ">> shard %d of %d running %d users"
+            % (shard_index, num_shards, len(workers))
+        )
+        wait_for_barrier(
+            REQUESTS_DIR,
+            barrier_name,
+            shard_index,
+            num_shards,
+            delay=float(os.getenv("BARRIER_DELAY", "2.0")),
+            timeout=float(os.getenv("BARRIER_TIMEOUT", "600.0")),
+        )
+
     energy_start_time = datetime.now().strftime("%Y-%m-%dT%H:%M:%SZ")
 
-    channel = grpc.insecure_channel(api_url) if target == "tgis" else None
+    # the client's own overhead is measured alongside the requests
+    monitor = OverheadMonitor()
+    monitor.start()
+
+    channel = None
+    if target == "tgis":
+        import grpc
 
-    with concurrent.futures.ThreadPoolExecutor(max_workers=num_users) as executor:
-        futures = []
-        for i in range(num_users):
-            futures.append(executor.submit(worker, wid=i, channel=channel))
+        channel = grpc.insecure_channel(api_url)
 
-        results = []
-        for future in concurrent.futures.as_completed(futures):
-            results.append(future.result())
+    if replay:
+        all_outputs = replay_requests(channel)
+    else:
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(len(workers), 1)
+        ) as executor:
+            futures = []
+            for i in workers:
+                futures.append(executor.submit(worker, wid=i, channel=channel))
+
+            results = []
+            for future in concurrent.futures.as_completed(futures):
+                results.append(future.result())
 
     energy_stop_time = datetime.now().strftime("%Y-%m-%dT%H:%M:%SZ")
+    monitor.stop()
 
-    all_outputs = []
-    for i in range(num_users):
-        with open("results_wid%d" % (i), "rb") as f:
-            tmp = json.load(f)
-        all_outputs.extend(tmp)
+    if not replay:
+        all_outputs = []
+        for i in workers:
+            with open("results_wid%d" % (i), "rb") as f:
+                tmp = json.load(f)
+            all_outputs.extend(tmp)
 
     def check_consistent(row):
+        # pulls in pytest, so only imported once there is something to check
+        from fmperf.utils.approx import approx
+
         if row["ok"]:
             tmp = sample_requests[row["sample_idx"]]["expected"]
+            if len(tmp) == 0:
+                # timing-only sample (generated offline)
+                return None
             tmp = tmp[row["response_idx"]]
             consistent = row["response"] == approx(tmp)
             return consistent
@@ -218,26 +404,52 @@ def run(result_filename=None):
 
     # collect and summarize energy metrics
     energy = {}
-    if os.environ.get("PROM_URL") is None:
+    if shard_index > 0:
+        print(">> energy metrics are collected by the first shard.")
+    elif os.environ.get("PROM_URL") is None:
         print(
             ">> skipped collecting energy metrics because prometheus is not available."
         )
     else:
+        from .collect_energy import (
+            collect_idle_power,
+            collect_metrics,
+            summarize_energy,
+        )
+
         step = os.environ.get("NUM_PROM_STEPS", "30")
         ns = os.environ["NAMESPACE"]
-        collect_metrics(energy_start_time, energy_stop_time, step, ns)
-        all_energy_metrics = summarize_energy(energy_start_time)
+        # the points of a sweep only query their own run
+        idle_power = (
+            collect_idle_power(idle_end_time, step, ns) if idle_end_time else None
+        )
+        store = collect_metrics(
+            energy_start_time,
+            energy_stop_time,
+            step,
+            ns,
+            idle_window=idle_end_time is None,
+        )
+        all_energy_metrics = summarize_energy(energy_start_time, store, idle_power)
         print(all_energy_metrics)
         energy = all_energy_metrics[["num_users", "energy"]].to_dict()
 
-    merged_data = {"results": all_outputs, "energy": energy}
+    itl = [r["duration_ms"] for r in all_outputs if r["ok"] and r["response_idx"] > 0]
+    client_overhead = monitor.summarize(float(np.median(itl)) if len(itl) > 0 else None)
+    print_overhead(client_overhead)
+
+    merged_data = make_results(
+        all_outputs, [energy] if energy else [], [client_overhead]
+    )
 
     print(">> writing results to file: %s" % (outfile))
-    with open(outfile, "w") as f:
-        json.dump(merged_data, f)
+    digest = write_results(outfile, merged_data)
+    print(">> results sha256: %s" % (digest))
 
     return all_outputs
 
 
 if __name__ == "__main__":
+    from fmperf.utils import parse_results
+
     parse_results(run(), print_df=True)
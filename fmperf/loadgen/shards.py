@@ -0,0 +1,84 @@
+import glob
+import os
+import time
+
+from .results_file import make_results, upgrade_results
+
+
+def get_shard_filename(filename: str, index) -> str:
+    """Name of the results file written by shard `index` of a sharded run."""
+    root, ext = os.path.splitext(filename)
+    return "%s-shard%s%s" % (root, index, ext)
+
+
+def get_shard_workers(num_users: int, index: int, count: int) -> list:
+    """
+    Global ids of the virtual users run by shard `index` out of `count`;
+    users are dealt round-robin so that every id is used exactly once.
+    """
+    return list(range(index, num_users, count))
+
+
+def wait_for_barrier(
+    directory: str,
+    name: str,
+    index: int,
+    count: int,
+    delay: float = 2.0,
+    timeout: float = 600.0,
+) -> int:
+    """
+    Synchronise the start of `count` shards through files on a shared volume.
+    Every shard announces itself with a ready file holding its wall-clock
+    time and waits for the others; all shards then agree on starting
+    `delay` seconds after the last one got ready. Returns that start time
+    (time.time_ns) once it has been reached; `name` must be unique per run.
+    """
+    pattern = os.path.join(directory, "%s.ready-*" % (name))
+    ready_file = os.path.join(directory, "%s.ready-%d" % (name, index))
+
+    tmp_filename = "%s.%d.tmp" % (ready_file, os.getpid())
+    with open(tmp_filename, "w") as f:
+        f.write(str(time.time_ns()))
+    os.replace(tmp_filename, ready_file)
+
+    t0 = time.time()
+    while True:
+        ready_files = glob.glob(pattern)
+        if len(ready_files) >= count:
+            break
+        if time.time() - t0 > timeout:
+            raise TimeoutError(
+                "only %d of %d shards got ready within %d seconds"
+                % (len(ready_files), count, timeout)
+            )
+        time.sleep(0.1)
+
+    t_ready = []
+    for filename in ready_files:
+        with open(filename, "r") as f:
+            t_ready.append(int(f.read()))
+    t_start = max(t_ready) + int(delay * 1000.0 * 1000.0 * 1000.0)
+
+    remaining = t_start - time.time_ns()
+    if remaining > 0:
+        time.sleep(remaining / (1000.0 * 1000.0 * 1000.0))
+
+    return t_start
+
+
+def merge_shards(outs: list) -> dict:
+    """
+    Merge the results written by the shards of a run. Worker ids are global
+    already; energy metrics are collected by the first shard only. The
+    client overheads of all shards (and sweep points) are kept.
+    """
+    results = []
+    energy = []
+    client_overhead = []
+    for out in map(upgrade_results, outs):
+        results.extend(out["results"])
+        if out["energy"] and not energy:
+            energy = out["energy"]
+        client_overhead.extend(out["client_overhead"])
+    return make_results(results, energy, client_overhead)
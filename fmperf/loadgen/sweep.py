@@ -1,30 +1,48 @@
 import os
 import json
+from datetime import datetime
 from .run import run
+from .results_file import make_results, upgrade_results, write_results
+from .shards import get_shard_filename
 from fmperf.utils import parse_results
 from fmperf.utils.constants import REQUESTS_DIR, RESULTS_ALL_FILENAME
 
 users = [int(u) for u in os.environ["SWEEP_USERS"].split(",")]
 
+# the points of a sweep run by an Indexed Job are sharded like single runs
+num_shards = int(os.getenv("NUM_SHARDS", "1"))
+shard_index = int(os.getenv("JOB_COMPLETION_INDEX", "0"))
+
 results = []
+energy = []
+client_overhead = []
+
+# the points run back-to-back, so the idle power of the GPUs is only measured
+# before the first one
+idle_end_time = datetime.now().strftime("%Y-%m-%dT%H:%M:%SZ")
 
 for u in users:
     os.environ["NUM_USERS"] = str(u)
 
     result_filename = "result_sweep_u%d.json" % (u)
 
-    run(result_filename)
+    run(result_filename, idle_end_time)
 
-    filename = os.path.join(REQUESTS_DIR, result_filename)
+    if num_shards > 1:
+        result_filename = get_shard_filename(result_filename, shard_index)
 
-    with open(filename, "rb") as f:
-        tmp = json.load(f)
+    with open(os.path.join(REQUESTS_DIR, result_filename), "rb") as f:
+        tmp = upgrade_results(json.load(f))
 
     results.extend(tmp["results"])
+    energy.extend(tmp["energy"])
+    client_overhead.extend(tmp["client_overhead"])
 
-    parse_results(results, print_df=True)
+    parse_results(results, print_df=True, energy=energy or None)
 
 outfile = os.path.join(REQUESTS_DIR, RESULTS_ALL_FILENAME)
+if num_shards > 1:
+    outfile = get_shard_filename(outfile, shard_index)
 print(f">> writing all results to file: {outfile}")
-with open(outfile, "w") as f:
-    json.dump(results, f)
+digest = write_results(outfile, make_results(results, energy, client_overhead))
+print(">> results sha256: %s" % (digest))
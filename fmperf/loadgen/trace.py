@@ -0,0 +1,52 @@
+import pandas as pd
+
+# columns every request trace must have
+TRACE_COLUMNS = ["arrival_time", "input_tokens", "output_tokens"]
+
+# optional sampling parameters of the traced requests and their defaults
+TRACE_DEFAULTS = {
+    "is_greedy": False,
+    "temperature": 1.0,
+    "top_k": 0,
+    "top_p": 1.0,
+}
+
+
+def load_trace(filename: str) -> pd.DataFrame:
+    """
+    Load a request trace from a CSV or JSON lines file with one request per
+    row: its arrival time in seconds and its number of input and output
+    tokens, optionally followed by its sampling parameters (requests with a
+    temperature of 0 are greedy). Requests are
+    sorted by arrival time and arrival times are made relative to the first
+    request.
+    """
+    if filename.endswith(".csv"):
+        trace = pd.read_csv(filename)
+    elif filename.endswith(".jsonl"):
+        trace = pd.read_json(filename, lines=True)
+    else:
+        raise ValueError("Unsupported trace format: %s" % (filename))
+
+    missing = [c for c in TRACE_COLUMNS if c not in trace.columns]
+    if missing:
+        raise ValueError("Trace %s has no column: %s" % (filename, ", ".join(missing)))
+    if trace.shape[0] == 0:
+        raise ValueError("Trace %s is empty" % (filename))
+
+    for c, default in TRACE_DEFAULTS.items():
+        if c not in trace.columns:
+            trace[c] = default
+        trace[c] = trace[c].fillna(default).astype(type(default))
+
+    # sampling at temperature 0 is greedy decoding
+    trace["is_greedy"] |= trace["temperature"] == 0.0
+
+    trace["arrival_time"] = trace["arrival_time"].astype(float)
+    trace["input_tokens"] = trace["input_tokens"].astype(int)
+    trace["output_tokens"] = trace["output_tokens"].astype(int)
+
+    trace = trace.sort_values("arrival_time", kind="stable").reset_index(drop=True)
+    trace["arrival_time"] -= trace["arrival_time"].iloc[0]
+
+    return trace[TRACE_COLUMNS + list(TRACE_DEFAULTS)]
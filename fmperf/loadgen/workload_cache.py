@@ -0,0 +1,173 @@
+import hashlib
+import json
+import os
+
+CACHE_VERSION = 5
+
+
+def get_digest(obj) -> str:
+    """Return a stable sha256 digest of a json-serializable object."""
+    s = json.dumps(obj, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(s.encode("utf-8")).hexdigest()
+
+
+def get_file_digest(filename) -> str:
+    """Return the sha256 digest of the contents of a file."""
+    with open(filename, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def get_tokenizer_revision(tokenizer) -> str:
+    """
+    Identify the exact tokenizer used to build prompts. The hub commit hash is
+    used when transformers recorded it, otherwise we fall back to a digest of
+    the vocabulary so that locally-modified tokenizers are still told apart.
+    """
+    revision = getattr(tokenizer, "_commit_hash", None) or getattr(
+        tokenizer, "init_kwargs", {}
+    ).get("_commit_hash")
+    if revision:
+        return revision
+    return get_digest(sorted(tokenizer.get_vocab().items()))
+
+
+def get_cache_key(params: dict) -> str:
+    """
+    Content-address a workload. `params` must contain everything that
+    influences the generated cases (workload parameters, model id, tokenizer
+    revision, seed text digest and target) except the sample size: cases are
+    generated from a fixed RNG sequence, so workloads that only differ in
+    sample size share a cache entry and larger ones extend smaller ones.
+    """
+    return get_digest({"version": CACHE_VERSION, "params": params})
+
+
+def get_cache_file(cache_dir: str, key: str) -> str:
+    return os.path.join(cache_dir, "workload-%s.json" % (key))
+
+
+def load_cache(cache_dir: str, key: str) -> dict:
+    """Return the cached cases for `key` as a dict of sample_idx -> case."""
+    try:
+        with open(get_cache_file(cache_dir, key), "r") as f:
+            entry = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+    if entry.get("key") != key:
+        return {}
+
+    return {int(idx): case for idx, case in entry["cases"].items()}
+
+
+def store_cache(cache_dir: str, key: str, params: dict, cases: dict):
+    """Merge `cases` (sample_idx -> case) into the cache entry for `key`."""
+    os.makedirs(cache_dir, exist_ok=True)
+
+    merged = load_cache(cache_dir, key)
+    merged.update(cases)
+
+    entry = {
+        "key": key,
+        "params": params,
+        "cases": {str(idx): merged[idx] for idx in sorted(merged)},
+    }
+
+    # write to a temporary file first so that readers never see a partial entry
+    filename = get_cache_file(cache_dir, key)
+    tmp_filename = "%s.%d.tmp" % (filename, os.getpid())
+    with open(tmp_filename, "w") as f:
+        json.dump(entry, f)
+    os.replace(tmp_filename, filename)
+
+
+def get_stamp_file(requests_dir: str, filename: str) -> str:
+    return os.path.join(requests_dir, "%s.key" % (filename))
+
+
+def write_stamp(requests_dir: str, filename: str, key: str, sample_size: int):
+    """Record the cache key and sample size a workload file was written for."""
+    with open(get_stamp_file(requests_dir, filename), "w") as f:
+        json.dump({"key": key, "sample_size": sample_size}, f)
+
+
+def is_up_to_date(requests_dir: str, filename: str, key: str, sample_size: int):
+    """
+    Whether the workload file `filename` exists and was written for `key`
+    and `sample_size`; files of the same name written for other parameters
+    (or by other tools) are not.
+    """
+    if not os.path.isfile(os.path.join(requests_dir, filename)):
+        return False
+    try:
+        with open(get_stamp_file(requests_dir, filename), "r") as f:
+            stamp = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return False
+    return stamp == {"key": key, "sample_size": sample_size}
+
+
+def get_journal_file(requests_dir: str, filename: str) -> str:
+    return os.path.join(requests_dir, "%s.journal" % (filename))
+
+
+def load_journal(journal_file: str, key: str) -> dict:
+    """
+    Return the cases committed to a journal as a dict of sample_idx -> case.
+    Journals written for a different cache key are ignored, as is a partially
+    written last line left behind by a crash.
+    """
+    cases = {}
+    try:
+        with open(journal_file, "r") as f:
+            lines = f.readlines()
+    except FileNotFoundError:
+        return cases
+
+    for i, line in enumerate(lines):
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError:
+            break
+        if i == 0:
+            if record.get("key") != key:
+                return {}
+        else:
+            cases[record["sample_idx"]] = record["case"]
+
+    return cases
+
+
+class Journal:
+    """
+    Append-only log of generated cases, durable after every append. Cases
+    committed by a previous (interrupted) run for the same key are available
+    in `cases` when the journal is opened.
+    """
+
+    def __init__(self, journal_file: str, key: str):
+        self.journal_file = journal_file
+        self.cases = load_journal(journal_file, key)
+
+        # rewrite the committed records so that we never append after a
+        # partially written line
+        tmp_filename = "%s.%d.tmp" % (journal_file, os.getpid())
+        with open(tmp_filename, "w") as f:
+            f.write(json.dumps({"key": key}) + "\n")
+            for sample_idx, case in self.cases.items():
+                f.write(json.dumps({"sample_idx": sample_idx, "case": case}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_filename, journal_file)
+
+        self.f = open(journal_file, "a")
+
+    def append(self, sample_idx: int, case: dict):
+        self.f.write(json.dumps({"sample_idx": sample_idx, "case": case}) + "\n")
+        self.f.flush()
+        os.fsync(self.f.fileno())
+
+    def close(self, remove: bool = False):
+        self.f.close()
+        if remove:
+            os.remove(self.journal_file)
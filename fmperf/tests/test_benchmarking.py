@@ -0,0 +1,72 @@
+import os
+import tempfile
+import unittest
+
+from fmperf import HomogeneousWorkloadSpec
+from fmperf.StackSpec import StackSpec
+from fmperf.Cluster import GeneratedWorkload
+from fmperf.utils import run_benchmark
+from fmperf.tests.test_parsing import make_results
+
+
+class FakeCluster:
+    """Records the evaluations instead of running jobs."""
+
+    def __init__(self):
+        self.evaluations = []
+
+    def generate_timestamp_id(self):
+        return "test"
+
+    def generate_workload(self, model, workload_spec, id=""):
+        return GeneratedWorkload(workload_spec, "workload.json", "vllm")
+
+    def evaluate(self, model, workload, num_users=1, **kwargs):
+        self.evaluations.append((num_users, kwargs))
+        results = []
+        for u in num_users:
+            for record in make_results():
+                record["exp_num_users"] = u
+                results.append(record)
+        return results, []
+
+
+class FakeStack(StackSpec):
+    def __init__(self):
+        self.name = "fake-stack"
+
+    def refresh_models(self):
+        pass
+
+
+class TestRunBenchmark(unittest.TestCase):
+    def test_single_job_sweep(self):
+        cluster = FakeCluster()
+        cwd = os.getcwd()
+        os.chdir(tempfile.mkdtemp())
+        try:
+            df = run_benchmark(
+                cluster,
+                stack_spec=FakeStack(),
+                workload_spec=HomogeneousWorkloadSpec(),
+                number_users=[1, 2, 4],
+                duration="5s",
+            )
+            self.assertTrue(os.path.exists("fmperf-test-result0.csv"))
+            self.assertTrue(os.path.exists("fmperf-test-results.csv"))
+        finally:
+            os.chdir(cwd)
+
+        # one job runs all points of the sweep
+        self.assertEqual(len(cluster.evaluations), 1)
+        num_users, kwargs = cluster.evaluations[0]
+        self.assertEqual(num_users, [1, 2, 4])
+        self.assertEqual(kwargs["duration"], "5s")
+
+        # one row per point in the combined table
+        self.assertEqual(list(df["exp_num_users"]), [1, 2, 4])
+        self.assertEqual(set(df["model"]), {"fake-stack"})
+
+
+if __name__ == "__main__":
+    unittest.main()
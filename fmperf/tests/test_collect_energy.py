@@ -0,0 +1,96 @@
+import glob
+import os
+import unittest
+from unittest import mock
+
+import pandas as pd
+
+from fmperf.loadgen import collect_energy as ce
+from fmperf.loadgen.metric_store import MetricSeries, MetricStore
+
+METRICS_DIR = os.path.join(os.path.dirname(__file__), "metrics")
+
+TARGET_METRICS_LIST = os.path.join(os.path.dirname(ce.__file__), "default_metrics.yaml")
+
+START = "2023-12-01T06:36:31Z"
+
+
+def load_sample_metrics(dirname):
+    """Load the per-metric CSV files of a run (as once written by collect_metrics)."""
+    store = MetricStore()
+    for filename in glob.glob(os.path.join(METRICS_DIR, dirname, "*.csv")):
+        df = pd.read_csv(filename)
+        metric = df.columns[1]
+        store.add(
+            ce.get_file_prefix(START),
+            MetricSeries(
+                metric, {"exported_pod": "flan-t5"}, df["timestamp"], df[metric]
+            ),
+        )
+    return store
+
+
+class TestCollectEnergy(unittest.TestCase):
+    def setUp(self):
+        env = {"NUM_USERS": "1", "TARGET_METRICS_LIST": TARGET_METRICS_LIST}
+        patch = mock.patch.dict(os.environ, env)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def test_file_prefix(self):
+        self.assertEqual(ce.get_file_prefix(START), "1_2023-12-01_06-36-31Z")
+
+    def test_target_metrics(self):
+        metrics = ce.get_target_metrics()
+        self.assertIn("DCGM_FI_DEV_POWER_USAGE", metrics)
+        self.assertIn("DCGM_FI_DEV_GPU_UTIL", metrics)
+        self.assertEqual(len(metrics), len(set(metrics)))
+
+    def test_no_prometheus(self):
+        with mock.patch.dict(os.environ, {"PROM_URL": ""}):
+            store = ce.collect_metrics(START, "2023-12-01T06:37:01Z", "15", "default")
+        self.assertEqual(store.runs(), [])
+
+    def test_summarize(self):
+        df = ce.summarize_energy(START, load_sample_metrics("sample_metrics"))
+
+        self.assertEqual(list(df.index), ["06:36:31"])
+        self.assertEqual(df["num_users"].iloc[0], 1)
+        # no samples before the run: the first sample is the idle power
+        self.assertAlmostEqual(df["dcgm_idle_power"].iloc[0], 76.487)
+        self.assertAlmostEqual(df["dcgm_total_energy"].iloc[0], 48.85 / 2 * 30)
+        self.assertAlmostEqual(
+            df["dcgm_gross_energy"].iloc[0], (76.487 + 125.337) / 2 * 30
+        )
+        self.assertAlmostEqual(df["DCGM_FI_DEV_GPU_UTIL"].iloc[0], 21.5)
+        self.assertAlmostEqual(df["DCGM_FI_DEV_MEM_COPY_UTIL"].iloc[0], 5.0)
+        self.assertAlmostEqual(
+            df["kepler_gpu_energy"].iloc[0], (9.5695 + 56.1521) / 2 * 30
+        )
+        self.assertAlmostEqual(
+            df["kepler_total_energy"].iloc[0],
+            (9.5695 + 56.1521 + 1.1954 + 11.2396 + 0.7111 + 1.6141) / 2 * 30,
+        )
+        # Kepler takes precedence over DCGM
+        self.assertEqual(df["energy"].iloc[0], df["kepler_total_energy"].iloc[0])
+
+    def test_summarize_missing_metrics(self):
+        # no Kepler GPU energy
+        df = ce.summarize_energy(START, load_sample_metrics("file_lacks"))
+        self.assertNotIn("kepler_gpu_energy", df)
+        self.assertAlmostEqual(
+            df["energy"].iloc[0], (1.1954 + 11.2396 + 0.7111 + 1.6141) / 2 * 30
+        )
+
+        # no DCGM power
+        df = ce.summarize_energy(START, load_sample_metrics("file_power_lacks"))
+        self.assertNotIn("dcgm_total_energy", df)
+        self.assertEqual(df["energy"].iloc[0], df["kepler_total_energy"].iloc[0])
+
+        # no metrics at all
+        df = ce.summarize_energy(START, MetricStore())
+        self.assertTrue(df["energy"].isna().all())
+
+
+if __name__ == "__main__":
+    unittest.main()
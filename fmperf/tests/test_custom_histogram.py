@@ -0,0 +1,138 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip("sklearn")
+
+from fmperf.loadgen.custom_histogram_model import CustomHistogram
+
+
+def reference_fit(vals, n_bins):
+    """Loop-based fit of a single column, as originally implemented."""
+    n_val = vals.shape[0]
+    sortind = np.argsort(vals)
+    sortval = np.array(vals)[sortind]
+
+    dd = [{"count": 1, "rank": 0, "val": sortval[0]}]
+    for i in range(1, n_val):
+        if sortval[i] != dd[-1]["val"]:
+            dd.append({"count": 1, "rank": i, "val": sortval[i]})
+        else:
+            dd[-1]["count"] += 1
+
+    edges, labels, rank_value = [], [], []
+
+    if len(dd) <= n_bins:
+        for x in dd:
+            edges.append(x["val"])
+            labels.append(x["val"])
+            rank_value.append(x["rank"])
+        rank_value.append(n_val)
+    else:
+        freqvals = [i for i, x in enumerate(dd) if x["count"] / n_val > 0.1]
+        num, den = n_val, n_bins
+        for i in freqvals:
+            num -= dd[i]["count"]
+            den -= 1
+        targ = int(np.floor(num / den))
+
+        bin_idx, pos = 0, 0
+        while bin_idx < n_bins and pos < len(dd):
+            bin_pos = pos
+            bin_weight = 0
+            bin_rank = dd[pos]["rank"]
+            bin_val = dd[pos]["val"]
+            bin_label = 0.0
+            while bin_weight < targ and pos < len(dd):
+                bin_label += dd[pos]["count"] * dd[pos]["val"]
+                bin_weight += dd[pos]["count"]
+                pos += 1
+            if float(bin_weight) > 1.2 * targ and pos > (bin_pos + 1):
+                pos -= 1
+                bin_weight -= dd[pos]["count"]
+                bin_label -= dd[pos]["count"] * dd[pos]["val"]
+            edges.append(bin_val)
+            labels.append(bin_label / bin_weight)
+            rank_value.append(bin_rank)
+            bin_idx += 1
+        rank_value.append(n_val)
+
+    codes = np.zeros(shape=(n_val,), dtype=np.uint8)
+    for i in range(len(rank_value) - 1):
+        for j in range(rank_value[i], rank_value[i + 1]):
+            codes[sortind[j]] = i
+
+    return edges, labels, codes
+
+
+@pytest.fixture
+def data():
+    rs = np.random.RandomState(0)
+    n = 5000
+    return pd.DataFrame(
+        {
+            "generated_token_count": rs.geometric(0.01, size=n),
+            "input_token_count": np.where(
+                rs.uniform(size=n) < 0.3, 512, rs.lognormal(6, 1, size=n).astype(int)
+            ),
+            "params.temperature": np.round(rs.uniform(0, 1.5, size=n), 2),
+            "batch_size": rs.randint(1, 5, size=n),
+            "is_greedy": rs.uniform(size=n) < 0.4,
+        }
+    )
+
+
+@pytest.mark.parametrize("n_bins", [4, 16, 64])
+def test_fit_transform_matches_reference(data, n_bins):
+    model = CustomHistogram(n_bins=n_bins)
+    out = model.fit_transform(data)
+
+    for c in data.columns:
+        edges, labels, codes = reference_fit(data[c].values, n_bins)
+        assert model.n_bins_[c] == len(edges)
+        assert model.bin_edges_[c] == edges
+        np.testing.assert_allclose(
+            np.asarray(model.bin_labels_[c], dtype=float),
+            np.asarray(labels, dtype=float),
+            rtol=1e-12,
+        )
+        expected = np.asarray(labels)[codes]
+        if c != "params.temperature":
+            expected = np.round(expected.astype(float)).astype(int)
+        np.testing.assert_allclose(out[c].values.astype(float), expected)
+
+    assert np.isclose(np.sum(model.probs_flat_), 1.0)
+
+
+def reference_transform(vals, edges):
+    """Loop-based bin assignment, as originally implemented."""
+    codes = np.zeros(shape=(vals.shape[0],), dtype=np.uint8)
+    for i in range(vals.shape[0]):
+        found = None
+        for bin_idx in range(len(edges) - 1):
+            if vals[i] >= edges[bin_idx] and vals[i] < edges[bin_idx + 1]:
+                found = bin_idx
+        codes[i] = len(edges) - 1 if found is None else found
+    return codes
+
+
+def test_transform_matches_reference(data):
+    model = CustomHistogram(n_bins=16)
+    model.fit_transform(data)
+
+    # include values below, between and above the fitted edges
+    rs = np.random.RandomState(1)
+    new_data = data.sample(n=1000, random_state=rs).reset_index(drop=True)
+    new_data["input_token_count"] += rs.randint(-600, 600, size=1000)
+    new_data["params.temperature"] *= 1.5
+
+    out = model.transform(new_data)
+
+    for c in data.columns:
+        codes = reference_transform(new_data[c].values, model.bin_edges_[c])
+        expected = np.asarray(model.bin_labels_[c])[codes]
+        if c != "params.temperature":
+            expected = np.round(expected.astype(float)).astype(int)
+        np.testing.assert_allclose(out[c].values.astype(float), expected)
+
+    assert out["is_greedy"].dtype == bool
@@ -0,0 +1,192 @@
+import time
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from kubernetes import client
+
+from fmperf import Cluster, vLLMModelSpec
+from fmperf.Cluster import (
+    LAST_USED_ANNOTATION,
+    IDLE_TTL_ANNOTATION,
+    IN_USE_ANNOTATION,
+)
+
+
+def make_deployment(name, manifest_hash="", available=1, annotations=None):
+    return SimpleNamespace(
+        metadata=SimpleNamespace(
+            name=name,
+            deletion_timestamp=None,
+            resource_version="1",
+            annotations=annotations,
+            labels={"fmperf/manifest-hash": manifest_hash},
+        ),
+        spec=SimpleNamespace(replicas=1),
+        status=SimpleNamespace(available_replicas=available),
+    )
+
+
+class TestDeploymentReuse(unittest.TestCase):
+    def setUp(self):
+        self.apps = mock.Mock()
+        self.core = mock.Mock()
+        self.core.read_namespaced_service.return_value = SimpleNamespace(
+            spec=SimpleNamespace(cluster_ip="10.0.0.1")
+        )
+        patches = [
+            mock.patch("fmperf.Cluster.client.AppsV1Api", return_value=self.apps),
+            mock.patch("fmperf.Cluster.client.CoreV1Api", return_value=self.core),
+            mock.patch("fmperf.Cluster.Creating"),
+            mock.patch("fmperf.Cluster.Deleting"),
+        ]
+        self.mocks = [p.start() for p in patches]
+        for p in patches:
+            self.addCleanup(p.stop)
+        self.creating, self.deleting = self.mocks[2](), self.mocks[3]()
+
+        self.cluster = Cluster("test", None, reuse_deployments=True, idle_ttl="10m")
+        # stop the heartbeats of the models left in use before unpatching
+        self.addCleanup(
+            lambda: [stop.set() for stop, _ in self.cluster.heartbeats.values()]
+        )
+
+    def spec(self):
+        return vLLMModelSpec(name="org/model", image="vllm", tensor_parallel_size=1)
+
+    def test_adopt(self):
+        self.apps.list_namespaced_deployment.return_value = SimpleNamespace(items=[])
+        model = self.cluster.deploy_model(self.spec(), "run1")
+        self.assertEqual(model.name, "fmperf-vllm-model-server-run1")
+        self.creating.create_namespaced_deployment.assert_called_once()
+        payload = self.creating.create_namespaced_deployment.call_args.kwargs["payload"]
+        manifest_hash = payload["metadata"]["labels"]["fmperf/manifest-hash"]
+        self.cluster.delete_model(model)
+        # kept around while idle
+        self.deleting.delete_namespaced_deployment.assert_not_called()
+
+        # an identical spec in a later run adopts the healthy deployment
+        self.apps.list_namespaced_deployment.return_value = SimpleNamespace(
+            items=[
+                make_deployment("unhealthy", manifest_hash, available=0),
+                make_deployment(model.name, manifest_hash),
+            ]
+        )
+        self.creating.create_namespaced_deployment.reset_mock()
+        adopted = self.cluster.deploy_model(self.spec(), "run2")
+        self.assertEqual(adopted.name, model.name)
+        self.assertEqual(adopted.url, "10.0.0.1:8000")
+        self.creating.create_namespaced_deployment.assert_not_called()
+        self.assertEqual(
+            self.apps.list_namespaced_deployment.call_args.kwargs["label_selector"],
+            "fmperf/manifest-hash=%s" % (manifest_hash),
+        )
+
+        # not adopted twice while in use
+        self.cluster.deploy_model(self.spec(), "run3")
+        self.creating.create_namespaced_deployment.assert_called_once()
+
+    def test_used_elsewhere(self):
+        self.apps.list_namespaced_deployment.return_value = SimpleNamespace(items=[])
+        self.cluster.deploy_model(self.spec(), "run1")
+        payload = self.creating.create_namespaced_deployment.call_args.kwargs["payload"]
+        manifest_hash = payload["metadata"]["labels"]["fmperf/manifest-hash"]
+        self.creating.create_namespaced_deployment.reset_mock()
+
+        now = time.time()
+        self.apps.list_namespaced_deployment.return_value = SimpleNamespace(
+            items=[
+                # benchmarked by another process
+                make_deployment(
+                    "busy",
+                    manifest_hash,
+                    annotations={
+                        IN_USE_ANNOTATION: "other",
+                        LAST_USED_ANNOTATION: str(now - 10),
+                    },
+                ),
+                # claimed by another process since the list
+                make_deployment("raced", manifest_hash),
+                # left marked as in use by a crashed process
+                make_deployment(
+                    "abandoned",
+                    manifest_hash,
+                    annotations={
+                        IN_USE_ANNOTATION: "other",
+                        LAST_USED_ANNOTATION: str(now - 3600),
+                    },
+                ),
+            ]
+        )
+
+        def patch(name, namespace, body):
+            if name == "raced":
+                raise client.exceptions.ApiException(status=409)
+
+        self.apps.patch_namespaced_deployment.side_effect = patch
+        model = self.cluster.deploy_model(self.spec(), "run2")
+        self.assertEqual(model.name, "abandoned")
+        self.creating.create_namespaced_deployment.assert_not_called()
+        claim = [
+            c.args[2]
+            for c in self.apps.patch_namespaced_deployment.call_args_list
+            if c.args[0] == "abandoned"
+        ][0]
+        self.assertEqual(claim["metadata"]["resourceVersion"], "1")
+        self.assertEqual(
+            claim["metadata"]["annotations"][IN_USE_ANNOTATION], self.cluster.owner
+        )
+
+        # released deployments are no longer marked as in use
+        self.cluster.delete_model(model)
+        release = self.apps.patch_namespaced_deployment.call_args.args[2]
+        self.assertIsNone(release["metadata"]["annotations"][IN_USE_ANNOTATION])
+
+    def test_heartbeat(self):
+        self.apps.list_namespaced_deployment.return_value = SimpleNamespace(items=[])
+        with mock.patch("fmperf.Cluster.HEARTBEAT_INTERVAL", 0.01):
+            model = self.cluster.deploy_model(self.spec(), "run1")
+
+        # last-used keeps being refreshed while the model is in use
+        patch = self.apps.patch_namespaced_deployment
+        deadline = time.monotonic() + 10
+        while patch.call_count < 3 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertGreaterEqual(patch.call_count, 3)
+        self.assertTrue(all(c.args[0] == model.name for c in patch.call_args_list))
+
+        # and no longer once it is released
+        self.cluster.delete_model(model)
+        self.assertEqual(self.cluster.heartbeats, {})
+        self.assertNotIn(model.name, self.cluster.in_use)
+
+    def test_reap(self):
+        now = time.time()
+        self.apps.list_namespaced_deployment.return_value = SimpleNamespace(
+            items=[
+                make_deployment(
+                    "idle",
+                    annotations={
+                        LAST_USED_ANNOTATION: str(now - 700),
+                        IDLE_TTL_ANNOTATION: "600",
+                    },
+                ),
+                make_deployment(
+                    "recent",
+                    annotations={
+                        LAST_USED_ANNOTATION: str(now - 60),
+                        IDLE_TTL_ANNOTATION: "600",
+                    },
+                ),
+            ]
+        )
+        self.cluster.reap_idle_models()
+        deleted = [
+            c.kwargs["name"]
+            for c in self.deleting.delete_namespaced_deployment.call_args_list
+        ]
+        self.assertEqual(deleted, ["idle"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,87 @@
+import gzip
+import os
+import subprocess
+import tempfile
+import unittest
+from unittest import mock
+
+from fmperf.loadgen.results_file import (
+    ChecksumError,
+    decode_results,
+    read_results,
+    write_results,
+)
+from fmperf.utils import Fetching
+
+
+def local_exec(self, name, namespace, command):
+    """Run the exec'ed command locally instead of inside the fetch pod."""
+    return subprocess.run(
+        ["/bin/sh", "-c", command], check=True, capture_output=True, text=True
+    ).stdout
+
+
+class TestResultsFile(unittest.TestCase):
+    def setUp(self):
+        self.filename = os.path.join(tempfile.mkdtemp(), "results.json")
+        self.data = {"results": [{"ok": True, "n_tokens": i} for i in range(100)]}
+
+    def test_roundtrip(self):
+        write_results(self.filename, self.data)
+        self.assertEqual(read_results(self.filename), self.data)
+        # the plain json copy is kept for the log fallback and sweeps
+        self.assertTrue(os.path.exists(self.filename))
+
+    def test_checksum_mismatch(self):
+        digest = write_results(self.filename, self.data)
+        with open(self.filename + ".gz", "rb") as f:
+            compressed = f.read()
+        corrupt = gzip.compress(b'{"results": []}')
+        with self.assertRaises(ChecksumError):
+            decode_results(corrupt, digest)
+        self.assertEqual(decode_results(compressed, digest + "\n"), self.data)
+
+
+class TestFetching(unittest.TestCase):
+    @mock.patch.object(Fetching, "_exec", local_exec)
+    def test_read_file_chunks(self):
+        filename = os.path.join(tempfile.mkdtemp(), "blob")
+        data = os.urandom(10000)
+        with open(filename, "wb") as f:
+            f.write(data)
+
+        fetching = Fetching(None, mock.Mock())
+        for chunk_size in [1000, 4096, 20000]:
+            self.assertEqual(
+                fetching.read_file("pod", "ns", filename, chunk_size=chunk_size), data
+            )
+
+    @mock.patch.object(Fetching, "_exec", local_exec)
+    def test_fetch_results(self):
+        filenames = [
+            os.path.join(tempfile.mkdtemp(), "fmperf-results-x-shard%d.json" % (i))
+            for i in range(2)
+        ]
+        data = [{"results": [{"ok": True, "shard": i}], "energy": {}} for i in range(2)]
+        for filename, out in zip(filenames, data):
+            write_results(filename, out)
+
+        fetching = Fetching(None, mock.Mock())
+        with mock.patch.object(
+            fetching, "create_fetch_pod"
+        ) as create, mock.patch.object(
+            fetching.deleting, "delete_namespaced_pod"
+        ) as delete:
+            out = fetching.fetch_results(
+                "fmperf-fetch-x", "ns", filenames, "image", [], [], node_name="node-a"
+            )
+
+        self.assertEqual(out, data)
+        # one fetch pod serves all files
+        create.assert_called_once()
+        self.assertEqual(create.call_args.kwargs["node_name"], "node-a")
+        delete.assert_called_once()
+
+
+if __name__ == "__main__":
+    unittest.main()
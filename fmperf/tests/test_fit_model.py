@@ -0,0 +1,86 @@
+import importlib
+import json
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from fmperf.loadgen.request_model import RequestModel
+
+fit_model = importlib.import_module("fmperf.loadgen.fit-model")
+
+
+def make_requests(n=5000, seed=0):
+    rs = np.random.RandomState(seed)
+    return pd.DataFrame(
+        {
+            "generated_token_count": rs.geometric(0.01, size=n),
+            "input_token_count": rs.lognormal(6, 1, size=n).astype(int) + 1,
+            "params.temperature": rs.choice([0.0, 0.7, 1.0], size=n),
+            "is_greedy": rs.uniform(size=n) < 0.3,
+        }
+    )
+
+
+def to_dict(model):
+    rows = zip(*[model.table[c].tolist() for c in model.columns])
+    return dict(zip(rows, model.probs.tolist()))
+
+
+@pytest.fixture
+def requests_dir():
+    return tempfile.mkdtemp()
+
+
+def test_matches_custom_histogram(requests_dir):
+    pytest.importorskip("sklearn")
+    from fmperf.loadgen.custom_histogram_model import CustomHistogram
+
+    data = make_requests()
+    filename = os.path.join(requests_dir, "requests.csv")
+    data.to_csv(filename, index=False)
+
+    model = fit_model.fit_model(
+        [filename], columns=list(data.columns), n_bins=16, chunksize=700
+    )
+
+    hist = CustomHistogram(n_bins=16)
+    hist.fit_transform(data)
+    expected = RequestModel.from_histogram(hist)
+
+    actual, expected = to_dict(model), to_dict(expected)
+    assert actual.keys() == expected.keys()
+    for key in expected:
+        assert actual[key] == pytest.approx(expected[key])
+
+
+def test_jsonl_nested(requests_dir):
+    data = make_requests(n=500)
+    filename = os.path.join(requests_dir, "requests.jsonl")
+    with open(filename, "w") as f:
+        for _, row in data.iterrows():
+            record = {
+                "generated_token_count": int(row["generated_token_count"]),
+                "input_token_count": int(row["input_token_count"]),
+                "params": {"temperature": float(row["params.temperature"])},
+                "is_greedy": bool(row["is_greedy"]),
+            }
+            f.write(json.dumps(record) + "\n")
+
+    model = fit_model.fit_model(
+        [filename], columns=list(data.columns), n_bins=8, chunksize=64
+    )
+    model_file = os.path.join(requests_dir, "model.npz")
+    model.save(model_file)
+
+    samples = RequestModel.load(model_file).sample(100)
+    assert samples["input_token_count"].dtype == np.int64
+    assert samples["is_greedy"].dtype == np.bool_
+    assert set(samples["params.temperature"]) <= {0.0, 0.7, 1.0}
+
+
+def test_unsupported_format(requests_dir):
+    with pytest.raises(ValueError):
+        fit_model.fit_model([os.path.join(requests_dir, "requests.txt")])
@@ -0,0 +1,58 @@
+import json
+import os
+import subprocess
+import sys
+import unittest
+
+# modules which are only needed to deploy models or for the TGIS target
+HEAVY_MODULES = ["kubernetes", "pandas", "grpc", "google.protobuf", "transformers"]
+
+SCRIPT = """
+import json, sys
+
+n = len(sys.modules)
+import fmperf, fmperf.utils, fmperf.loadgen.run
+lazy = len(sys.modules) - n
+loaded = [m for m in %r if m in sys.modules]
+
+n = len(sys.modules)
+# importing the submodule first must not shadow the class of the same name
+import fmperf.Cluster
+from fmperf import Cluster, HomogeneousWorkloadSpec
+from fmperf.utils import Waiting, Creating
+eager = len(sys.modules) - n
+
+print(json.dumps({
+    "lazy": lazy,
+    "eager": eager,
+    "loaded": loaded,
+    "classes": [x.__name__ for x in (Cluster, fmperf.Cluster, Waiting, Creating)],
+}))
+""" % (
+    HEAVY_MODULES
+)
+
+
+class TestImportTime(unittest.TestCase):
+    def test_lazy_imports(self):
+        env = dict(os.environ, REQUESTS_FILENAME="r.json", RESULTS_FILENAME="o.json")
+        out = subprocess.run(
+            [sys.executable, "-c", SCRIPT],
+            env=env,
+            capture_output=True,
+            check=True,
+            text=True,
+        )
+        result = json.loads(out.stdout)
+
+        self.assertEqual(result["loaded"], [])
+        self.assertEqual(
+            result["classes"], ["Cluster", "Cluster", "Waiting", "Creating"]
+        )
+        # the load generator must not pay for the cluster dependencies, which
+        # are counted in modules rather than seconds to be independent of load
+        self.assertLess(result["lazy"], result["eager"], result)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,122 @@
+import importlib.util
+import json
+import threading
+import time
+import unittest
+
+import requests
+
+from fmperf.loadgen.mock_server import MockModel, make_vllm_server
+
+
+def start(model):
+    server = make_vllm_server(model, "127.0.0.1", 0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, "http://127.0.0.1:%d/v1/completions" % (server.server_address[1])
+
+
+def stream(url, prompt, max_tokens=5, session=None):
+    """Return the events of a streamed completion with their arrival times."""
+    t0 = time.perf_counter()
+    response = (session or requests).post(
+        url,
+        json={"prompt": prompt, "max_tokens": max_tokens, "seed": 42, "stream": True},
+        stream=True,
+    )
+    response.raise_for_status()
+    events = []
+    for chunk in response.iter_lines(chunk_size=8192, delimiter=b"\n"):
+        if chunk:
+            data = chunk.decode("utf-8").split("data: ")[1]
+            if data != "[DONE]":
+                events.append((time.perf_counter() - t0, json.loads(data)))
+    return events
+
+
+class TestMockServer(unittest.TestCase):
+    def test_stream(self):
+        server, url = start(MockModel(ttft=0.1, itl=0.02))
+        self.addCleanup(server.shutdown)
+
+        session = requests.Session()
+        events = stream(url, [1, 2, 3], session=session)
+        times = [t for t, _ in events]
+        self.assertEqual(
+            [x["usage"]["completion_tokens"] for _, x in events], [1, 2, 3, 4, 5]
+        )
+        self.assertEqual(
+            [x["choices"][0]["finish_reason"] for _, x in events],
+            [None, None, None, None, "length"],
+        )
+        self.assertGreaterEqual(times[0], 0.1)
+        self.assertLess(times[0], 0.15)
+        for a, b in zip(times, times[1:]):
+            self.assertAlmostEqual(b - a, 0.02, delta=0.01)
+
+        # deterministic outputs, also over a reused connection
+        texts = [x["choices"][0]["text"] for _, x in events]
+        again = [
+            x["choices"][0]["text"] for _, x in stream(url, [1, 2, 3], session=session)
+        ]
+        other = [x["choices"][0]["text"] for _, x in stream(url, [4, 5, 6])]
+        self.assertEqual(texts, again)
+        self.assertNotEqual(texts, other)
+
+    def test_batch_slowdown(self):
+        server, url = start(MockModel(ttft=0.02, itl=0.02, batch_slowdown=1.0))
+        self.addCleanup(server.shutdown)
+
+        solo = stream(url, [1])[-1][0]
+        durations = []
+
+        def target():
+            durations.append(stream(url, [1])[-1][0])
+
+        threads = [threading.Thread(target=target) for i in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertGreater(min(durations), 2 * solo)
+
+    def test_failures(self):
+        server, url = start(MockModel(ttft=0.0, itl=0.0, failure_rate=1.0))
+        self.addCleanup(server.shutdown)
+        response = requests.post(url, json={"prompt": "a", "stream": True})
+        self.assertEqual(response.status_code, 503)
+
+        server, url = start(MockModel(ttft=0.0, itl=0.0, abort_rate=1.0))
+        self.addCleanup(server.shutdown)
+        with self.assertRaises(requests.exceptions.RequestException):
+            stream(url, "a", max_tokens=10)
+
+    @unittest.skipUnless(
+        importlib.util.find_spec("grpc")
+        and importlib.util.find_spec("text_generation_tests"),
+        "grpc and the TGIS protos are not installed",
+    )
+    def test_tgis(self):
+        import grpc
+        from google.protobuf import json_format
+        from text_generation_tests.pb import generation_pb2 as pb2
+        from text_generation_tests.pb import generation_pb2_grpc as gpb2
+        from fmperf.loadgen.mock_server import make_tgis_server
+
+        server = make_tgis_server(MockModel(ttft=0.0, itl=0.0), "127.0.0.1", 18033)
+        self.addCleanup(server.stop, None)
+        stub = gpb2.GenerationServiceStub(grpc.insecure_channel("127.0.0.1:18033"))
+        message = json_format.ParseDict(
+            {
+                "params": {"stopping": {"maxNewTokens": 3}},
+                "request": {"text": "a b"},
+            },
+            pb2.SingleGenerationRequest(),
+        )
+        out = [json_format.MessageToDict(x) for x in stub.GenerateStream(message)]
+        self.assertEqual(out[0]["inputTokenCount"], 2)
+        self.assertEqual([x["generatedTokenCount"] for x in out[1:]], [1, 2, 3])
+        self.assertEqual(out[-1]["stopReason"], "MAX_TOKENS")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,71 @@
+import time
+import unittest
+from unittest import mock
+
+from fmperf.loadgen import overhead
+from fmperf.loadgen.overhead import OverheadMonitor
+
+
+class TestOverhead(unittest.TestCase):
+    def test_monitor(self):
+        monitor = OverheadMonitor(interval=0.005, calibration_seconds=0.05)
+        monitor.start()
+        self.assertGreater(len(monitor.idle_lags), 0)
+        monitor.add_gap(100 * 1000)
+        time.sleep(0.1)
+        # the monitor thread may be scheduled late on a loaded machine
+        deadline = time.monotonic() + 10
+        while len(monitor.lags) == 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        monitor.stop()
+
+        out = monitor.summarize(median_itl_ms=1000.0)
+        self.assertGreater(len(monitor.lags), 0)
+        self.assertGreaterEqual(out["wall_seconds"], 0.1)
+        self.assertAlmostEqual(out["record_gap_ms_p50"], 0.1)
+        self.assertGreaterEqual(out["lag_ms_p99"], out["lag_ms_p50"])
+        # an idle client is fast enough for 1s inter-token latencies
+        self.assertEqual(out["warnings"], [])
+
+    def test_calibrate_once(self):
+        overhead.calibrate.cache_clear()
+        first = OverheadMonitor(interval=0.005, calibration_seconds=0.05)
+        first.start()
+        first.stop()
+        second = OverheadMonitor(interval=0.005, calibration_seconds=0.05)
+        t0 = time.perf_counter()
+        second.start()
+        second.stop()
+
+        self.assertLess(time.perf_counter() - t0, 0.05)
+        self.assertEqual(second.idle_lags, first.idle_lags)
+        self.assertEqual(overhead.calibrate.cache_info().misses, 1)
+
+    def test_warnings(self):
+        monitor = OverheadMonitor()
+        monitor.idle_lags = [100 * 1000] * 10
+        monitor.lags = [1000 * 1000] * 10
+        monitor.cpu_seconds, monitor.wall_seconds = 0.5, 1.0
+
+        # 0.9 ms of lag on top of the idle lag is below 5% of 20 ms ...
+        self.assertEqual(monitor.summarize(median_itl_ms=20.0)["warnings"], [])
+        # ... but not of 10 ms
+        warnings = monitor.summarize(median_itl_ms=10.0)["warnings"]
+        self.assertEqual(len(warnings), 1)
+        self.assertIn("scheduling lag", warnings[0])
+
+        monitor.cpu_seconds = 0.95
+        with mock.patch.object(overhead, "get_num_cpus", return_value=1):
+            warnings = monitor.summarize()["warnings"]
+        self.assertEqual(len(warnings), 1)
+        self.assertIn("95%", warnings[0])
+
+        # one busy core out of four is not saturated
+        with mock.patch.object(overhead, "get_num_cpus", return_value=4):
+            out = monitor.summarize()
+        self.assertAlmostEqual(out["cpu_utilisation"], 0.95 / 4)
+        self.assertEqual(out["warnings"], [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,68 @@
+import unittest
+
+from fmperf.utils.Parsing import parse_results
+
+
+def make_results(weights=None):
+    results = []
+    timestamp = 0
+    for worker_idx, duration_ms in enumerate([10.0, 30.0]):
+        for response_idx in range(2):
+            timestamp += 1
+            record = {
+                "response": None,
+                "ok": True,
+                "error": "None",
+                "timestamp": timestamp,
+                "exp_num_users": 2,
+                "exp_duration": 1.0,
+                "duration_ms": duration_ms,
+                "exclude": False,
+                "worker_idx": worker_idx,
+                "request_idx": 0,
+                "sample_idx": worker_idx,
+                "response_idx": response_idx,
+                "n_tokens": 1,
+                "consistent": True,
+            }
+            if weights is not None:
+                record["weight"] = weights[worker_idx]
+            results.append(record)
+    return results
+
+
+class TestParseResults(unittest.TestCase):
+    def test_unweighted(self):
+        df = parse_results(make_results())
+        self.assertEqual(df.at[2, "n_requests"], 2)
+        self.assertAlmostEqual(df.at[2, "latency_prefill_ms"], 20.0)
+        self.assertAlmostEqual(df.at[2, "latency_nexttoken_ms"], 20.0)
+        self.assertAlmostEqual(df.at[2, "latency_e2e_ms"], 40.0)
+        self.assertAlmostEqual(df.at[2, "consistent_pct"], 100.0)
+
+    def test_weighted(self):
+        df = parse_results(make_results(weights=[1.0, 3.0]))
+        self.assertAlmostEqual(df.at[2, "latency_prefill_ms"], 25.0)
+        self.assertAlmostEqual(df.at[2, "latency_nexttoken_ms"], 25.0)
+        self.assertAlmostEqual(df.at[2, "latency_e2e_ms"], 50.0)
+        # counts and throughput are measured, not re-weighted
+        self.assertEqual(df.at[2, "n_requests"], 2)
+        self.assertAlmostEqual(df.at[2, "throughput"], 4.0)
+
+    def test_energy(self):
+        energy = [
+            {"num_users": {"12:00:00": 2}, "energy": {"12:00:00": 8.0}},
+            {"num_users": {"12:05:00": 4}, "energy": {"12:05:00": 100.0}},
+        ]
+        df = parse_results(make_results(), energy=energy)
+        self.assertAlmostEqual(df.at[2, "energy_j"], 8.0)
+        self.assertAlmostEqual(df.at[2, "j_per_token"], 2.0)
+        self.assertAlmostEqual(df.at[2, "tokens_per_j"], 0.5)
+
+        # no energy metrics were collected
+        df = parse_results(make_results(), energy={})
+        self.assertTrue(df["energy_j"].isna().all())
+
+
+if __name__ == "__main__":
+    unittest.main()
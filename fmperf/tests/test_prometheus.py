@@ -0,0 +1,269 @@
+import json
+import os
+import tempfile
+import threading
+import unittest
+import warnings
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
+
+from fmperf.loadgen import collect_energy as ce
+from fmperf.loadgen.metric_store import MetricSeries, MetricStore
+
+
+class FakePrometheus(BaseHTTPRequestHandler):
+    """Answers range queries with one point per step for two pods."""
+
+    requests = []
+    points = []
+    fail_first = 0
+
+    def do_GET(self):
+        params = {k: v[0] for k, v in parse_qs(urlparse(self.path).query).items()}
+        FakePrometheus.requests.append(params)
+
+        if FakePrometheus.fail_first > 0:
+            FakePrometheus.fail_first -= 1
+            self.send_response(503)
+            self.end_headers()
+            return
+
+        def to_unix(ts):
+            t = datetime.strptime(ts, ce.TIMESTAMP_FORMAT)
+            return int(t.replace(tzinfo=timezone.utc).timestamp())
+
+        start, end, step = to_unix(params["start"]), to_unix(params["end"]), 15
+        values = [[t, "1.0"] for t in range(start, end + 1, step)]
+        FakePrometheus.points.append(len(values))
+        result = [
+            {"metric": {"exported_pod": pod}, "values": values}
+            for pod in ["pod-a", "pod-b"]
+        ]
+
+        body = json.dumps({"data": {"result": result}}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestPrometheusQueries(unittest.TestCase):
+    def setUp(self):
+        FakePrometheus.requests = []
+        FakePrometheus.points = []
+        FakePrometheus.fail_first = 0
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), FakePrometheus)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.uri = "http://127.0.0.1:%d/api/v1/query_range" % (self.server.server_port)
+        ce.get_session.cache_clear()
+        ce.collect_idle_power.cache_clear()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_windows(self):
+        windows = ce.get_query_windows(
+            "2024-01-01T00:00:00Z", "2024-01-03T00:00:00Z", 15
+        )
+        self.assertEqual(windows[0][0], "2024-01-01T00:00:00Z")
+        self.assertEqual(windows[-1][1], "2024-01-03T00:00:00Z")
+        self.assertEqual(len(windows), 2)
+        self.assertEqual(
+            ce.get_query_windows("2024-01-01T00:00:00Z", "2024-01-01T00:10:00Z", "1m"),
+            [("2024-01-01T00:00:00Z", "2024-01-01T00:10:00Z")],
+        )
+
+    def test_chunked_query(self):
+        start, end = "2024-01-01T00:00:00Z", "2024-01-03T00:00:00Z"
+        results = ce.query_range(self.uri, "up", 15, start, end)
+
+        self.assertEqual(len(FakePrometheus.requests), 2)
+        self.assertTrue(max(FakePrometheus.points) <= ce.MAX_POINTS_PER_QUERY)
+        self.assertEqual(len(results), 2)
+        timestamps = [t for t, _ in results[0]["values"]]
+        # every step exactly once across the windows
+        self.assertEqual(len(timestamps), 2 * 24 * 3600 // 15 + 1)
+        self.assertEqual(len(set(timestamps)), len(timestamps))
+
+    def test_retry(self):
+        FakePrometheus.fail_first = 2
+        results = ce.query_range(
+            self.uri, "up", 15, "2024-01-01T00:00:00Z", "2024-01-01T00:01:00Z"
+        )
+        self.assertEqual(len(FakePrometheus.requests), 3)
+        self.assertEqual(len(results[0]["values"]), 5)
+
+    def test_collect_sweep_point(self):
+        env = {"PROM_URL": self.uri, "NUM_USERS": "4", "IDLE_WINDOW": "60s"}
+        start = "2024-01-01T00:10:00Z"
+        with mock.patch.dict(os.environ, env), mock.patch.object(
+            ce, "get_target_metrics", return_value=["m1"]
+        ):
+            for _ in range(2):
+                idle_power = ce.collect_idle_power("2024-01-01T00:00:00Z", 15, "ns")
+            store = ce.collect_metrics(
+                start, "2024-01-01T00:11:00Z", 15, "ns", idle_window=False
+            )
+            fprefix = ce.get_file_prefix(start)
+
+        # the idle power is measured once, before the sweep
+        self.assertEqual(
+            [(r["start"], r["end"]) for r in FakePrometheus.requests],
+            [
+                ("2023-12-31T23:59:00Z", "2024-01-01T00:00:00Z"),
+                (start, "2024-01-01T00:11:00Z"),
+            ],
+        )
+        self.assertEqual(
+            idle_power,
+            {(("exported_pod", "pod-a"),): 1.0, (("exported_pod", "pod-b"),): 1.0},
+        )
+        # and the points only query their own run
+        self.assertEqual(len(store.get(fprefix, "m1")[0]), 5)
+
+    def test_collect_metrics(self):
+        metrics_file = os.path.join(tempfile.mkdtemp(), "metrics.csv")
+        env = {"PROM_URL": self.uri, "NUM_USERS": "4", "METRICS_FILE": metrics_file}
+        start = "2024-01-01T00:00:00Z"
+        with mock.patch.dict(os.environ, env), mock.patch.object(
+            ce, "get_target_metrics", return_value=["m1", "m2", "m3"]
+        ):
+            store = ce.collect_metrics(start, "2024-01-01T00:01:00Z", 15, "default")
+            run_id = ce.get_file_prefix(start)
+
+        self.assertEqual(len(FakePrometheus.requests), 3)
+        self.assertEqual(store.runs(), [run_id])
+        for m in ["m1", "m2", "m3"]:
+            series = store.get(run_id, m)
+            self.assertEqual(
+                sorted(x.labels["exported_pod"] for x in series), ["pod-a", "pod-b"]
+            )
+            # the idle window before the run is collected as well
+            self.assertEqual(len(series[0]), 9)
+
+        # the persisted file holds the same series
+        loaded = MetricStore.load(metrics_file)
+        self.assertEqual(loaded.runs(), [run_id])
+        self.assertEqual(
+            list(loaded.get(run_id, "m2")[1].values),
+            list(store.get(run_id, "m2")[1].values),
+        )
+
+
+class TestMetricStore(unittest.TestCase):
+    def setUp(self):
+        self.store = MetricStore()
+        self.store.add(
+            "4_2024-01-01_00-00-00Z",
+            MetricSeries.from_prom_values(
+                "DCGM_FI_DEV_POWER_USAGE",
+                {"exported_pod": "pod-a"},
+                [[0, "100"], [15, "200"], [15, "200"], [30, "300"]],
+            ),
+        )
+
+    def test_dedup(self):
+        series = self.store.get("4_2024-01-01_00-00-00Z", "DCGM_FI_DEV_POWER_USAGE")
+        self.assertEqual(list(series[0].timestamps), [0, 15, 30])
+        self.assertEqual(list(series[0].values), [100, 200, 300])
+
+    def test_save_replaces_run(self):
+        filename = os.path.join(tempfile.mkdtemp(), "metrics.csv")
+        self.store.save(filename)
+        self.store.save(filename)
+
+        other = MetricStore()
+        other.add("8_2024-01-01_01-00-00Z", MetricSeries("m", {}, [0, 1], [1, 2]))
+        other.save(filename)
+
+        loaded = MetricStore.load(filename)
+        self.assertEqual(
+            sorted(loaded.runs()), ["4_2024-01-01_00-00-00Z", "8_2024-01-01_01-00-00Z"]
+        )
+        self.assertEqual(loaded.to_frame().shape[0], 5)
+
+    def test_summarize(self):
+        start_ts = "2024-01-01T00:00:00Z"
+        t0 = ce.get_unix_time(start_ts)
+        store = MetricStore()
+        run_id = "4_2024-01-01_00-00-00Z"
+        for pod, idle in [("gpu-0", 50.0), ("gpu-1", 60.0)]:
+            # idle samples before the run, then 200W for 60s at uneven steps
+            timestamps = [t0 - 30, t0 - 15, t0, t0 + 10, t0 + 40, t0 + 60]
+            values = [idle, idle, 200.0, 200.0, 200.0, 200.0]
+            store.add(
+                run_id,
+                MetricSeries(
+                    "DCGM_FI_DEV_POWER_USAGE", {"exported_pod": pod}, timestamps, values
+                ),
+            )
+        store.add(
+            run_id,
+            MetricSeries(
+                "kepler_container_gpu_joules_total",
+                {"pod_name": "pod-a"},
+                [t0 - 15, t0, t0 + 30, t0 + 60],
+                [5.0, 10.0, 20.0, 10.0],
+            ),
+        )
+
+        env = {"NUM_USERS": "4"}
+        metrics = ["DCGM_FI_DEV_POWER_USAGE", "kepler_container_gpu_joules_total"]
+        with mock.patch.dict(os.environ, env), mock.patch.object(
+            ce, "get_target_metrics", return_value=metrics
+        ):
+            df = ce.summarize_energy(start_ts, store)
+            # unrelated runs are not picked up
+            empty = ce.summarize_energy("2024-01-01T01:00:00Z", store)
+
+        self.assertEqual(df["num_users"].iloc[0], 4)
+        self.assertAlmostEqual(df["dcgm_idle_power"].iloc[0], 110.0)
+        self.assertAlmostEqual(df["dcgm_gross_energy"].iloc[0], 2 * 200.0 * 60)
+        self.assertAlmostEqual(df["dcgm_total_energy"].iloc[0], (150 + 140) * 60.0)
+        self.assertAlmostEqual(df["dcgm_power"].iloc[0], 290.0)
+        self.assertAlmostEqual(df["kepler_gpu_energy"].iloc[0], 15 * 30 + 15 * 30)
+        self.assertAlmostEqual(df["energy"].iloc[0], 900.0)
+        self.assertTrue(empty["energy"].isna().all())
+
+    def test_summarize_sweep_point(self):
+        # the previous point of a sweep kept the GPU busy until this one
+        # started, so the idle power measured before the sweep is used
+        start_ts = "2024-01-01T00:10:00Z"
+        t0 = ce.get_unix_time(start_ts)
+        store = MetricStore()
+        series = MetricSeries(
+            "DCGM_FI_DEV_POWER_USAGE",
+            {"exported_pod": "gpu-0"},
+            [t0 - 30, t0 - 15, t0, t0 + 60],
+            [180.0, 180.0, 200.0, 200.0],
+        )
+        store.add("4_2024-01-01_00-10-00Z", series)
+        store.add(
+            "4_2024-01-01_00-10-00Z",
+            MetricSeries("DCGM_FI_DEV_GPU_UTIL", {"exported_pod": "gpu-0"}, [], []),
+        )
+        metrics = ["DCGM_FI_DEV_POWER_USAGE", "DCGM_FI_DEV_GPU_UTIL"]
+
+        with mock.patch.dict(os.environ, {"NUM_USERS": "4"}), mock.patch.object(
+            ce, "get_target_metrics", return_value=metrics
+        ), warnings.catch_warnings():
+            warnings.simplefilter("error")
+            df = ce.summarize_energy(start_ts, store, {ce.get_series_key(series): 50.0})
+            # no samples in the run at all
+            empty = ce.summarize_energy("2024-01-01T01:00:00Z", store)
+
+        self.assertAlmostEqual(df["dcgm_idle_power"].iloc[0], 50.0)
+        self.assertAlmostEqual(df["dcgm_total_energy"].iloc[0], 150.0 * 60)
+        # metrics without samples in the run are left out
+        self.assertNotIn("DCGM_FI_DEV_GPU_UTIL", df)
+        self.assertNotIn("dcgm_idle_power", empty)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,65 @@
+import unittest
+from types import SimpleNamespace
+
+from fmperf.loadgen.prompt_index import PromptIndex
+
+
+class TestPromptIndex(unittest.TestCase):
+    def setUp(self):
+        self.text_ids = [
+            list(range(100, 110)),
+            list(range(200, 203)),
+            [],
+            list(range(300, 350)),
+        ]
+        self.index = PromptIndex(self.text_ids)
+
+    def test_exact_length(self):
+        for n_tokens in [1, 3, 4, 10, 11, 50, 51, 200]:
+            for sample_idx in range(5):
+                prompt = self.index.get_prompt_ids(n_tokens, sample_idx)
+                self.assertEqual(len(prompt), n_tokens)
+
+    def test_long_enough_texts_are_used(self):
+        # only the first and last texts have at least 5 tokens
+        prompts = [self.index.get_prompt_ids(5, i) for i in range(4)]
+        self.assertEqual(prompts[0], list(range(105, 110)))
+        self.assertEqual(prompts[1], list(range(345, 350)))
+        self.assertEqual(prompts[2], prompts[0])
+
+        # and only the last one has at least 11
+        self.assertEqual(self.index.get_prompt_ids(11, 0), list(range(339, 350)))
+
+    def test_wraps_when_corpus_too_short(self):
+        prompt = self.index.get_prompt_ids(70, 0)
+        self.assertEqual(prompt[-50:], list(range(300, 350)))
+        self.assertEqual(prompt[-53:-50], list(range(200, 203)))
+
+    def test_single_text_is_repeated(self):
+        index = PromptIndex([[1, 2, 3]])
+        self.assertEqual(index.get_prompt_ids(2), [2, 3])
+        self.assertEqual(index.get_prompt_ids(7), [3, 1, 2, 3, 1, 2, 3])
+
+    def test_special_tokens_are_stripped(self):
+        BOS, EOS = 1, 2
+
+        class Tokenizer:
+            all_special_ids = [BOS, EOS]
+
+            def __call__(self, texts, add_special_tokens=True):
+                ids = [[ord(c) for c in text] for text in texts]
+                if add_special_tokens:
+                    ids = [[BOS] + x for x in ids]
+                # special tokens spelled out in the text itself
+                return SimpleNamespace(input_ids=[x + [EOS] for x in ids])
+
+        index = PromptIndex.from_texts(Tokenizer(), ["ab", "cd"])
+        self.assertEqual(index.get_prompt_ids(6), [99, 100, 97, 98, 99, 100])
+
+    def test_empty_corpus(self):
+        with self.assertRaises(ValueError):
+            PromptIndex([[]])
+
+
+if __name__ == "__main__":
+    unittest.main()
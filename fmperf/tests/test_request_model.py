@@ -0,0 +1,115 @@
+import os
+import tempfile
+import unittest
+import warnings
+from importlib import resources as impresources
+
+import numpy as np
+
+import fmperf.data
+from fmperf.loadgen.request_model import RequestModel
+
+
+class TestRequestModel(unittest.TestCase):
+    def setUp(self):
+        self.model = RequestModel(
+            ["input_token_count", "params.temperature", "is_greedy"],
+            {
+                "input_token_count": [10, 20, 30, 40],
+                "params.temperature": [0.0, 0.5, 0.7, 1.0],
+                "is_greedy": [1, 0, 0, 0],
+            },
+            [0.5, 0.25, 0.2, 0.05],
+        )
+
+    def test_typed_columns(self):
+        samples = self.model.sample(10)
+        self.assertEqual(samples["input_token_count"].dtype, np.int64)
+        self.assertEqual(samples["params.temperature"].dtype, np.float64)
+        self.assertEqual(samples["is_greedy"].dtype, np.bool_)
+
+    def test_frequencies(self):
+        rng = np.random.RandomState(0)
+        rows, _ = self.model.sample_rows(200000, rng)
+        freqs = np.bincount(rows, minlength=4) / len(rows)
+        np.testing.assert_allclose(freqs, self.model.probs, atol=0.005)
+
+    def test_prefix_consistent(self):
+        small, _ = self.model.sample_rows(100, np.random.RandomState(42))
+        large, _ = self.model.sample_rows(1000, np.random.RandomState(42))
+        np.testing.assert_array_equal(small, large[:100])
+
+        # np.random.Generator is supported as well
+        small, _ = self.model.sample_rows(100, np.random.default_rng(42))
+        large, _ = self.model.sample_rows(1000, np.random.default_rng(42))
+        np.testing.assert_array_equal(small, large[:100])
+
+    def test_conditional(self):
+        samples = self.model.sample(
+            1000, np.random.RandomState(0), where={"input_token_count": [20, None]}
+        )
+        self.assertTrue((samples["input_token_count"] >= 20).all())
+        self.assertEqual(set(samples["input_token_count"]), {20, 30, 40})
+        # importance weights p/q equal the probability of the condition
+        np.testing.assert_allclose(samples["weight"], 0.5)
+
+        samples = self.model.sample(10, where={"is_greedy": True})
+        self.assertTrue(samples["is_greedy"].all())
+
+        with self.assertRaises(ValueError):
+            self.model.sample(10, where={"input_token_count": [41, None]})
+
+    def test_stratified(self):
+        rng = np.random.RandomState(0)
+        samples = self.model.sample(200000, rng, stratify="input_token_count")
+        freqs = samples["input_token_count"].value_counts(normalize=True)
+        np.testing.assert_allclose(freqs.sort_index().values, 0.25, atol=0.005)
+
+        # weighted statistics recover the full distribution
+        weighted_mean = np.average(
+            samples["input_token_count"], weights=samples["weight"]
+        )
+        expected_mean = np.dot(self.model.table["input_token_count"], self.model.probs)
+        self.assertAlmostEqual(weighted_mean, expected_mean, delta=0.1)
+
+    def test_stratified_conditional(self):
+        where = {"input_token_count": [20, None]}
+        with warnings.catch_warnings():
+            warnings.simplefilter("error")
+            q = self.model.get_proposal(where, stratify="input_token_count")
+        np.testing.assert_allclose(q, [0.0, 1 / 3, 1 / 3, 1 / 3])
+
+    def test_save_load(self):
+        filename = os.path.join(tempfile.mkdtemp(), "model.npz")
+        self.model.save(filename)
+        loaded = RequestModel.load(filename)
+
+        self.assertEqual(loaded.columns, self.model.columns)
+        np.testing.assert_array_equal(loaded.probs, self.model.probs)
+        for c in self.model.columns:
+            np.testing.assert_array_equal(loaded.table[c], self.model.table[c])
+
+        self.assertTrue(
+            loaded.sample(50, np.random.RandomState(1)).equals(
+                self.model.sample(50, np.random.RandomState(1))
+            )
+        )
+
+    def test_bundled_model(self):
+        model = RequestModel.load(impresources.files(fmperf.data) / "all_nbins_64.npz")
+        self.assertAlmostEqual(model.probs.sum(), 1.0)
+        samples = model.sample(1000)
+        self.assertTrue((samples["input_token_count"] > 0).all())
+        self.assertTrue((samples["generated_token_count"] > 0).all())
+
+        # the example constraint of the README
+        samples = model.sample(
+            100,
+            where={"input_token_count": [1000, None]},
+            stratify="generated_token_count",
+        )
+        self.assertTrue((samples["input_token_count"] >= 1000).all())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,130 @@
+import threading
+import time
+import unittest
+from unittest import mock
+
+from kubernetes import client
+
+from fmperf import vLLMModelSpec
+from fmperf.utils.Scheduling import Scheduler, get_free_gpus, get_gpu_products
+
+
+def make_spec(name, num_gpus, gpu=None):
+    return vLLMModelSpec(
+        name=name,
+        image="vllm",
+        tensor_parallel_size=num_gpus,
+        cluster_gpu_name=gpu,
+    )
+
+
+NODES = {
+    "node-a": ("NVIDIA-A100-SXM4-80GB", 4, 4),
+    "node-b": ("NVIDIA-H100-80GB-HBM3", 8, 8),
+}
+
+
+class TestScheduler(unittest.TestCase):
+    def test_gpu_products(self):
+        self.assertEqual(
+            get_gpu_products(make_spec("m", 1, "NVIDIA-A100-SXM4-80GB").affinity),
+            ["NVIDIA-A100-SXM4-80GB"],
+        )
+        self.assertIsNone(get_gpu_products(make_spec("m", 1).affinity))
+
+    def test_plan(self):
+        specs = [
+            make_spec("a100-4", 4, "NVIDIA-A100-SXM4-80GB"),
+            make_spec("a100-2", 2, "NVIDIA-A100-SXM4-80GB"),
+            make_spec("any-8", 8),
+            make_spec("any-1", 1),
+        ]
+        waves = Scheduler(NODES, max_concurrent=3).plan(specs)
+        self.assertEqual(
+            waves,
+            [[(0, "node-a"), (2, "node-b")], [(1, "node-a"), (3, "node-a")]],
+        )
+
+        # only the number of concurrent specs is bounded without capacities
+        waves = Scheduler(None, max_concurrent=3).plan(specs)
+        self.assertEqual([len(w) for w in waves], [3, 1])
+
+        with self.assertRaises(ValueError):
+            Scheduler(NODES).plan([make_spec("h100-16", 16)])
+
+        # GPUs held by other tenants delay specs rather than refuse them
+        busy = {"node-a": ("NVIDIA-A100-SXM4-80GB", 1, 4)}
+        specs = [make_spec("a100-4", 4), make_spec("a100-2", 2)]
+        waves = Scheduler(busy, max_concurrent=2).plan(specs)
+        self.assertEqual(waves, [[(0, "node-a")], [(1, "node-a")]])
+        out = Scheduler(busy, max_concurrent=2).run(specs, lambda i, spec: i)
+        self.assertEqual(out, [0, 1])
+
+        # no GPU nodes is unknown capacity rather than none at all
+        waves = Scheduler({}, max_concurrent=3).plan([make_spec("h100-16", 16)])
+        self.assertEqual(waves, [[(0, "")]])
+
+    @mock.patch("fmperf.utils.Scheduling.client.CoreV1Api")
+    def test_free_gpus(self, core):
+        node = client.V1Node(
+            metadata=client.V1ObjectMeta(
+                name="node-a", labels={"nvidia.com/gpu.product": "A100"}
+            ),
+            spec=client.V1NodeSpec(),
+            status=client.V1NodeStatus(allocatable={"nvidia.com/gpu": "4"}),
+        )
+        pod = client.V1Pod(
+            spec=client.V1PodSpec(
+                node_name="node-a",
+                containers=[
+                    client.V1Container(
+                        name="c",
+                        resources=client.V1ResourceRequirements(
+                            limits={"nvidia.com/gpu": "3"}
+                        ),
+                    )
+                ],
+            )
+        )
+        core.return_value.list_node.return_value = client.V1NodeList(items=[node])
+        core.return_value.list_pod_for_all_namespaces.return_value = client.V1PodList(
+            items=[pod]
+        )
+        self.assertEqual(get_free_gpus(None), {"node-a": ("A100", 1, 4)})
+
+        # no node advertises GPUs
+        core.return_value.list_node.return_value = client.V1NodeList(items=[])
+        self.assertIsNone(get_free_gpus(None))
+
+        # nodes cannot be listed with namespace-scoped permissions
+        core.return_value.list_node.side_effect = client.exceptions.ApiException(
+            status=403
+        )
+        self.assertIsNone(get_free_gpus(None))
+
+    def test_run(self):
+        specs = [make_spec("m%d" % (i), 4, "NVIDIA-A100-SXM4-80GB") for i in range(3)]
+        specs.append(make_spec("h100", 2, "NVIDIA-H100-80GB-HBM3"))
+
+        lock = threading.Lock()
+        running = []
+        max_a100 = [0]
+
+        def func(i, spec):
+            with lock:
+                running.append(i)
+                a100 = sum(1 for j in running if j < 3)
+                max_a100[0] = max(max_a100[0], a100)
+            time.sleep(0.05)
+            with lock:
+                running.remove(i)
+            return spec.shortname
+
+        out = Scheduler(NODES, max_concurrent=4).run(specs, func)
+        self.assertEqual(out, ["m0", "m1", "m2", "h100"])
+        # a single A100 node with 4 GPUs fits one of these at a time
+        self.assertEqual(max_a100[0], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,73 @@
+import concurrent.futures
+import tempfile
+import time
+import unittest
+
+from fmperf.loadgen.results_file import RESULTS_VERSION, make_results
+from fmperf.loadgen.shards import (
+    get_shard_filename,
+    get_shard_workers,
+    merge_shards,
+    wait_for_barrier,
+)
+
+
+class TestShards(unittest.TestCase):
+    def test_workers(self):
+        shards = [get_shard_workers(10, i, 3) for i in range(3)]
+        self.assertEqual(shards[0], [0, 3, 6, 9])
+        self.assertEqual(sorted(sum(shards, [])), list(range(10)))
+        # more shards than users
+        self.assertEqual(get_shard_workers(2, 3, 4), [])
+
+    def test_filename(self):
+        self.assertEqual(
+            get_shard_filename("/requests/fmperf-results-x.json", 2),
+            "/requests/fmperf-results-x-shard2.json",
+        )
+
+    def test_barrier(self):
+        directory = tempfile.mkdtemp()
+
+        def shard(index):
+            # shards get ready at different times
+            time.sleep(0.2 * index)
+            t_start = wait_for_barrier(directory, "run", index, 3, delay=0.1)
+            return t_start, time.time_ns()
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=3) as executor:
+            out = list(executor.map(shard, range(3)))
+
+        t_starts = set(t for t, _ in out)
+        self.assertEqual(len(t_starts), 1)
+        for t_start, t_returned in out:
+            self.assertGreaterEqual(t_returned, t_start)
+            self.assertLess(t_returned - t_start, 0.1 * 1e9)
+
+        with self.assertRaises(TimeoutError):
+            wait_for_barrier(directory, "other-run", 0, 2, timeout=0.2)
+
+    def test_merge(self):
+        outs = [
+            {"results": [{"worker_idx": 0}], "energy": {"energy": {"t": 1.0}}},
+            {"results": [{"worker_idx": 1}], "energy": {}},
+        ]
+        merged = merge_shards(outs)
+        self.assertEqual(merged["version"], RESULTS_VERSION)
+        self.assertEqual([r["worker_idx"] for r in merged["results"]], [0, 1])
+        self.assertEqual(merged["energy"], [{"energy": {"t": 1.0}}])
+        self.assertEqual(merged["client_overhead"], [])
+
+        # results of earlier versions carry a single client overhead per run
+        outs[0]["client_overhead"] = {"warnings": []}
+        outs[1] = make_results([], [], [{"warnings": []}, {"warnings": ["lag"]}])
+        self.assertEqual(len(merge_shards(outs)["client_overhead"]), 3)
+
+        # sweeps of earlier versions wrote a plain list of records
+        merged = merge_shards([[{"worker_idx": 2}]])
+        self.assertEqual(merged["results"], [{"worker_idx": 2}])
+        self.assertEqual(merged["energy"], [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,101 @@
+import json
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from kubernetes import client
+
+from fmperf import Cluster, HomogeneousWorkloadSpec, vLLMModelSpec
+from fmperf.Cluster import GeneratedWorkload
+from fmperf.utils.Waiting import Informer, _informers
+from fmperf.utils.Simulating import FakeApiServer
+
+DELAYS = {"deployment": 0.3, "pod": 0.05, "job": 0.3, "delete": 0.05}
+
+
+def logs(pod):
+    if pod["metadata"]["name"].startswith("fmperf-evaluate"):
+        return "starting\n" + json.dumps({"results": [{"ttft": 1.0}], "energy": {}})
+    return ""
+
+
+class TestSimulating(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeApiServer(delays=DELAYS, logs=logs).start()
+        self.addCleanup(self.stop)
+        # evaluate writes the pod logs to ./logs
+        cwd = os.getcwd()
+        os.chdir(tempfile.mkdtemp())
+        self.addCleanup(os.chdir, cwd)
+        # the fake server does not support exec, so results come from the log
+        self.cluster = Cluster("fake", self.server.get_apiclient(), results_in_log=True)
+
+    def stop(self):
+        # let the informers of the test expire once the server is gone
+        with mock.patch.object(Informer, "LINGER_SECONDS", 0):
+            self.server.stop()
+            deadline = time.time() + 10
+            while any(key[0] == id(self.cluster.apiclient) for key in list(_informers)):
+                self.assertLess(time.time(), deadline)
+                time.sleep(0.05)
+
+    def timed(self, func, *args, **kwargs):
+        start = time.time()
+        out = func(*args, **kwargs)
+        return out, time.time() - start
+
+    def test_orchestration(self):
+        spec = vLLMModelSpec(name="org/model", image="vllm", tensor_parallel_size=1)
+        model, elapsed = self.timed(self.cluster.deploy_model, spec, "run1")
+        self.assertGreaterEqual(elapsed, DELAYS["deployment"])
+        self.assertRegex(model.url, r"^10\.96\.\d+\.\d+:8000$")
+        # waiting on the deployment is served by a single list and watch
+        self.assertEqual(self.server.requests[("list", "deployments")], 1)
+        self.assertEqual(self.server.requests[("watch", "deployments")], 1)
+
+        workload = GeneratedWorkload(
+            spec=HomogeneousWorkloadSpec(), file="workload.json", target="vllm"
+        )
+        (perf, energy), elapsed = self.timed(
+            self.cluster.evaluate, model, workload, id="run1", delete_job=True
+        )
+        self.assertEqual(perf, [{"ttft": 1.0}])
+        self.assertGreaterEqual(elapsed, DELAYS["pod"] + DELAYS["job"])
+        # waiting on the job and on its deletion is served by a single list
+        self.assertEqual(self.server.requests[("list", "jobs")], 1)
+
+        self.cluster.delete_model(model)
+        apps = client.AppsV1Api(self.cluster.apiclient)
+        deadline = time.time() + 5
+        while apps.list_namespaced_deployment("default").items:
+            self.assertLess(time.time(), deadline)
+            time.sleep(0.05)
+
+    def test_conflict_and_selectors(self):
+        core = client.CoreV1Api(self.cluster.apiclient)
+        service = {
+            "metadata": {"name": "svc", "labels": {"app": "a"}},
+            "spec": {"ports": [{"port": 80}]},
+        }
+        core.create_namespaced_service("default", service)
+        with self.assertRaises(client.exceptions.ApiException) as e:
+            core.create_namespaced_service("default", service)
+        self.assertEqual(e.exception.reason, "Conflict")
+
+        self.assertEqual(
+            len(core.list_namespaced_service("default", label_selector="app=a").items),
+            1,
+        )
+        self.assertEqual(
+            len(core.list_namespaced_service("default", label_selector="app=b").items),
+            0,
+        )
+        with self.assertRaises(client.exceptions.ApiException) as e:
+            core.read_namespaced_service("missing", "default")
+        self.assertEqual(e.exception.status, 404)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,138 @@
+import gzip
+import os
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from kubernetes import client
+
+from fmperf.utils import Streaming
+
+
+class FakeResponse:
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.closed = False
+        self.released = False
+
+    def stream(self, amt):
+        for chunk in self.chunks:
+            if self.closed:
+                raise ValueError("closed")
+            yield chunk
+
+    def close(self):
+        self.closed = True
+
+    def release_conn(self):
+        self.released = True
+
+
+class TestStreaming(unittest.TestCase):
+    def setUp(self):
+        self.core = mock.Mock()
+        patch = mock.patch(
+            "fmperf.utils.Streaming.client.CoreV1Api", return_value=self.core
+        )
+        patch.start()
+        self.addCleanup(patch.stop)
+        self.log_dir = tempfile.mkdtemp()
+
+    def test_follow(self):
+        response = FakeResponse(
+            [
+                b"INFO: 127.0.0.1 - GET /health HTTP/1.1 200\nstarting\n",
+                b"request 1\nreq",
+                b"uest 2\nGET /metrics HTTP/1.1\n",
+                b'{"results": []}',
+            ]
+        )
+        self.core.read_namespaced_pod_log.return_value = response
+        streaming = Streaming(
+            lambda: None, mock.Mock(), self.log_dir, tail_lines=2, max_buffered_lines=2
+        )
+        streaming.follow("loadgen", "default")
+
+        self.assertEqual(
+            streaming.tail("loadgen", timeout=5), ["request 2", '{"results": []}']
+        )
+        self.assertTrue(response.released)
+        self.assertIsNone(streaming.tail("unknown"))
+
+        streaming.stop()
+        with gzip.open(os.path.join(self.log_dir, "loadgen.log.gz"), "rt") as f:
+            self.assertEqual(
+                f.read().splitlines(),
+                ["starting", "request 1", "request 2", '{"results": []}'],
+            )
+
+    def test_long_lines(self):
+        response = FakeResponse([b"a" * 6, b"b" * 6 + b"\nshort\n", b"c" * 20])
+        self.core.read_namespaced_pod_log.return_value = response
+        streaming = Streaming(
+            lambda: None, mock.Mock(), self.log_dir, max_line_length=8
+        )
+        streaming.follow("loadgen", "default")
+
+        self.assertEqual(
+            streaming.tail("loadgen", timeout=5),
+            [
+                "aaaaaabb ... [4 bytes truncated]",
+                "short",
+                "cccccccc ... [12 bytes truncated]",
+            ],
+        )
+        streaming.stop()
+
+    def test_containers(self):
+        responses = {
+            "server": FakeResponse([b"serving\n"]),
+            "sidecar": FakeResponse([b"routing\n"]),
+        }
+        self.core.read_namespaced_pod_log.side_effect = (
+            lambda pod, namespace, container, **kwargs: responses[container]
+        )
+        streaming = Streaming(lambda: None, mock.Mock(), self.log_dir)
+        pod = SimpleNamespace(
+            metadata=SimpleNamespace(name="stack"),
+            spec=SimpleNamespace(
+                containers=[SimpleNamespace(name=x) for x in responses]
+            ),
+        )
+        streaming.follow_pod(pod, "default")
+
+        self.assertEqual(streaming.tail("stack.server", timeout=5), ["serving"])
+        self.assertEqual(streaming.tail("stack.sidecar", timeout=5), ["routing"])
+        streaming.stop()
+        self.assertEqual(
+            sorted(os.listdir(self.log_dir)),
+            ["stack.server.log.gz", "stack.sidecar.log.gz"],
+        )
+
+    def test_bad_request(self):
+        # e.g. no container given for a pod with several containers
+        self.core.read_namespaced_pod_log.side_effect = client.exceptions.ApiException(
+            status=400, reason="Bad Request"
+        )
+        logger = mock.Mock()
+        streaming = Streaming(lambda: None, logger, self.log_dir)
+        streaming.follow("stack", "default")
+        self.assertEqual(streaming.tail("stack", timeout=5), [])
+        logger.warning.assert_called_once()
+        self.assertEqual(self.core.read_namespaced_pod_log.call_count, 1)
+        streaming.stop()
+
+    def test_missing_pod(self):
+        self.core.read_namespaced_pod_log.side_effect = client.exceptions.ApiException(
+            status=404
+        )
+        streaming = Streaming(lambda: None, mock.Mock(), self.log_dir)
+        streaming.follow("gone", "default")
+        self.assertEqual(streaming.tail("gone", timeout=5), [])
+        streaming.stop()
+        self.assertEqual(os.listdir(self.log_dir), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,137 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+
+from fmperf.loadgen.mock_server import MockModel, make_vllm_server
+from fmperf.loadgen.results_file import read_results
+from fmperf.loadgen.trace import load_trace
+
+
+class TestTrace(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def test_csv(self):
+        filename = os.path.join(self.dir, "trace.csv")
+        with open(filename, "w") as f:
+            f.write("arrival_time,input_tokens,output_tokens,temperature\n")
+            f.write("12.5,100,10,0.7\n")
+            f.write("10.0,200,20,\n")
+            f.write("10.25,300,30,0.0\n")
+
+        trace = load_trace(filename)
+        self.assertEqual(list(trace["arrival_time"]), [0.0, 0.25, 2.5])
+        self.assertEqual(list(trace["input_tokens"]), [200, 300, 100])
+        self.assertEqual(list(trace["temperature"]), [1.0, 0.0, 0.7])
+        self.assertEqual(list(trace["top_k"]), [0, 0, 0])
+        self.assertEqual(list(trace["is_greedy"]), [False, True, False])
+
+    def test_jsonl(self):
+        filename = os.path.join(self.dir, "trace.jsonl")
+        with open(filename, "w") as f:
+            for t in [0.5, 1.5]:
+                record = {
+                    "arrival_time": t,
+                    "input_tokens": 10,
+                    "output_tokens": 5,
+                    "is_greedy": True,
+                }
+                f.write(json.dumps(record) + "\n")
+
+        trace = load_trace(filename)
+        self.assertEqual(list(trace["arrival_time"]), [0.0, 1.0])
+        self.assertTrue(trace["is_greedy"].all())
+
+    def test_missing_column(self):
+        filename = os.path.join(self.dir, "trace.csv")
+        with open(filename, "w") as f:
+            f.write("arrival_time,input_tokens\n1.0,100\n")
+
+        with self.assertRaises(ValueError):
+            load_trace(filename)
+
+
+class TestReplay(unittest.TestCase):
+    def test_dispatch_times(self):
+        server = make_vllm_server(MockModel(ttft=0.01, itl=0.01), "127.0.0.1", 0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.shutdown)
+
+        # listed out of order; replayed by arrival time
+        arrival_times = [0.6, 0.0, 0.2, 0.8, 0.4]
+        requests_dir = tempfile.mkdtemp()
+        with open(os.path.join(requests_dir, "trace.json"), "w") as f:
+            json.dump(
+                [
+                    {
+                        "config": {"arrival_time": t},
+                        "request": {"prompt": [i], "max_tokens": 3, "stream": True},
+                        "expected": [],
+                    }
+                    for i, t in enumerate(arrival_times)
+                ],
+                f,
+            )
+
+        env = dict(
+            os.environ,
+            REQUESTS_DIR=requests_dir,
+            REQUESTS_FILENAME="trace.json",
+            RESULTS_FILENAME="results.json",
+            TARGET="vllm",
+            URL="127.0.0.1:%d" % (server.server_address[1]),
+            NUM_USERS="2",
+            DURATION="1s",
+            BACKOFF="0s",
+            GRACE_PERIOD="0s",
+            REPLAY="true",
+        )
+        env.pop("PROM_URL", None)
+        out = subprocess.run(
+            [
+                sys.executable,
+                "-c",
+                "import sys; from fmperf.loadgen.run import run; "
+                "switch_interval = sys.getswitchinterval(); run(); "
+                "print(switch_interval == sys.getswitchinterval())",
+            ],
+            env=env,
+            capture_output=True,
+            check=True,
+            text=True,
+        )
+        # the switch interval of the interpreter is restored
+        self.assertEqual(out.stdout.splitlines()[-1], "True")
+
+        records = read_results(os.path.join(requests_dir, "results.json"))["results"]
+        first = sorted(
+            [r for r in records if r["response_idx"] == 0],
+            key=lambda r: r["request_idx"],
+        )
+        self.assertTrue(all(r["ok"] for r in records))
+        self.assertEqual(len(first), len(arrival_times))
+
+        # requests are sent in the order of the trace and never early
+        self.assertEqual(
+            [arrival_times[r["sample_idx"]] for r in first], sorted(arrival_times)
+        )
+        self.assertTrue(all(r["schedule_skew_ms"] >= 0.0 for r in first))
+
+        # the skew is measured against the scheduled arrival, so the send times
+        # (the time of the first response minus its latency) follow the trace
+        t_send = [r["timestamp"] - r["duration_ms"] * 1000.0 * 1000.0 for r in first]
+        for r, t in zip(first, t_send):
+            offset = (t - t_send[0]) / (1000.0 * 1000.0 * 1000.0)
+            expected = (
+                arrival_times[r["sample_idx"]]
+                + (r["schedule_skew_ms"] - first[0]["schedule_skew_ms"]) / 1000.0
+            )
+            self.assertAlmostEqual(offset, expected, delta=0.01)
+
+
+if __name__ == "__main__":
+    unittest.main()
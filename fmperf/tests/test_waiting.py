@@ -0,0 +1,202 @@
+import queue
+import threading
+import time
+import unittest
+from unittest import mock
+
+from kubernetes import client
+
+from fmperf.utils import Waiting
+from fmperf.utils.Waiting import CloudError, Informer, _informers
+
+
+def make_deployment(name, resource_version, available=False):
+    return {
+        "metadata": {"name": name, "resourceVersion": str(resource_version)},
+        "status": {
+            "conditions": [
+                {"type": "Available", "status": "True" if available else "False"}
+            ]
+        },
+    }
+
+
+class FakeApi:
+    """Serves list requests from a dict of objects; watch events come from a queue."""
+
+    objects = {}
+    lists = 0
+    field_selectors = []
+    events = queue.Queue()
+    fail_watch = []
+
+    def __init__(self, apiclient):
+        pass
+
+    def list_namespaced_deployment(self, namespace, **kwargs):
+        FakeApi.lists += 1
+        FakeApi.field_selectors.append(kwargs.get("field_selector"))
+        return {
+            "items": list(FakeApi.objects.values()),
+            "metadata": {"resourceVersion": "10"},
+        }
+
+
+class FakeWatch:
+    watches = 0
+
+    def __init__(self):
+        FakeWatch.watches += 1
+        self.stopped = False
+
+    def stream(self, func, *args, **kwargs):
+        if FakeApi.fail_watch:
+            raise FakeApi.fail_watch.pop(0)
+        while not self.stopped:
+            try:
+                event = FakeApi.events.get(timeout=0.05)
+            except queue.Empty:
+                # server-side timeout of the watch
+                return
+            yield event
+
+    def stop(self):
+        self.stopped = True
+
+
+class TestWaiting(unittest.TestCase):
+    def setUp(self):
+        FakeApi.objects = {"a": make_deployment("a", 1), "b": make_deployment("b", 2)}
+        FakeApi.lists = 0
+        FakeApi.field_selectors = []
+        FakeApi.events = queue.Queue()
+        FakeApi.fail_watch = []
+        FakeWatch.watches = 0
+        patches = [
+            mock.patch("fmperf.utils.Waiting.watch.Watch", FakeWatch),
+            mock.patch("fmperf.utils.Waiting.client.AppsV1Api", FakeApi),
+            # informers stop as soon as their waiters are gone
+            mock.patch.object(Informer, "LINGER_SECONDS", 0),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        # every test gets its own informers
+        apiclient = object()
+        self.waiting = Waiting(lambda: apiclient, mock.Mock())
+        self.apiclient = apiclient
+
+    def wait(self, name, until, **kwargs):
+        self.waiting._wait_for(
+            name,
+            FakeApi,
+            "list_namespaced_deployment",
+            "default",
+            until=until,
+            **kwargs
+        )
+
+    def start(self, name, until, **kwargs):
+        errors = []
+
+        def target():
+            try:
+                self.wait(name, until, **kwargs)
+            except Exception as e:
+                errors.append(e)
+
+        thread = threading.Thread(target=target)
+        thread.start()
+        return thread, errors
+
+    def start_deployment_wait(self, name, until):
+        errors = []
+
+        def target():
+            try:
+                self.waiting.wait_for_namespaced_deployment(
+                    name, "default", until=until, resource_version="1"
+                )
+            except Exception as e:
+                errors.append(e)
+
+        thread = threading.Thread(target=target)
+        thread.start()
+        return thread, errors
+
+    def test_shared_informer(self):
+        waiters = [self.start(name, "available") for name in ["a", "b"]]
+        FakeApi.events.put(
+            {"type": "MODIFIED", "object": make_deployment("a", 11, available=True)}
+        )
+        FakeApi.events.put(
+            {"type": "MODIFIED", "object": make_deployment("b", 12, available=True)}
+        )
+        for thread, errors in waiters:
+            thread.join(timeout=5)
+            self.assertFalse(thread.is_alive())
+            self.assertEqual(errors, [])
+        # both waiters are served by a single list
+        self.assertEqual(FakeApi.lists, 1)
+
+    def test_delete(self):
+        thread, errors = self.start("a", "delete", resource_version="1")
+        FakeApi.events.put({"type": "DELETED", "object": make_deployment("a", 13)})
+        thread.join(timeout=5)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(errors, [])
+
+    def test_relist_after_gone(self):
+        FakeApi.fail_watch = [client.exceptions.ApiException(status=410)]
+        thread, errors = self.start("a", "available")
+        FakeApi.events.put(
+            {"type": "MODIFIED", "object": make_deployment("a", 20, available=True)}
+        )
+        thread.join(timeout=5)
+        self.assertEqual(errors, [])
+        self.assertEqual(FakeApi.lists, 2)
+
+    def test_linger(self):
+        Informer.LINGER_SECONDS = 0.5
+        FakeApi.objects["a"] = make_deployment("a", 1, available=True)
+        self.waiting.wait_for_namespaced_deployment("a", "default", until="available")
+        # the informer is scoped to the deployment waited for
+        self.assertEqual(FakeApi.field_selectors, ["metadata.name=a"])
+
+        # a following wait on the same deployment needs no new list
+        thread, errors = self.start_deployment_wait("a", "delete")
+        FakeApi.events.put({"type": "DELETED", "object": make_deployment("a", 13)})
+        thread.join(timeout=5)
+        self.assertEqual(errors, [])
+        self.assertEqual(FakeApi.lists, 1)
+
+        # and the informer is dropped once it has been idle for a while
+        deadline = time.time() + 5
+        while any(key[0] == id(self.apiclient) for key in list(_informers)):
+            self.assertLess(time.time(), deadline)
+            time.sleep(0.05)
+
+    def test_timeout_and_cloud_error(self):
+        with self.assertRaises(TimeoutError):
+            self.wait("a", "available", timeout_seconds=0.2)
+
+        cloud_error = {
+            "metadata": {"name": "c", "resourceVersion": "3"},
+            "status": {
+                "conditions": [
+                    {
+                        "type": "Synced",
+                        "status": "False",
+                        "reason": "ReconcileError",
+                        "message": "no capacity",
+                    }
+                ]
+            },
+        }
+        FakeApi.events.put({"type": "ADDED", "object": cloud_error})
+        with self.assertRaises(CloudError):
+            self.wait("c", "ready", timeout_seconds=5)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,95 @@
+import os
+import tempfile
+import unittest
+
+from fmperf.loadgen.workload_cache import (
+    Journal,
+    get_cache_key,
+    is_up_to_date,
+    load_cache,
+    load_journal,
+    store_cache,
+    write_stamp,
+)
+
+
+class TestWorkloadCache(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.params = {
+            "workload": {"min_in_tokens": 10, "max_in_tokens": 20},
+            "model_id": "ibm-granite/granite-3.0-8b-instruct",
+            "tokenizer_name": "ibm-granite/granite-3.0-8b-instruct",
+            "tokenizer_revision": "abc123",
+            "seed_text": "0" * 64,
+            "target": "vllm",
+        }
+
+    def test_key_is_content_addressed(self):
+        key = get_cache_key(self.params)
+        self.assertEqual(key, get_cache_key(dict(reversed(self.params.items()))))
+
+        for field, value in [
+            ("model_id", "other-model"),
+            ("tokenizer_name", "other-tokenizer"),
+            ("tokenizer_revision", "def456"),
+            ("seed_text", "1" * 64),
+            ("target", "tgis"),
+        ]:
+            params = dict(self.params, **{field: value})
+            self.assertNotEqual(key, get_cache_key(params))
+
+    def test_miss(self):
+        key = get_cache_key(self.params)
+        self.assertEqual(load_cache(self.cache_dir, key), {})
+
+    def test_partial_match_is_extended(self):
+        key = get_cache_key(self.params)
+        store_cache(self.cache_dir, key, self.params, {0: {"a": 0}, 1: {"a": 1}})
+        store_cache(self.cache_dir, key, self.params, {2: {"a": 2}})
+
+        cases = load_cache(self.cache_dir, key)
+        self.assertEqual(sorted(cases), [0, 1, 2])
+        self.assertEqual(cases[2], {"a": 2})
+        self.assertEqual(os.listdir(self.cache_dir), ["workload-%s.json" % (key)])
+
+    def test_stamp(self):
+        key = get_cache_key(self.params)
+        with open(os.path.join(self.cache_dir, "requests.json"), "w") as f:
+            f.write("[]")
+        # written by another tool or an older version
+        self.assertFalse(is_up_to_date(self.cache_dir, "requests.json", key, 10))
+
+        write_stamp(self.cache_dir, "requests.json", key, 10)
+        self.assertTrue(is_up_to_date(self.cache_dir, "requests.json", key, 10))
+        # stale: written for other parameters or another sample size
+        other_key = get_cache_key(dict(self.params, target="tgis"))
+        self.assertFalse(is_up_to_date(self.cache_dir, "requests.json", other_key, 10))
+        self.assertFalse(is_up_to_date(self.cache_dir, "requests.json", key, 20))
+
+    def test_journal_resume(self):
+        key = get_cache_key(self.params)
+        journal_file = os.path.join(self.cache_dir, "requests.json.journal")
+
+        journal = Journal(journal_file, key)
+        journal.append(0, {"a": 0})
+        journal.append(3, {"a": 3})
+        journal.close()
+
+        # simulate a crash in the middle of writing a record
+        with open(journal_file, "a") as f:
+            f.write('{"sample_idx": 4, "ca')
+
+        journal = Journal(journal_file, key)
+        self.assertEqual(journal.cases, {0: {"a": 0}, 3: {"a": 3}})
+        journal.append(4, {"a": 4})
+        journal.close()
+        self.assertEqual(sorted(load_journal(journal_file, key)), [0, 3, 4])
+
+        # journals written for other workloads are not resumed
+        other_key = get_cache_key(dict(self.params, target="tgis"))
+        self.assertEqual(Journal(journal_file, other_key).cases, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
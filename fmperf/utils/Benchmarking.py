@@ -8,6 +8,7 @@ from fmperf.StackSpec import StackSpec
 from fmperf.DeployedModel import DeployedModel
 from fmperf.WorkloadSpecs import WorkloadSpec, GuideLLMWorkloadSpec
 from fmperf.utils import parse_results
+from fmperf.utils.Scheduling import Scheduler, get_free_gpus
 
 
 def _run_benchmark_iteration(
@@ -20,10 +21,12 @@ def _run_benchmark_iteration(
     id,
     rep,
     delete_job=False,
+    parallelism=1,
 ):
     """Helper function to run a single benchmark iteration."""
     print(f"Performing sweep with {workload.file}")
     results = []
+    energy = []
 
     if isinstance(workload_spec, GuideLLMWorkloadSpec):
         output, _ = cluster.evaluate(
@@ -37,21 +40,72 @@ def _run_benchmark_iteration(
         if output is not None:
             results.extend(output)
     else:
-        for num_users in number_users:
-            output, _ = cluster.evaluate(
+        # all points of the sweep are run by a single job (fmperf.loadgen.sweep)
+        output, energy_out = cluster.evaluate(
+            model,
+            workload,
+            num_users=list(number_users),
+            duration=duration,
+            id=id,
+            delete_job=delete_job,
+            parallelism=parallelism,
+        )
+        if output is not None:
+            results.extend(output)
+        if energy_out:
+            energy.extend(energy_out)
+
+    if len(results) > 0:
+        df = parse_results(results, print_df=True, energy=energy or None)
+        df.to_csv(f"fmperf-{id}-result{rep}.csv")
+        return df
+    return None
+
+
+def _benchmark_model(
+    cluster,
+    spec,
+    workload_spec,
+    repetition,
+    number_users,
+    duration,
+    id,
+    delete_job=False,
+    parallelism=1,
+):
+    """Deploy a model, benchmark it and delete it again; returns its results."""
+    dfs = []
+    # Deploy the model
+    model = cluster.deploy_model(spec, id)
+    try:
+        # Run benchmarks
+        workload = cluster.generate_workload(model, workload_spec, id=id)
+        for rep in range(repetition):
+            df = _run_benchmark_iteration(
+                cluster,
                 model,
                 workload,
-                num_users=num_users,
-                duration=duration,
-                id=id,
-                delete_job=delete_job,
+                workload_spec,
+                number_users,
+                duration,
+                id,
+                rep,
+                delete_job,
+                parallelism,
             )
-            if output is not None:
-                results.extend(output)
+            if df is not None:
+                dfs.append(_label_results(df, model.name, rep))
+    finally:
+        # Always clean up model deployment
+        cluster.delete_model(model)
+    return dfs
 
-    if len(results) > 0:
-        df = parse_results(results, print_df=True)
-        df.to_csv(f"fmperf-{id}-result{rep}.csv")
+
+def _label_results(df, model_name, rep):
+    df = df.rename_axis("exp_num_users").reset_index()
+    df.insert(0, "rep", rep)
+    df.insert(0, "model", model_name)
+    return df
 
 
 # Run benchmark for models or stack deployment
@@ -65,7 +119,10 @@ def run_benchmark(
     duration: Optional[str] = "10s",
     id: str = "",
     delete_job: bool = False,
-) -> None:
+    parallelism: int = 1,
+    max_concurrent: int = 1,
+    dry_run: bool = False,
+) -> Optional[pd.DataFrame]:
     """Run benchmarking against either a model deployment or an existing stack deployment.
 
     Args:
@@ -78,6 +135,14 @@ def run_benchmark(
         duration: Duration of each benchmark run (ignored for GuideLLMWorkloadSpec)
         id: Optional identifier for the benchmark run
         delete_job: When True, deletes the job and its logs after evaluation
+        parallelism: Number of load generator pods sharing the users (requires a workload PVC)
+        max_concurrent: Maximum number of model specs deployed and benchmarked at the same time,
+            subject to the free GPUs of the cluster
+        dry_run: When True, only prints the schedule of the model specs
+
+    Returns:
+        The results of all model specs and repetitions in one table (also written to
+        fmperf-{id}-results.csv), or None if there are no results
     """
     if model_spec is not None and stack_spec is not None:
         raise ValueError("Cannot specify both model_spec and stack_spec. Choose one.")
@@ -90,39 +155,47 @@ def run_benchmark(
     if not isinstance(number_users, list):
         number_users = [number_users]
 
+    dfs = []
     if model_spec is not None:
         # Handle model deployment case
         if not isinstance(model_spec, list):
             model_spec = [model_spec]
 
-        for spec in model_spec:
-            # Deploy the model
-            model = cluster.deploy_model(spec, id)
-            try:
-                # Run benchmarks
-                workload = cluster.generate_workload(model, workload_spec, id=id)
-                for rep in range(repetition):
-                    _run_benchmark_iteration(
-                        cluster,
-                        model,
-                        workload,
-                        workload_spec,
-                        number_users,
-                        duration,
-                        id,
-                        rep,
-                        delete_job,
-                    )
-            finally:
-                # Always clean up model deployment
-                cluster.delete_model(model)
+        # the models are deployed concurrently as far as the free GPUs allow;
+        # one at a time needs no capacity (nor the RBAC to list the nodes)
+        nodes = get_free_gpus(cluster.apiclient) if max_concurrent > 1 else None
+        scheduler = Scheduler(nodes, max_concurrent)
+        if dry_run:
+            scheduler.print_plan(model_spec)
+            return None
+
+        def benchmark(i, spec):
+            # every spec gets its own deployment, service and jobs
+            spec_id = id if len(model_spec) == 1 else f"{id}-{i}"
+            return _benchmark_model(
+                cluster,
+                spec,
+                workload_spec,
+                repetition,
+                number_users,
+                duration,
+                spec_id,
+                delete_job,
+                parallelism,
+            )
+
+        for out in scheduler.run(model_spec, benchmark):
+            dfs.extend(out)
     else:
+        if dry_run:
+            print(">> benchmarking the existing stack %s" % (stack_spec.name))
+            return None
         # Handle stack case - no deployment needed
         stack_spec.refresh_models()
         # Run benchmarks directly with stack_spec
         workload = cluster.generate_workload(stack_spec, workload_spec, id=id)
         for rep in range(repetition):
-            _run_benchmark_iteration(
+            df = _run_benchmark_iteration(
                 cluster,
                 stack_spec,
                 workload,
@@ -132,4 +205,14 @@ def run_benchmark(
                 id,
                 rep,
                 delete_job,
+                parallelism,
             )
+            if df is not None:
+                dfs.append(_label_results(df, stack_spec.name, rep))
+
+    if len(dfs) == 0:
+        return None
+
+    df = pd.concat(dfs, ignore_index=True)
+    df.to_csv(f"fmperf-{id}-results.csv", index=False)
+    return df
@@ -143,6 +143,32 @@ class Deleting:
                 until="delete",
             )
 
+    def delete_namespaced_pod(self, name, namespace, wait=True):
+        try:
+            manifest = client.CoreV1Api(self.apigetter()).read_namespaced_pod(
+                name, namespace
+            )
+            exists = True
+        except:
+            exists = False
+
+        if not exists:
+            return
+
+        self.logger.info("deleting namespaced pod: %s %s" % (name, namespace))
+
+        client.CoreV1Api(self.apigetter()).delete_namespaced_pod(
+            name, namespace, grace_period_seconds=0
+        )
+
+        if wait:
+            self.waiting.wait_for_namespaced_pod(
+                name,
+                namespace,
+                until="delete",
+                resource_version=manifest.metadata.resource_version,
+            )
+
     def delete_namespaced_job(self, name, namespace, wait=True):
         try:
             manifest = client.BatchV1Api(self.apigetter()).read_namespaced_job(
@@ -0,0 +1,133 @@
+from kubernetes import client
+from kubernetes.stream import stream
+from fmperf.utils import Waiting, Deleting
+from fmperf.loadgen.results_file import GZIP_SUFFIX, CHECKSUM_SUFFIX, decode_results
+import base64
+import shlex
+
+# bytes read per exec call; kept well below the websocket frame limits of the API server
+FETCH_CHUNK_SIZE = 4 * 1024 * 1024
+
+
+class Fetching:
+    """
+    Retrieve files from a workload volume. A short-lived pod mounting the
+    volume is started (on a given node, so that hostPath volumes resolve to
+    the same directory) and the file is read in base64-encoded chunks over
+    exec, rather than pushing it through the pod log endpoint.
+    """
+
+    def __init__(self, apigetter, logger):
+        self.apigetter = apigetter
+        self.logger = logger
+        self.waiting = Waiting(apigetter, logger)
+        self.deleting = Deleting(apigetter, logger)
+
+    def _exec(self, name, namespace, command):
+        return stream(
+            client.CoreV1Api(self.apigetter()).connect_get_namespaced_pod_exec,
+            name,
+            namespace,
+            command=["/bin/sh", "-c", command],
+            stderr=False,
+            stdin=False,
+            stdout=True,
+            tty=False,
+        )
+
+    def create_fetch_pod(
+        self,
+        name,
+        namespace,
+        image,
+        volumes,
+        volume_mounts,
+        node_name=None,
+        security_context=None,
+        active_deadline_seconds=3600,
+    ):
+        manifest = {
+            "apiVersion": "v1",
+            "kind": "Pod",
+            "metadata": {"name": name, "namespace": namespace},
+            "spec": {
+                "containers": [
+                    {
+                        "name": "fetch",
+                        "image": image,
+                        "command": ["sleep", str(active_deadline_seconds)],
+                        "volumeMounts": volume_mounts,
+                        "securityContext": security_context,
+                    }
+                ],
+                "restartPolicy": "Never",
+                # the pod is removed after fetching; this bounds its lifetime otherwise
+                "activeDeadlineSeconds": active_deadline_seconds,
+                "volumes": volumes,
+            },
+        }
+        if node_name is not None:
+            manifest["spec"]["nodeName"] = node_name
+
+        self.logger.info("creating fetch pod: %s %s" % (name, namespace))
+        client.CoreV1Api(self.apigetter()).create_namespaced_pod(namespace, manifest)
+        self.waiting.wait_for_namespaced_pod(name, namespace, until="ready")
+
+    def read_file(self, name, namespace, path, chunk_size=FETCH_CHUNK_SIZE) -> bytes:
+        """Read `path` from the running fetch pod `name`."""
+        size = int(self._exec(name, namespace, "stat -c %%s %s" % (shlex.quote(path))))
+
+        chunks = []
+        for i in range((size + chunk_size - 1) // chunk_size):
+            out = self._exec(
+                name,
+                namespace,
+                "dd if=%s bs=%d skip=%d count=1 2>/dev/null | base64 -w0"
+                % (shlex.quote(path), chunk_size, i),
+            )
+            chunks.append(base64.b64decode(out))
+
+        data = b"".join(chunks)
+        if len(data) != size:
+            raise IOError(
+                "incomplete read of %s: %d of %d bytes" % (path, len(data), size)
+            )
+        return data
+
+    def fetch_results(
+        self,
+        name,
+        namespace,
+        paths,
+        image,
+        volumes,
+        volume_mounts,
+        node_name=None,
+        security_context=None,
+    ) -> list:
+        """
+        Fetch the results files (written by
+        fmperf.loadgen.results_file.write_results) at `paths` through a single
+        fetch pod and verify them against their checksums.
+        """
+        self.create_fetch_pod(
+            name,
+            namespace,
+            image,
+            volumes,
+            volume_mounts,
+            node_name=node_name,
+            security_context=security_context,
+        )
+        try:
+            outs = []
+            for path in paths:
+                digest = self.read_file(name, namespace, path + CHECKSUM_SUFFIX)
+                compressed = self.read_file(name, namespace, path + GZIP_SUFFIX)
+                self.logger.info(
+                    "fetched %s (%d bytes compressed)" % (path, len(compressed))
+                )
+                outs.append(decode_results(compressed, digest.decode("utf-8")))
+            return outs
+        finally:
+            self.deleting.delete_namespaced_pod(name, namespace, wait=False)
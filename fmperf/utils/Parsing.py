@@ -3,10 +3,41 @@ import pandas as pd
 pd.set_option("future.no_silent_downcasting", True)
 
 
-def parse_results(results, print_df=False, print_csv=False):
+def weighted_mean(df, column, by="exp_num_users"):
+    """
+    Mean of `column` per group, weighted by the importance weights of the
+    sampled requests so that conditionally or stratified sampled workloads
+    are re-weighted to the full request distribution.
+    """
+    num = (df[column] * df["weight"]).groupby(df[by]).sum()
+    return num / df["weight"].groupby(df[by]).sum()
+
+
+def get_energy(energy) -> pd.Series:
+    """
+    Total energy (J) per number of users from the energy summaries of one or
+    more runs, as written by fmperf.loadgen.run ({"num_users": {...},
+    "energy": {...}}) or as returned by summarize_energy.
+    """
+    if not isinstance(energy, list):
+        energy = [energy]
+    frames = [pd.DataFrame(e) for e in energy if e is not None and len(e) > 0]
+    frames = [df for df in frames if {"num_users", "energy"} <= set(df.columns)]
+    if len(frames) == 0:
+        return pd.Series(dtype=float)
+    df = pd.concat(frames)
+    return df.groupby(df["num_users"].astype(int))["energy"].sum(min_count=1)
+
+
+def parse_results(results, print_df=False, print_csv=False, energy=None):
     df = pd.DataFrame.from_dict(results, orient="columns")
     df = df.set_index("timestamp").sort_index()
 
+    # results of older versions carry no importance weights
+    if "weight" not in df.columns:
+        df["weight"] = 1.0
+    df["weight"] = df["weight"].fillna(1.0)
+
     df_out = pd.DataFrame(index=df["exp_num_users"].unique())
 
     # count total number of requests
@@ -47,9 +78,12 @@ def parse_results(results, print_df=False, print_csv=False):
     if df.shape[0] == 0:
         return df_out
 
-    # percetnage of consistent responses
-    df["consistent"] = df["consistent"].astype(int)
-    df_out["consistent_pct"] = 100 * df.groupby(["exp_num_users"])["consistent"].mean()
+    # percetnage of consistent responses (timing-only samples are not checked)
+    df_consistent = df[df["consistent"].notna()].copy()
+    df_consistent["consistent"] = df_consistent["consistent"].astype(int)
+    df_out["consistent_pct"] = (
+        100 * df_consistent.groupby(["exp_num_users"])["consistent"].mean()
+    )
 
     df_out["throughput"] = (
         df.groupby(["exp_num_users"])["n_tokens"].sum() / df.iloc[0]["exp_duration"]
@@ -58,18 +92,25 @@ def parse_results(results, print_df=False, print_csv=False):
     df_prefill = df[df["response_idx"] == 0]
     df_nexttoken = df[df["response_idx"] > 0]
 
-    df_out["latency_prefill_ms"] = df_prefill.groupby(["exp_num_users"])[
-        "duration_ms"
-    ].mean()
-    df_out["latency_nexttoken_ms"] = df_nexttoken.groupby(["exp_num_users"])[
-        "duration_ms"
-    ].mean()
-    df_out["latency_e2e_ms"] = (
-        df.groupby(["exp_num_users", "worker_idx", "request_idx"])["duration_ms"]
-        .sum()
-        .groupby("exp_num_users")
-        .mean()
+    df_out["latency_prefill_ms"] = weighted_mean(df_prefill, "duration_ms")
+    df_out["latency_nexttoken_ms"] = weighted_mean(df_nexttoken, "duration_ms")
+
+    df_e2e = df.groupby(["exp_num_users", "worker_idx", "request_idx"]).agg(
+        {"duration_ms": "sum", "weight": "first"}
     )
+    df_out["latency_e2e_ms"] = weighted_mean(df_e2e.reset_index(), "duration_ms")
+
+    # energy efficiency of the generated (output) tokens
+    if energy is not None:
+        df_out["energy_j"] = get_energy(energy)
+        df_out["j_per_token"] = df_out["energy_j"] / df_out["n_toks"]
+        df_out["tokens_per_j"] = df_out["n_toks"] / df_out["energy_j"]
+
+    # lateness of replayed requests w.r.t. their recorded arrival times
+    if "schedule_skew_ms" in df_prefill.columns:
+        df_out["schedule_skew_p99_ms"] = df_prefill.groupby(["exp_num_users"])[
+            "schedule_skew_ms"
+        ].quantile(0.99)
 
     with pd.option_context(
         "display.float_format",
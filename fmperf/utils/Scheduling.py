@@ -0,0 +1,214 @@
+from kubernetes import client
+import concurrent.futures
+import threading
+from typing import Optional
+
+GPU_RESOURCE = "nvidia.com/gpu"
+GPU_PRODUCT_LABEL = "nvidia.com/gpu.product"
+
+
+def get_gpu_products(affinity) -> Optional[list]:
+    """
+    GPU products a ModelSpec may be scheduled on, as required by the node
+    affinity set through `cluster_gpu_name`; None if any GPU will do.
+    """
+    node_affinity = (affinity or {}).get("nodeAffinity", {})
+    required = node_affinity.get("requiredDuringSchedulingIgnoredDuringExecution", {})
+    for term in required.get("nodeSelectorTerms", []):
+        for expression in term.get("matchExpressions", []):
+            if (
+                expression.get("key") == GPU_PRODUCT_LABEL
+                and expression.get("operator") == "In"
+            ):
+                return list(expression.get("values", []))
+    return None
+
+
+def get_free_gpus(apiclient) -> Optional[dict]:
+    """
+    Return {node name: (gpu product, number of free gpus, number of
+    allocatable gpus)} for the schedulable GPU nodes of the cluster; the GPUs
+    requested by running pods are taken off the allocatable ones where the
+    pods can be listed. Returns None (unknown
+    capacity) when nodes cannot be listed, which needs cluster-scoped RBAC,
+    or when no node reports any GPUs.
+    """
+    try:
+        node_list = client.CoreV1Api(apiclient).list_node()
+    except client.exceptions.ApiException as e:
+        if e.status == 403:
+            return None
+        raise
+
+    nodes = {}
+    for node in node_list.items:
+        if node.spec.unschedulable:
+            continue
+        allocatable = int((node.status.allocatable or {}).get(GPU_RESOURCE, 0))
+        if allocatable == 0:
+            continue
+        product = (node.metadata.labels or {}).get(GPU_PRODUCT_LABEL)
+        nodes[node.metadata.name] = (product, allocatable, allocatable)
+
+    if len(nodes) == 0:
+        # e.g. the GPU operator does not advertise its resources; deployments
+        # are left pending rather than refused
+        return None
+
+    try:
+        pods = client.CoreV1Api(apiclient).list_pod_for_all_namespaces(
+            field_selector="status.phase!=Succeeded,status.phase!=Failed"
+        )
+    except client.exceptions.ApiException:
+        # not allowed to list pods cluster-wide; assume all GPUs are free
+        return nodes
+
+    for pod in pods.items:
+        if pod.spec.node_name not in nodes:
+            continue
+        used = 0
+        for container in pod.spec.containers:
+            resources = container.resources
+            limits = (resources.limits if resources else None) or {}
+            used += int(limits.get(GPU_RESOURCE, 0))
+        product, free, allocatable = nodes[pod.spec.node_name]
+        nodes[pod.spec.node_name] = (product, max(free - used, 0), allocatable)
+
+    return nodes
+
+
+class Scheduler:
+    """
+    Run tasks for a list of ModelSpecs with at most `max_concurrent` of them
+    at a time, such that the GPUs they request (`num_gpus` of a matching
+    `cluster_gpu_name`, on a single node) fit into the free GPUs of the
+    cluster. `nodes` is the output of get_free_gpus; None (or no nodes)
+    disables the capacity check.
+
+    Specs are only refused if they exceed the allocatable GPUs of every
+    node. GPUs held by other tenants merely delay a spec: when none of our
+    own deployments is running, it is deployed anyway and stays pending in
+    Kubernetes until the GPUs are released. The GPUs are only booked
+    locally; the placement itself is left to Kubernetes.
+    """
+
+    def __init__(self, nodes: Optional[dict] = None, max_concurrent: int = 1):
+        self.nodes = nodes or None
+        self.max_concurrent = max(max_concurrent, 1)
+
+    def _get_free(self) -> Optional[dict]:
+        if self.nodes is None:
+            return None
+        return {name: (x[0], x[1]) for name, x in self.nodes.items()}
+
+    def _get_capacity(self) -> Optional[dict]:
+        if self.nodes is None:
+            return None
+        return {name: (x[0], x[2]) for name, x in self.nodes.items()}
+
+    def _find_node(self, free, spec) -> Optional[str]:
+        num_gpus = int(getattr(spec, "num_gpus", 0) or 0)
+        if free is None or num_gpus == 0:
+            return ""
+        products = get_gpu_products(spec.affinity)
+        for name, (product, n_free) in free.items():
+            if products is not None and product not in products:
+                continue
+            if n_free >= num_gpus:
+                return name
+        return None
+
+    def _book(self, free, node, spec, sign=1):
+        if free is not None and node:
+            product, n_free = free[node]
+            free[node] = (product, n_free - sign * int(getattr(spec, "num_gpus", 0)))
+
+    def plan(self, specs: list) -> list:
+        """
+        Group the specs into waves of concurrently running deployments,
+        assuming that all of them take equally long; returns a list of waves
+        of (spec index, node) pairs.
+        """
+        capacity = self._get_capacity()
+        for i, spec in enumerate(specs):
+            if self._find_node(capacity, spec) is None:
+                raise ValueError(
+                    "model spec %d (%s) requests %s GPUs which do not fit on any node"
+                    % (i, spec.shortname, getattr(spec, "num_gpus", 0))
+                )
+
+        waves = []
+        remaining = list(range(len(specs)))
+        while len(remaining) > 0:
+            free = self._get_free()
+            wave = []
+            for i in list(remaining):
+                if len(wave) == self.max_concurrent:
+                    break
+                node = self._find_node(free, specs[i])
+                if node is None:
+                    if len(wave) > 0:
+                        continue
+                    # the GPUs are held by others; wait for them in Kubernetes
+                    node = self._find_node(capacity, specs[i])
+                self._book(free, node, specs[i])
+                wave.append((i, node))
+                remaining.remove(i)
+            waves.append(wave)
+        return waves
+
+    def print_plan(self, specs: list):
+        for w, wave in enumerate(self.plan(specs)):
+            print(">> wave %d:" % (w))
+            for i, node in wave:
+                spec = specs[i]
+                print(
+                    "   [%d] %s: %s GPUs%s"
+                    % (
+                        i,
+                        spec.shortname,
+                        getattr(spec, "num_gpus", 0),
+                        " on %s (%s)" % (node, self.nodes[node][0]) if node else "",
+                    )
+                )
+
+    def run(self, specs: list, func) -> list:
+        """
+        Call func(i, spec) for every spec as soon as a slot and enough GPUs
+        are available; returns the outputs in the order of `specs`.
+        """
+        # raises if some spec can never be scheduled
+        self.plan(specs)
+
+        free = self._get_free()
+        capacity = self._get_capacity()
+        cond = threading.Condition()
+        running = [0]
+
+        def task(i, spec):
+            with cond:
+                while True:
+                    node = self._find_node(free, spec)
+                    if node is not None:
+                        break
+                    if running[0] == 0:
+                        # nothing of ours will free GPUs; the GPUs are held by
+                        # others, so wait for them in Kubernetes instead
+                        node = self._find_node(capacity, spec)
+                        break
+                    cond.wait()
+                self._book(free, node, spec)
+                running[0] += 1
+            try:
+                return func(i, spec)
+            finally:
+                with cond:
+                    self._book(free, node, spec, sign=-1)
+                    running[0] -= 1
+                    cond.notify_all()
+
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.max_concurrent
+        ) as executor:
+            futures = [executor.submit(task, i, spec) for i, spec in enumerate(specs)]
+            return [future.result() for future in futures]
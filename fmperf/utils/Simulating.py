@@ -0,0 +1,606 @@
+from kubernetes import client
+from collections import Counter
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import bisect
+import copy
+import json
+import threading
+import time
+import uuid
+
+# seconds the simulated controllers take for each step of a lifecycle
+DEFAULT_DELAYS = {
+    # deployment created -> pods ready and deployment available
+    "deployment": 1.0,
+    # pod created -> pod running and ready
+    "pod": 0.5,
+    # job pods running -> pods succeeded and job complete
+    "job": 1.0,
+    # delete requested -> object gone (pods deleted with a grace period of 0 go at once)
+    "delete": 0.5,
+}
+
+KINDS = {
+    "deployments": "Deployment",
+    "statefulsets": "StatefulSet",
+    "services": "Service",
+    "jobs": "Job",
+    "pods": "Pod",
+    "nodes": "Node",
+    "namespaces": "Namespace",
+}
+
+
+def _now():
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def _merge(target, patch):
+    # JSON merge patch (RFC 7386), which covers the strategic merge patches fmperf sends
+    for k, v in patch.items():
+        if v is None:
+            target.pop(k, None)
+        elif isinstance(v, dict) and isinstance(target.get(k), dict):
+            _merge(target[k], v)
+        else:
+            target[k] = copy.deepcopy(v)
+
+
+def _matches(object, label_selector, field_selector):
+    labels = object["metadata"].get("labels") or {}
+    for term in (label_selector or "").split(","):
+        term = term.strip()
+        if not term:
+            continue
+        if "!=" in term:
+            k, v = term.split("!=", 1)
+            if labels.get(k.strip()) == v.strip():
+                return False
+        elif "=" in term:
+            k, v = term.replace("==", "=").split("=", 1)
+            if labels.get(k.strip()) != v.strip():
+                return False
+        elif term not in labels:
+            return False
+    fields = {
+        "metadata.name": object["metadata"]["name"],
+        "metadata.namespace": object["metadata"].get("namespace"),
+    }
+    for term in (field_selector or "").split(","):
+        if "=" in term:
+            k, v = term.replace("==", "=").split("=", 1)
+            if fields.get(k.strip()) != v.strip():
+                return False
+    return True
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # every response closes its connection (see FakeApiServer._send)
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _dispatch(self, method):
+        url = urlparse(self.path)
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        body = None
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > 0:
+            body = json.loads(self.rfile.read(length))
+        try:
+            self.server.fake._handle(self, method, url.path, query, body)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def do_PATCH(self):
+        self._dispatch("PATCH")
+
+    def do_PUT(self):
+        self._dispatch("PUT")
+
+    def do_DELETE(self):
+        self._dispatch("DELETE")
+
+
+class FakeApiServer:
+    """
+    In-process stand-in for a Kubernetes API server, for exercising Cluster,
+    Creating, Deleting, Waiting and friends (through the real
+    kubernetes.client) without a cluster. It serves get, list, watch,
+    create, patch and delete on any resource, and simulates the lifecycles
+    of Deployments, Services, Jobs and Pods with the configurable `delays`.
+    `logs(pod)` returns the text (a str) logged by a pod, given as a dict,
+    and `nodes` ({name: (gpu product, number of gpus)}) become ready Nodes.
+    Exec is not supported, so Cluster needs `results_in_log` to read the
+    results from the pod logs. The number of requests per (verb, resource)
+    is counted in `requests`.
+    """
+
+    def __init__(self, delays=None, logs=None, nodes=None):
+        self.delays = dict(DEFAULT_DELAYS, **(delays or {}))
+        self.logs = logs or (lambda pod: "")
+
+        self.cond = threading.Condition()
+        # {(api prefix, plural): {(namespace, name): object}}
+        self.objects = {}
+        # [(resource version, (api prefix, plural), namespace, type, object)]
+        self.events = []
+        self.resource_version = 0
+        self.requests = Counter()
+        self.timers = []
+        self.stopped = False
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.fake = self
+        self.url = "http://127.0.0.1:%d" % (self.httpd.server_address[1])
+        self.thread = None
+
+        with self.cond:
+            for name, (product, gpus) in (nodes or {}).items():
+                self._create(
+                    ("api/v1", "nodes"),
+                    None,
+                    {
+                        "metadata": {
+                            "name": name,
+                            "labels": {
+                                "kubernetes.io/hostname": name,
+                                "nvidia.com/gpu.product": product,
+                            },
+                        },
+                        "spec": {},
+                        "status": {
+                            "allocatable": {"nvidia.com/gpu": str(gpus)},
+                            "conditions": [{"type": "Ready", "status": "True"}],
+                        },
+                    },
+                )
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        with self.cond:
+            self.stopped = True
+            self.cond.notify_all()
+        for timer in self.timers:
+            timer.cancel()
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def get_apiclient(self):
+        configuration = client.Configuration()
+        configuration.host = self.url
+        return client.ApiClient(configuration)
+
+    # -- store (callers hold self.cond) --
+
+    def _emit(self, collection, namespace, type, object):
+        self.events.append(
+            (self.resource_version, collection, namespace, type, copy.deepcopy(object))
+        )
+        self.cond.notify_all()
+
+    def _bump(self, object):
+        self.resource_version += 1
+        object["metadata"]["resourceVersion"] = str(self.resource_version)
+
+    def _create(self, collection, namespace, object):
+        metadata = object["metadata"]
+        metadata["namespace"] = namespace
+        metadata["uid"] = str(uuid.uuid4())
+        metadata["creationTimestamp"] = _now()
+        metadata["generation"] = 1
+        object["kind"] = object.get("kind") or KINDS.get(collection[1], "Object")
+        object["apiVersion"] = (
+            object.get("apiVersion") or collection[0].split("/", 1)[1]
+        )
+        self._simulate_created(collection, namespace, object)
+        self._bump(object)
+        self.objects.setdefault(collection, {})[(namespace, metadata["name"])] = object
+        self._emit(collection, namespace, "ADDED", object)
+        return object
+
+    def _update(self, collection, namespace, object):
+        self._bump(object)
+        self._emit(collection, namespace, "MODIFIED", object)
+
+    def _remove(self, collection, namespace, name):
+        object = self.objects.get(collection, {}).pop((namespace, name), None)
+        if object is None:
+            return
+        self._bump(object)
+        self._emit(collection, namespace, "DELETED", object)
+        # garbage-collect the dependents
+        uid = object["metadata"]["uid"]
+        for c, objects in self.objects.items():
+            for (ns, n), x in list(objects.items()):
+                owners = x["metadata"].get("ownerReferences") or []
+                if any(o["uid"] == uid for o in owners):
+                    self._remove(c, ns, n)
+
+    def _get(self, collection, namespace, name):
+        return self.objects.get(collection, {}).get((namespace, name))
+
+    # -- simulated controllers --
+
+    def _later(self, delay, func, *args):
+        def target():
+            with self.cond:
+                if not self.stopped:
+                    func(*args)
+
+        timer = threading.Timer(delay, target)
+        timer.daemon = True
+        self.timers.append(timer)
+        timer.start()
+
+    def _current(self, collection, object):
+        # the object unless it has been deleted (or replaced) since
+        x = self._get(
+            collection, object["metadata"]["namespace"], object["metadata"]["name"]
+        )
+        if x is None or x["metadata"]["uid"] != object["metadata"]["uid"]:
+            return None
+        return x
+
+    def _create_pod(self, owner, template, name, annotations=None):
+        spec = copy.deepcopy(template.get("spec") or {})
+        nodes = sorted(n for _, n in self.objects.get(("api/v1", "nodes"), {}))
+        spec.setdefault("nodeName", nodes[0] if nodes else "fake-node")
+        pod = {
+            "apiVersion": "v1",
+            "kind": "Pod",
+            "metadata": {
+                "name": name,
+                "labels": copy.deepcopy(
+                    (template.get("metadata") or {}).get("labels") or {}
+                ),
+                "annotations": annotations or {},
+                "ownerReferences": [
+                    {
+                        "apiVersion": owner["apiVersion"],
+                        "kind": owner["kind"],
+                        "name": owner["metadata"]["name"],
+                        "uid": owner["metadata"]["uid"],
+                    }
+                ],
+            },
+            "spec": spec,
+            "status": {"phase": "Pending"},
+        }
+        return self._create(("api/v1", "pods"), owner["metadata"]["namespace"], pod)
+
+    def _set_pod_phase(self, pod, phase):
+        pod = self._current(("api/v1", "pods"), pod)
+        if pod is None:
+            return
+        ready = "True" if phase == "Running" else "False"
+        pod["status"] = {
+            "phase": phase,
+            "conditions": [
+                {"type": "PodScheduled", "status": "True"},
+                {"type": "Ready", "status": ready},
+            ],
+        }
+        self._update(("api/v1", "pods"), pod["metadata"]["namespace"], pod)
+
+    def _deployment_available(self, deployment):
+        deployment = self._current(("apis/apps/v1", "deployments"), deployment)
+        if deployment is None:
+            return
+        replicas = deployment["spec"].get("replicas", 1)
+        name = deployment["metadata"]["name"]
+        for i in range(replicas):
+            pod = self._create_pod(
+                deployment,
+                deployment["spec"]["template"],
+                "%s-%s" % (name, uuid.uuid4().hex[:5]),
+            )
+            self._set_pod_phase(pod, "Running")
+        deployment["status"] = {
+            "replicas": replicas,
+            "readyReplicas": replicas,
+            "availableReplicas": replicas,
+            "conditions": [{"type": "Available", "status": "True"}],
+        }
+        self._update(
+            ("apis/apps/v1", "deployments"),
+            deployment["metadata"]["namespace"],
+            deployment,
+        )
+
+    def _job_complete(self, job, pods):
+        job = self._current(("apis/batch/v1", "jobs"), job)
+        if job is None:
+            return
+        for pod in pods:
+            self._set_pod_phase(pod, "Succeeded")
+        job["status"] = {
+            "succeeded": len(pods),
+            "completionTime": _now(),
+            "conditions": [{"type": "Complete", "status": "True"}],
+        }
+        self._update(("apis/batch/v1", "jobs"), job["metadata"]["namespace"], job)
+
+    def _simulate_created(self, collection, namespace, object):
+        plural = collection[1]
+        if plural == "services":
+            spec = object.setdefault("spec", {})
+            n = self.resource_version
+            spec.setdefault("clusterIP", "10.96.%d.%d" % (n // 250 % 250, n % 250 + 1))
+        elif plural == "deployments":
+            object["status"] = {
+                "conditions": [{"type": "Available", "status": "False"}]
+            }
+            self._later(self.delays["deployment"], self._deployment_available, object)
+        elif plural == "pods" and not object["metadata"].get("ownerReferences"):
+            object["status"] = {"phase": "Pending"}
+            self._later(self.delays["pod"], self._set_pod_phase, object, "Running")
+        elif plural == "jobs":
+            name = object["metadata"]["name"]
+            labels = {"controller-uid": object["metadata"]["uid"], "job-name": name}
+            object["metadata"].setdefault("labels", {}).update(labels)
+            template = copy.deepcopy(object["spec"]["template"])
+            template.setdefault("metadata", {}).setdefault("labels", {}).update(labels)
+            object["status"] = {}
+            indexed = object["spec"].get("completionMode") == "Indexed"
+            pods = []
+            for i in range(object["spec"].get("completions") or 1):
+                annotations = None
+                if indexed:
+                    annotations = {"batch.kubernetes.io/job-completion-index": str(i)}
+                pod = self._create_pod(
+                    object,
+                    template,
+                    "%s-%s%s"
+                    % (name, "%d-" % (i) if indexed else "", uuid.uuid4().hex[:5]),
+                    annotations,
+                )
+                self._later(self.delays["pod"], self._set_pod_phase, pod, "Running")
+                pods.append(pod)
+            self._later(
+                self.delays["pod"] + self.delays["job"],
+                self._job_complete,
+                object,
+                pods,
+            )
+
+    # -- http --
+
+    def _parse(self, path):
+        parts = path.strip("/").split("/")
+        if parts[0] == "api":
+            prefix, rest = "/".join(parts[:2]), parts[2:]
+        else:
+            prefix, rest = "/".join(parts[:3]), parts[3:]
+        namespace = None
+        if len(rest) >= 3 and rest[0] == "namespaces":
+            namespace, rest = rest[1], rest[2:]
+        plural = rest[0] if rest else None
+        name = rest[1] if len(rest) > 1 else None
+        subresource = rest[2] if len(rest) > 2 else None
+        return (prefix, plural), namespace, name, subresource
+
+    def _send(self, handler, status, object):
+        data = json.dumps(object).encode("utf-8")
+        handler.send_response(status)
+        handler.send_header("Content-Type", "application/json")
+        handler.send_header("Content-Length", str(len(data)))
+        handler.send_header("Connection", "close")
+        handler.end_headers()
+        handler.wfile.write(data)
+
+    def _send_error(self, handler, status, reason, message):
+        self._send(
+            handler,
+            status,
+            {
+                "kind": "Status",
+                "apiVersion": "v1",
+                "status": "Failure",
+                "message": message,
+                "reason": reason,
+                "code": status,
+            },
+        )
+
+    def _handle(self, handler, method, path, query, body):
+        collection, namespace, name, subresource = self._parse(path)
+        if method == "GET" and name is None:
+            verb = "watch" if query.get("watch", "").lower() == "true" else "list"
+        else:
+            verb = {
+                "GET": "get",
+                "POST": "create",
+                "PATCH": "patch",
+                "PUT": "update",
+                "DELETE": "delete",
+            }[method]
+        resource = collection[1] + ("/" + subresource if subresource else "")
+        self.requests[(verb, resource)] += 1
+
+        if verb == "watch":
+            return self._watch(handler, collection, namespace, query)
+        if subresource == "log":
+            return self._log(handler, namespace, name, query)
+        if subresource is not None:
+            return self._send_error(
+                handler, 404, "NotFound", "%s is not supported" % (resource)
+            )
+
+        with self.cond:
+            if verb == "list":
+                items = [
+                    copy.deepcopy(x)
+                    for (ns, n), x in sorted(self.objects.get(collection, {}).items())
+                    if (namespace is None or ns == namespace)
+                    and _matches(
+                        x, query.get("labelSelector"), query.get("fieldSelector")
+                    )
+                ]
+                kind = items[0]["kind"] if items else KINDS.get(collection[1], "")
+                return self._send(
+                    handler,
+                    200,
+                    {
+                        "kind": kind + "List",
+                        "apiVersion": collection[0].split("/", 1)[1],
+                        "metadata": {"resourceVersion": str(self.resource_version)},
+                        "items": items,
+                    },
+                )
+
+            if verb == "create":
+                name = body["metadata"]["name"]
+                if self._get(collection, namespace, name) is not None:
+                    return self._send_error(
+                        handler, 409, "AlreadyExists", "%s already exists" % (name)
+                    )
+                object = self._create(collection, namespace, copy.deepcopy(body))
+                return self._send(handler, 201, copy.deepcopy(object))
+
+            object = self._get(collection, namespace, name)
+            if object is None:
+                return self._send_error(
+                    handler, 404, "NotFound", "%s not found" % (name)
+                )
+
+            if verb == "get":
+                return self._send(handler, 200, copy.deepcopy(object))
+
+            if verb in ("patch", "update"):
+                if verb == "patch":
+                    _merge(object, body)
+                else:
+                    body["metadata"]["uid"] = object["metadata"]["uid"]
+                    object.clear()
+                    object.update(copy.deepcopy(body))
+                self._update(collection, namespace, object)
+                return self._send(handler, 200, copy.deepcopy(object))
+
+            # delete
+            grace_period = (body or {}).get(
+                "gracePeriodSeconds", query.get("gracePeriodSeconds")
+            )
+            if grace_period is not None and int(grace_period) == 0:
+                self._remove(collection, namespace, name)
+            elif object["metadata"].get("deletionTimestamp") is None:
+                object["metadata"]["deletionTimestamp"] = _now()
+                self._update(collection, namespace, object)
+                self._later(
+                    self.delays["delete"], self._remove, collection, namespace, name
+                )
+            return self._send(
+                handler,
+                200,
+                {
+                    "kind": "Status",
+                    "apiVersion": "v1",
+                    "status": "Success",
+                    "details": {
+                        "name": name,
+                        "kind": collection[1],
+                        "uid": object["metadata"]["uid"],
+                    },
+                },
+            )
+
+    def _events(self, collection, namespace, query):
+        label_selector = query.get("labelSelector")
+        field_selector = query.get("fieldSelector")
+        deadline = time.time() + float(query.get("timeoutSeconds") or 1800)
+
+        with self.cond:
+            resource_version = query.get("resourceVersion")
+            if resource_version in (None, "", "0"):
+                # a watch without a resourceVersion starts with the current state
+                events = [
+                    (None, collection, ns, "ADDED", copy.deepcopy(x))
+                    for (ns, _), x in sorted(self.objects.get(collection, {}).items())
+                ]
+                start = len(self.events)
+            else:
+                events = []
+                start = bisect.bisect_right(
+                    [e[0] for e in self.events], int(resource_version)
+                )
+
+        while True:
+            for _, c, ns, type, object in events:
+                if c != collection or (namespace is not None and ns != namespace):
+                    continue
+                if _matches(object, label_selector, field_selector):
+                    yield {"type": type, "object": object}
+            with self.cond:
+                while len(self.events) == start and not self.stopped:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return
+                    self.cond.wait(min(remaining, 1.0))
+                if self.stopped:
+                    return
+                events = self.events[start:]
+                start = len(self.events)
+
+    def _watch(self, handler, collection, namespace, query):
+        # events are sent as chunks so that the client sees each one at once
+        handler.send_response(200)
+        handler.send_header("Content-Type", "application/json")
+        handler.send_header("Transfer-Encoding", "chunked")
+        handler.send_header("Connection", "close")
+        handler.end_headers()
+        for event in self._events(collection, namespace, query):
+            data = (json.dumps(event) + "\n").encode("utf-8")
+            handler.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+            handler.wfile.flush()
+        handler.wfile.write(b"0\r\n\r\n")
+
+    def _log(self, handler, namespace, name, query):
+        collection = ("api/v1", "pods")
+        with self.cond:
+            pod = self._get(collection, namespace, name)
+            if pod is None:
+                return self._send_error(
+                    handler, 404, "NotFound", "%s not found" % (name)
+                )
+            if (pod.get("status") or {}).get("phase", "Pending") == "Pending":
+                return self._send_error(
+                    handler, 400, "BadRequest", "container is waiting to start"
+                )
+            if query.get("follow", "").lower() == "true":
+                # the stream ends once the containers have terminated
+                while not self.stopped:
+                    pod = self._get(collection, namespace, name)
+                    if pod is None or pod["status"]["phase"] != "Running":
+                        break
+                    self.cond.wait(1.0)
+            text = self.logs(copy.deepcopy(pod)) if pod is not None else ""
+
+        if query.get("tailLines") is not None:
+            text = "\n".join(text.rstrip("\n").split("\n")[-int(query["tailLines"]) :])
+        data = text.encode("utf-8")
+        handler.send_response(200)
+        handler.send_header("Content-Type", "text/plain")
+        handler.send_header("Content-Length", str(len(data)))
+        handler.send_header("Connection", "close")
+        handler.end_headers()
+        handler.wfile.write(data)
@@ -0,0 +1,248 @@
+from kubernetes import client, watch
+from collections import deque
+import gzip
+import os
+import queue
+import threading
+import time
+
+# log lines matching any of these patterns are dropped
+EXCLUDE_PATTERNS = (
+    "GET /health HTTP/1.1",
+    "GET /metrics HTTP/1.1",
+)
+
+
+class Streaming:
+    """
+    Collect the logs of many pods in-process. Every pod's log is followed
+    through its own `follow=True` stream; the lines of all pods go through a
+    single bounded queue (so that a slow disk applies backpressure to the
+    streams rather than growing memory) to a writer which drops the excluded
+    lines and appends the rest to a gzip'ed file per pod in `log_dir`. The
+    last `tail_lines` lines of every pod are also kept in memory. Lines
+    longer than `max_line_length` bytes are truncated (unless it is None).
+    The containers of pods with several containers are followed (and
+    stored) separately as "<pod>.<container>".
+    """
+
+    def __init__(
+        self,
+        apigetter,
+        logger,
+        log_dir,
+        exclude_patterns=EXCLUDE_PATTERNS,
+        tail_lines=10,
+        max_buffered_lines=10000,
+        max_line_length=1 << 20,
+    ):
+        self.apigetter = apigetter
+        self.logger = logger
+        self.log_dir = log_dir
+        self.exclude_patterns = exclude_patterns
+        self.tail_lines = tail_lines
+        self.max_line_length = max_line_length
+
+        self.lines = queue.Queue(maxsize=max_buffered_lines)
+        self.stopped = threading.Event()
+        self.lock = threading.Lock()
+        self.followers = {}
+        self.responses = {}
+        self.tails = {}
+        self.drained = {}
+        self.files = {}
+        self.watches = []
+
+        os.makedirs(log_dir, exist_ok=True)
+        self.writer = threading.Thread(target=self._write, daemon=True)
+        self.writer.start()
+
+    def _write(self):
+        while True:
+            item = self.lines.get()
+            try:
+                if item is None:
+                    return
+                pod, line = item
+                if line is None:
+                    # end of the pod's stream
+                    self.drained[pod].set()
+                    continue
+                if any(p in line for p in self.exclude_patterns):
+                    continue
+                with self.lock:
+                    self.tails[pod].append(line)
+                if pod not in self.files:
+                    self.files[pod] = gzip.open(
+                        os.path.join(self.log_dir, "%s.log.gz" % (pod)), "at"
+                    )
+                self.files[pod].write(line + "\n")
+            finally:
+                self.lines.task_done()
+
+    def _read_log(self, pod, namespace, container):
+        """
+        Return the follow stream of the pod's log once its container has
+        started, or None if it cannot be read.
+        """
+        while not self.stopped.is_set():
+            try:
+                return client.CoreV1Api(self.apigetter()).read_namespaced_pod_log(
+                    pod,
+                    namespace,
+                    container=container,
+                    follow=True,
+                    _preload_content=False,
+                )
+            except client.exceptions.ApiException as e:
+                if e.status == 404:
+                    return None
+                # 400 "is waiting to start": the container is still being
+                # created; any other client error will not go away
+                if (
+                    400 <= e.status < 500
+                    and e.status != 429
+                    and "waiting to start" not in str(e.body)
+                ):
+                    self.logger.warning(
+                        "cannot follow the log of %s: %s" % (pod, e.body or e.reason)
+                    )
+                    return None
+                time.sleep(1)
+        return None
+
+    def _extend(self, buffer, data, truncated):
+        """Append `data` to the pending line; return the number of bytes cut off."""
+        if self.max_line_length is not None:
+            room = max(self.max_line_length - len(buffer), 0)
+            truncated += max(len(data) - room, 0)
+            data = data[:room]
+        buffer += data
+        return truncated
+
+    def _put(self, pod, buffer, truncated):
+        line = buffer.decode("utf-8", errors="replace")
+        if truncated > 0:
+            line += " ... [%d bytes truncated]" % (truncated)
+        self.lines.put((pod, line))
+
+    def _follow(self, name, pod, namespace, container):
+        response = self._read_log(pod, namespace, container)
+        if response is None:
+            self.lines.put((name, None))
+            return
+        with self.lock:
+            self.responses[name] = response
+
+        # only the newly received chunk is split; the pending line is
+        # extended in place and capped at max_line_length
+        buffer = bytearray()
+        truncated = 0
+        try:
+            for chunk in response.stream(4096):
+                *lines, rest = chunk.split(b"\n")
+                for line in lines:
+                    truncated = self._extend(buffer, line, truncated)
+                    self._put(name, buffer, truncated)
+                    buffer.clear()
+                    truncated = 0
+                truncated = self._extend(buffer, rest, truncated)
+        except Exception as e:
+            # the stream is closed by stop()
+            if not self.stopped.is_set():
+                self.logger.warning("log stream of %s failed: %s" % (pod, e))
+        finally:
+            if len(buffer) > 0:
+                self._put(name, buffer, truncated)
+            response.release_conn()
+            self.lines.put((name, None))
+
+    def follow(self, pod, namespace, container=None):
+        """
+        Start following the log of `pod` (or of its `container`, stored as
+        "<pod>.<container>") unless it is followed already.
+        """
+        name = pod if container is None else "%s.%s" % (pod, container)
+        with self.lock:
+            if name in self.followers or self.stopped.is_set():
+                return
+            self.tails[name] = deque(maxlen=self.tail_lines)
+            self.drained[name] = threading.Event()
+            thread = threading.Thread(
+                target=self._follow,
+                args=(name, pod, namespace, container),
+                daemon=True,
+            )
+            self.followers[name] = thread
+        thread.start()
+
+    def follow_pod(self, pod, namespace):
+        """Follow the log of every container of `pod` (a V1Pod)."""
+        containers = [x.name for x in (pod.spec.containers or [])]
+        if len(containers) > 1:
+            for container in containers:
+                self.follow(pod.metadata.name, namespace, container)
+        else:
+            self.follow(pod.metadata.name, namespace)
+
+    def _discover(self, namespace, label_selector):
+        w = watch.Watch()
+        self.watches.append(w)
+        while not self.stopped.is_set():
+            try:
+                for event in w.stream(
+                    client.CoreV1Api(self.apigetter()).list_namespaced_pod,
+                    namespace,
+                    label_selector=label_selector,
+                    timeout_seconds=60,
+                ):
+                    if event["type"] in ("ADDED", "MODIFIED"):
+                        self.follow_pod(event["object"], namespace)
+                    if self.stopped.is_set():
+                        w.stop()
+            except Exception as e:
+                if not self.stopped.is_set():
+                    self.logger.warning(
+                        "watching pods %s failed: %s" % (label_selector, e)
+                    )
+                    time.sleep(1)
+
+    def follow_selector(self, namespace, label_selector):
+        """Follow the logs of all current and future pods matching `label_selector`."""
+        threading.Thread(
+            target=self._discover, args=(namespace, label_selector), daemon=True
+        ).start()
+
+    def tail(self, pod, timeout=60):
+        """
+        Wait for the log stream of `pod` to end (i.e. its containers have
+        terminated) and return its last lines.
+        """
+        with self.lock:
+            drained = self.drained.get(pod)
+        if drained is None:
+            return None
+        if not drained.wait(timeout):
+            self.logger.warning("log stream of %s did not end" % (pod))
+        with self.lock:
+            return list(self.tails[pod])
+
+    def stop(self, grace_period=0):
+        """Stop following after `grace_period` seconds and close the log files."""
+        if grace_period > 0:
+            time.sleep(grace_period)
+        self.stopped.set()
+        for w in self.watches:
+            w.stop()
+        with self.lock:
+            responses = list(self.responses.values())
+            followers = list(self.followers.values())
+        for response in responses:
+            response.close()
+        for thread in followers:
+            thread.join(5)
+        self.lines.put(None)
+        self.writer.join()
+        for f in self.files.values():
+            f.close()
+        self.logger.info("pod logs written to %s" % (self.log_dir))
@@ -1,14 +1,251 @@
 from kubernetes import client, watch
-import traceback
+import threading
 import time
-import json
-import urllib3
 
 
 class CloudError(Exception):
     pass
 
 
+def _to_dict(object):
+    if not isinstance(object, dict):
+        object = object.to_dict()
+    return object
+
+
+def _get_resource_version(object):
+    # models use snake_case keys, raw (custom) objects use camelCase ones
+    metadata = object["metadata"]
+    return metadata.get("resource_version") or metadata.get("resourceVersion")
+
+
+def _is_done(object, until):
+    if "status" not in object or object["status"] is None:
+        return False
+    conditions = object["status"].get("conditions")
+    if conditions is None:
+        return False
+
+    for x in conditions:
+        if until == "ready":
+            if x["type"] == "Ready" and x["status"] == "True":
+                return True
+            # handle observed ng provisioing errors on AWS
+            if (
+                x["type"] == "Synced"
+                and x["status"] == "False"
+                and x["reason"] == "ReconcileError"
+            ):
+                raise CloudError(x["message"])
+            # handle observed quota errors on Azure
+            if (
+                x["type"] == "LastAsyncOperation"
+                and x["status"] == "False"
+                and x["reason"] == "ApplyFailure"
+                and "QuotaExceeded" in x["message"]
+            ):
+                raise CloudError(x["message"])
+            # handle observed quota errors on GCP
+            if (
+                x["type"] == "LastAsyncOperation"
+                and x["status"] == "False"
+                and x["reason"] == "ApplyFailure"
+                and "error creating NodePool" in x["message"]
+            ):
+                raise CloudError(x["message"])
+            # handle issue #25
+            if (
+                x["type"] == "PodScheduled"
+                and x["status"] == "False"
+                and x["reason"] == "Unschedulable"
+                and "untolerated taint" not in x["message"]
+            ):
+                raise CloudError(x["message"])
+        elif until == "available":
+            if x["type"] == "Available" and x["status"] == "True":
+                return True
+        elif until == "complete":
+            if x["type"] == "Complete" and x["status"] == "True":
+                return True
+    return False
+
+
+class Informer:
+    """
+    Cache of the objects of one resource type (in one namespace) which is
+    kept up to date by a single list followed by a watch that resumes from
+    the last seen resourceVersion; it is re-listed only when the server no
+    longer has that version (410 Gone). Any number of waiters can subscribe;
+    they are woken up on every change and check their own object. The
+    `field_selector` limits the cache (and the watch) to the objects waited
+    for. Once the last waiter is gone, the informer lingers for
+    LINGER_SECONDS, so that consecutive waits on the same objects (e.g. for
+    completion, then for deletion) need no new list; after that its watch
+    stops and it is dropped from the shared informers.
+    """
+
+    # server-side timeout of a single watch request (it is resumed afterwards)
+    WATCH_TIMEOUT_SECONDS = 60
+    # seconds for which an informer without waiters keeps watching
+    LINGER_SECONDS = 30
+
+    def __init__(self, apigetter, api, method, args, field_selector, logger, key=None):
+        self.apigetter = apigetter
+        self.api = api
+        self.method = method
+        self.args = args
+        self.field_selector = field_selector
+        self.logger = logger
+
+        self.cond = threading.Condition()
+        self.objects = {}
+        self.resource_version = None
+        self.synced = False
+        self.subscribers = 0
+        self.idle_since = time.time()
+        self.thread = None
+        # key of the informer in _informers
+        self.key = key
+
+    def _func(self):
+        return getattr(self.api(self.apigetter()), self.method)
+
+    def _kwargs(self):
+        if self.field_selector is None:
+            return {}
+        return {"field_selector": self.field_selector}
+
+    def _list(self):
+        out = self._func()(*self.args, **self._kwargs())
+        if isinstance(out, dict):
+            items, resource_version = out["items"], out["metadata"]["resourceVersion"]
+        else:
+            items, resource_version = out.items, out.metadata.resource_version
+
+        with self.cond:
+            self.objects = {}
+            for x in items:
+                x = _to_dict(x)
+                self.objects[x["metadata"]["name"]] = x
+            self.resource_version = resource_version
+            self.synced = True
+            self.cond.notify_all()
+
+    def _watch(self):
+        w = watch.Watch()
+        for event in w.stream(
+            self._func(),
+            *self.args,
+            resource_version=self.resource_version,
+            timeout_seconds=self.WATCH_TIMEOUT_SECONDS,
+            _request_timeout=self.WATCH_TIMEOUT_SECONDS + 10,
+            allow_watch_bookmarks=True,
+            **self._kwargs()
+        ):
+            with self.cond:
+                if event["type"] == "BOOKMARK":
+                    self.resource_version = _get_resource_version(event["raw_object"])
+                else:
+                    object = _to_dict(event["object"])
+                    name = object["metadata"]["name"]
+                    if event["type"] == "DELETED":
+                        self.objects.pop(name, None)
+                    else:
+                        self.objects[name] = object
+                    self.resource_version = _get_resource_version(object)
+                    self.cond.notify_all()
+
+                if self._is_expired():
+                    w.stop()
+
+    def _is_expired(self):
+        return (
+            self.subscribers == 0
+            and time.time() - self.idle_since >= self.LINGER_SECONDS
+        )
+
+    def _run(self):
+        while True:
+            with _informers_lock, self.cond:
+                if self._is_expired():
+                    # nobody is watching; the cache goes stale from now on
+                    self.thread = None
+                    self.synced = False
+                    self.resource_version = None
+                    if _informers.get(self.key) is self:
+                        del _informers[self.key]
+                    return
+
+            try:
+                if self.resource_version is None:
+                    self._list()
+                self._watch()
+            except client.exceptions.ApiException as e:
+                if e.status == 410:
+                    # our resourceVersion is too old; start over from a fresh list
+                    with self.cond:
+                        self.resource_version = None
+                else:
+                    self.logger.warning("%s failed: %s" % (self.method, e))
+                    time.sleep(1)
+            except Exception as e:
+                self.logger.warning("%s failed: %s" % (self.method, e))
+                time.sleep(1)
+
+    def _has_seen(self, resource_version):
+        if resource_version is None or self.resource_version is None:
+            return True
+        try:
+            return int(self.resource_version) >= int(resource_version)
+        except ValueError:
+            # resource versions are opaque outside of etcd-backed servers
+            return True
+
+    def _check(self, name, until, resource_version):
+        if not self.synced:
+            return False
+        if until == "delete":
+            return name not in self.objects and self._has_seen(resource_version)
+        object = self.objects.get(name)
+        return object is not None and _is_done(object, until)
+
+    def wait(self, name, until, timeout_seconds, resource_version=None):
+        deadline = time.time() + timeout_seconds
+        with self.cond:
+            self.subscribers += 1
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+            try:
+                while not self._check(name, until, resource_version):
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise TimeoutError(
+                            "%s did not become %s within %d seconds"
+                            % (name, until, timeout_seconds)
+                        )
+                    self.cond.wait(remaining)
+            finally:
+                self.subscribers -= 1
+                if self.subscribers == 0:
+                    self.idle_since = time.time()
+
+
+# informers shared by all Waiting objects, keyed by api client and resource
+_informers = {}
+_informers_lock = threading.Lock()
+
+
+def get_informer(apigetter, api, method, args, field_selector, logger):
+    key = (id(apigetter()), api.__name__, method, tuple(args), field_selector)
+    with _informers_lock:
+        if key not in _informers:
+            _informers[key] = Informer(
+                apigetter, api, method, args, field_selector, logger, key
+            )
+        return _informers[key]
+
+
 class Waiting:
     def __init__(self, apigetter, logger):
         self.apigetter = apigetter
@@ -17,121 +254,25 @@ class Waiting:
     def _wait_for(
         self,
         name,
-        func,
+        api,
+        method,
         *args,
         until="ready",
         timeout_seconds=6400,
-        resource_version=None
+        resource_version=None,
+        field_selector=None
     ):
         if until is None:
             return
 
-        t0 = time.time()
-
-        try:
-            self.logger.info(
-                "waiting for %s until %s (%d seconds remaining)"
-                % (name, until, timeout_seconds)
-            )
-            w = watch.Watch()
-            for event in w.stream(
-                func(self.apigetter()),
-                *args,
-                timeout_seconds=timeout_seconds,
-                _request_timeout=20,
-                resource_version=resource_version
-            ):
-                object = event["object"]
-                if not isinstance(object, dict):
-                    object = object.to_dict()
-
-                if object["metadata"]["name"] != name:
-                    continue
-
-                if until == "delete":
-                    if event["type"] == "DELETED":
-                        w.stop()
-                        return
-                elif until == "ready":
-                    if "status" in object and "conditions" in object["status"]:
-                        # print(object["status"]["conditions"])
-                        if object["status"]["conditions"] is None:
-                            continue
-                        for x in object["status"]["conditions"]:
-                            if x["type"] == "Ready" and x["status"] == "True":
-                                w.stop()
-                                return
-                            # handle observed ng provisioing errors on AWS
-                            if (
-                                x["type"] == "Synced"
-                                and x["status"] == "False"
-                                and x["reason"] == "ReconcileError"
-                            ):
-                                raise CloudError(x["message"])
-                            # handle observed quota errors on Azure
-                            if (
-                                x["type"] == "LastAsyncOperation"
-                                and x["status"] == "False"
-                                and x["reason"] == "ApplyFailure"
-                                and "QuotaExceeded" in x["message"]
-                            ):
-                                raise CloudError(x["message"])
-                            # handle observed quota errors on GCP
-                            if (
-                                x["type"] == "LastAsyncOperation"
-                                and x["status"] == "False"
-                                and x["reason"] == "ApplyFailure"
-                                and "error creating NodePool" in x["message"]
-                            ):
-                                raise CloudError(x["message"])
-                            # handle issue #25
-                            if (
-                                x["type"] == "PodScheduled"
-                                and x["status"] == "False"
-                                and x["reason"] == "Unschedulable"
-                                and "untolerated taint" not in x["message"]
-                            ):
-                                raise CloudError(x["message"])
-
-                elif until == "available":
-                    if "status" in object and "conditions" in object["status"]:
-                        # print(object["status"]["conditions"])
-                        if object["status"]["conditions"] is None:
-                            continue
-                        for x in object["status"]["conditions"]:
-                            if x["type"] == "Available" and x["status"] == "True":
-                                w.stop()
-                                return
-                elif until == "complete":
-                    if "status" in object and "conditions" in object["status"]:
-                        # print(object["status"]["conditions"])
-                        if object["status"]["conditions"] is None:
-                            continue
-                        for x in object["status"]["conditions"]:
-                            if x["type"] == "Complete" and x["status"] == "True":
-                                w.stop()
-                                return
-        except CloudError as e:
-            retry = False
-            err = e
-        except Exception as e:
-            retry = True
-            if isinstance(e, urllib3.exceptions.ReadTimeoutError):
-                # pynisher cannot handle this kind of exception; need to remap
-                err = TimeoutError("Client-side watch timeout")
-            else:
-                err = e
-        else:
-            # we can only reach here in case of server-side timeout
-            retry = False
-            err = TimeoutError("Server-side watch timeout")
-
-        t_remaining = int(timeout_seconds - time.time() + t0)
-
-        if retry and t_remaining >= 1:
-            self._wait_for(name, func, *args, until=until, timeout_seconds=t_remaining)
-        else:
-            raise err
+        self.logger.info(
+            "waiting for %s until %s (%d seconds remaining)"
+            % (name, until, timeout_seconds)
+        )
+        informer = get_informer(
+            self.apigetter, api, method, args, field_selector, self.logger
+        )
+        informer.wait(name, until, timeout_seconds, resource_version)
 
     def wait_for_node(
         self,
@@ -141,9 +282,11 @@ class Waiting:
     ):
         self._wait_for(
             name,
-            lambda x: client.CoreV1Api(x).list_node,
+            client.CoreV1Api,
+            "list_node",
             until=until,
             timeout_seconds=timeout_seconds,
+            field_selector="metadata.name=%s" % (name),
         )
 
     def wait_for_cluster_custom_object(
@@ -157,12 +300,14 @@ class Waiting:
     ):
         self._wait_for(
             name,
-            lambda x: client.CustomObjectsApi(x).list_cluster_custom_object,
+            client.CustomObjectsApi,
+            "list_cluster_custom_object",
             group,
             version,
             plural,
             until=until,
             timeout_seconds=timeout_seconds,
+            field_selector="metadata.name=%s" % (name),
         )
 
     def wait_for_namespaced_custom_object(
@@ -176,12 +321,14 @@ class Waiting:
     ):
         self._wait_for(
             name,
-            lambda x: client.CustomObjectsApi(x).list_namespaced_custom_object,
+            client.CustomObjectsApi,
+            "list_namespaced_custom_object",
             group,
             version,
             namespace,
             plural,
             until=until,
+            field_selector="metadata.name=%s" % (name),
         )
 
     def wait_for_namespaced_deployment(
@@ -189,9 +336,11 @@ class Waiting:
     ):
         self._wait_for(
             name,
-            lambda x: client.AppsV1Api(x).list_namespaced_deployment,
+            client.AppsV1Api,
+            "list_namespaced_deployment",
             namespace,
             until=until,
+            field_selector="metadata.name=%s" % (name),
             resource_version=resource_version,
         )
 
@@ -202,22 +351,45 @@ class Waiting:
         for x in out.items:
             pods.append(x.metadata.name)
 
+        # all pods of the namespace share one informer
         for name in pods:
             self._wait_for(
                 name,
-                lambda x: client.CoreV1Api(x).list_namespaced_pod,
+                client.CoreV1Api,
+                "list_namespaced_pod",
                 namespace,
                 until=until,
             )
 
+    def wait_for_namespaced_pod(
+        self,
+        name: str,
+        namespace: str,
+        until="ready",
+        timeout_seconds=1800,
+        resource_version=None,
+    ):
+        self._wait_for(
+            name,
+            client.CoreV1Api,
+            "list_namespaced_pod",
+            namespace,
+            until=until,
+            field_selector="metadata.name=%s" % (name),
+            timeout_seconds=timeout_seconds,
+            resource_version=resource_version,
+        )
+
     def wait_for_namespaced_service(
         self, name: str, namespace: str, until="delete", resource_version=None
     ):
         self._wait_for(
             name,
-            lambda x: client.CoreV1Api(x).list_namespaced_service,
+            client.CoreV1Api,
+            "list_namespaced_service",
             namespace,
             until=until,
+            field_selector="metadata.name=%s" % (name),
             resource_version=resource_version,
         )
 
@@ -226,9 +398,11 @@ class Waiting:
     ):
         self._wait_for(
             name,
-            lambda x: client.AppsV1Api(x).list_namespaced_stateful_set,
+            client.AppsV1Api,
+            "list_namespaced_stateful_set",
             namespace,
             until=until,
+            field_selector="metadata.name=%s" % (name),
         )
 
     def wait_for_namespaced_job(
@@ -240,8 +414,10 @@ class Waiting:
     ):
         self._wait_for(
             name,
-            lambda x: client.BatchV1Api(x).list_namespaced_job,
+            client.BatchV1Api,
+            "list_namespaced_job",
             namespace,
             until=until,
+            field_selector="metadata.name=%s" % (name),
             resource_version=resource_version,
         )
@@ -1,6 +1,27 @@
-from fmperf.utils.Waiting import Waiting
-from fmperf.utils.Creating import Creating
-from fmperf.utils.Deleting import Deleting
-from fmperf.utils.Logging import make_logger
-from fmperf.utils.Parsing import parse_results
-from fmperf.utils.Benchmarking import run_benchmark
+from typing import TYPE_CHECKING
+
+from fmperf.utils.lazy import make_lazy
+
+make_lazy(
+    __name__,
+    {
+        "Waiting": "Waiting",
+        "Creating": "Creating",
+        "Deleting": "Deleting",
+        "Fetching": "Fetching",
+        "Streaming": "Streaming",
+        "make_logger": "Logging",
+        "parse_results": "Parsing",
+        "run_benchmark": "Benchmarking",
+    },
+)
+
+if TYPE_CHECKING:
+    from fmperf.utils.Waiting import Waiting
+    from fmperf.utils.Creating import Creating
+    from fmperf.utils.Deleting import Deleting
+    from fmperf.utils.Fetching import Fetching
+    from fmperf.utils.Streaming import Streaming
+    from fmperf.utils.Logging import make_logger
+    from fmperf.utils.Parsing import parse_results
+    from fmperf.utils.Benchmarking import run_benchmark
@@ -0,0 +1,46 @@
+import importlib
+import sys
+import types
+
+
+class LazyModule(types.ModuleType):
+    """
+    Package whose exports are imported on first access (PEP 562). Importing
+    a submodule binds it on its package, which for an export named like its
+    submodule (fmperf.Cluster.Cluster) would shadow the export; bind the
+    export instead, as the eager `from .Cluster import Cluster` did.
+    """
+
+    def __setattr__(self, name, value):
+        if (
+            isinstance(value, types.ModuleType)
+            and self.__lazy_exports__.get(name) == name
+            and value.__name__ == "%s.%s" % (self.__name__, name)
+            and hasattr(value, name)
+        ):
+            value = getattr(value, name)
+        super().__setattr__(name, value)
+
+
+def make_lazy(package: str, exports: dict):
+    """
+    Import the exports of `package` lazily; `exports` maps the name of every
+    export to the submodule which defines it.
+    """
+    module = sys.modules[package]
+
+    def __getattr__(name):
+        if name not in exports:
+            raise AttributeError("module %r has no attribute %r" % (package, name))
+        value = getattr(importlib.import_module("." + exports[name], package), name)
+        setattr(module, name, value)
+        return value
+
+    def __dir__():
+        return sorted(set(module.__dict__) | set(exports))
+
+    module.__lazy_exports__ = exports
+    module.__all__ = list(exports)
+    module.__getattr__ = __getattr__
+    module.__dir__ = __dir__
+    module.__class__ = LazyModule